@@ -0,0 +1,170 @@
+# anomaly_detector.py - Streaming Latency, Token and Cost Anomaly Detection
+#
+# Keeps an exponentially weighted mean and variance of each request's
+# latency, prompt tokens, completion tokens and cost per model - O(1) time
+# and a few floats per model and metric - and flags a request whose value
+# sits more than THRESHOLD standard deviations above its model's usual
+# level. Values are tracked as logarithms, so a baseline means "typical
+# size and spread" for a cheap fast model and an expensive slow one alike,
+# and an alert reads as "5.1x the usual". Alerts are returned to the caller
+# (for the terminal and web page) and appended to anomalies.log
+# Used by: cost_tracking.py (CostTracker), web_chat.py, async_chat.py, model_compare.py
+# Dependencies: none (standard library only)
+
+import datetime
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+THRESHOLD = 4.0     # Standard deviations above the usual level that count as an anomaly
+ALPHA = 0.05        # EWMA weight of each new request (roughly the last 40 requests matter)
+WARMUP = 20         # Requests per model and metric before alerts are raised
+MIN_SPREAD = 0.1    # Floor on the log-space deviation, so steady metrics don't alert on 30% blips
+COOLDOWN = 60.0     # Seconds between repeated alerts for the same model and metric
+LABELS = {"latency": "latency", "prompt_tokens": "prompt", "completion_tokens": "reply", "cost": "cost"}
+
+def upstream_seconds(timings_ms: Optional[Dict[str, float]]) -> Optional[float]:
+    """Upstream time of a request from its phase timings (blocking 'upstream', or streaming 'connect' + 'generate')"""
+    if not timings_ms:
+        return None
+    if "upstream" in timings_ms:
+        return timings_ms["upstream"] / 1000
+    if "generate" in timings_ms:
+        return (timings_ms.get("connect", 0) + timings_ms["generate"]) / 1000
+    return None
+
+def describe_value(metric: str, value: float) -> str:
+    if metric == "latency":
+        return f"{value:.2f}s"
+    if metric == "cost":
+        return f"${value:.6f}"
+    return f"{value:,.0f} tokens"
+
+class EwmaStats:
+    """Exponentially weighted mean and variance of one metric's log values"""
+    __slots__ = ("count", "mean", "var")
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.var = 0.0
+
+    def update(self, x: float, alpha: float):
+        self.count += 1
+        # A plain running average until 1/count drops below alpha, so the first values aren't overweighted
+        weight = max(alpha, 1.0 / self.count)
+        diff = x - self.mean
+        self.mean += weight * diff
+        self.var = (1 - weight) * (self.var + weight * diff * diff)
+
+    def spread(self) -> float:
+        return max(math.sqrt(self.var), MIN_SPREAD)
+
+class AnomalyDetector:
+    """Per-model baselines of latency, tokens and cost that flag sudden jumps"""
+
+    def __init__(self, threshold: float = THRESHOLD, alpha: float = ALPHA, warmup: int = WARMUP,
+                 cooldown: float = COOLDOWN, log_file: Optional[str] = "anomalies.log", history: int = 50):
+        self.threshold = threshold
+        self.alpha = alpha
+        self.warmup = warmup
+        self.cooldown = cooldown
+        self.log_file = log_file
+        self.stats: Dict[tuple, EwmaStats] = {}    # (model, metric) -> baseline
+        self.last_alert: Dict[tuple, float] = {}
+        self.recent = deque(maxlen=history)
+        self.alerts = 0
+        self.suppressed = 0  # Anomalies inside a cooldown, counted but not reported again
+        self.lock = threading.Lock()
+
+    def _update(self, model: str, metric: str, value: float, now: Optional[float]) -> Optional[dict]:
+        # now=None learns without alerting (seeding from the log)
+        key = (model, metric)
+        stats = self.stats.get(key)
+        if stats is None:
+            stats = self.stats[key] = EwmaStats()
+        x = math.log(value)
+        alert = None
+        if stats.count >= self.warmup:
+            spread = stats.spread()
+            z = (x - stats.mean) / spread
+            if z >= self.threshold:
+                if now is not None:
+                    if now - self.last_alert.get(key, 0.0) >= self.cooldown:
+                        self.last_alert[key] = now
+                        usual = math.exp(stats.mean)
+                        ratio = value / usual
+                        alert = {"time": datetime.datetime.fromtimestamp(now).isoformat(), "model": model,
+                                 "metric": metric, "value": value, "usual": usual, "ratio": round(ratio, 2),
+                                 "z": round(z, 1),
+                                 "message": f"{LABELS.get(metric, metric)} {describe_value(metric, value)} is "
+                                            f"{ratio:.1f}x the usual {describe_value(metric, usual)} "
+                                            f"for {model} (z={z:.1f})"}
+                    else:
+                        self.suppressed += 1
+                # An outlier moves the baseline only as far as the threshold, so one spike can't
+                # hide the next; a lasting shift still becomes the new normal within a few dozen requests
+                x = stats.mean + self.threshold * spread
+        stats.update(x, self.alpha)
+        return alert
+
+    def observe(self, model: str, **values: Optional[float]) -> List[dict]:
+        """Check a finished request against its model's baselines, then learn from it
+
+        Keyword arguments are metric values (latency in seconds); None or
+        non-positive values are skipped. Returns the alerts raised, if any.
+        """
+        now = time.time()
+        found = []
+        with self.lock:
+            for metric, value in values.items():
+                if value is None or value <= 0:
+                    continue
+                alert = self._update(model, metric, float(value), now)
+                if alert:
+                    found.append(alert)
+            self.alerts += len(found)
+            self.recent.extend(found)
+        if found and self.log_file:
+            self._write(found)
+        return found
+
+    def learn(self, entry: dict):
+        """Seed baselines from one chat_costs.log record without raising alerts"""
+        model = entry.get("model")
+        if not model:
+            return
+        values = {"latency": upstream_seconds(entry.get("timings_ms")),
+                  "prompt_tokens": entry.get("prompt_tokens"), "completion_tokens": entry.get("completion_tokens"),
+                  "cost": entry.get("cost_usd")}
+        with self.lock:
+            for metric, value in values.items():
+                if isinstance(value, (int, float)) and value > 0:
+                    self._update(model, metric, float(value), None)
+
+    def _write(self, alerts: List[dict]):
+        try:
+            # One O_APPEND write, like the cost log, so several processes can share the file
+            data = "".join(json.dumps(alert) + "\n" for alert in alerts).encode("utf-8")
+            fd = os.open(self.log_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+        except OSError as e:
+            print(f"Could not log anomaly: {e}")
+
+    def snapshot(self, recent: int = 20) -> dict:
+        """Baselines per model and the latest alerts, for /metrics"""
+        with self.lock:
+            baselines: Dict[str, dict] = {}
+            for (model, metric), stats in self.stats.items():
+                baselines.setdefault(model, {})[metric] = {
+                    "usual": round(math.exp(stats.mean), 6), "spread": round(math.exp(stats.spread()), 3),
+                    "samples": stats.count}
+            return {"alerts": self.alerts, "suppressed": self.suppressed, "threshold": self.threshold,
+                    "recent": list(self.recent)[-recent:], "baselines": baselines}
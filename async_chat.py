@@ -0,0 +1,401 @@
+# async_chat.py - Non-blocking Terminal Chat with Conversation Tabs
+#
+# asyncio version of the chat_with_costs.py terminal loop. Input is read on
+# a background thread, so you can keep typing while replies stream in.
+# Ctrl-C cancels the reply being generated (closing the upstream request so
+# spend stops) instead of exiting. Several named conversations ("tabs") run
+# concurrently, each with its own history, model and CostTracker totals;
+# replies in background tabs are held until you switch to them
+# Used by: chat_with_costs.py --tabs
+# Dependencies: pip install openai
+
+import asyncio
+import signal
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+from openai import AsyncOpenAI
+
+from anomaly_detector import AnomalyDetector, upstream_seconds
+from budget import BudgetExceeded
+from chat_with_costs import MAX_TOKENS, budgets, client, estimator
+from cost_tracking import MODEL_PRICING, CostTracker
+from max_tokens_tuner import MaxTokensTuner
+from model_cache import ModelCache
+from phase_timer import PhaseTimer, phase_stats
+from traffic_capture import anonymize, capture
+
+HISTORY_LIMIT = 20  # Messages of context kept per tab, as in chat()
+
+HELP = """Commands (anything else is sent to the current tab):
+  /new NAME [N]   open a tab, optionally with model number N     /tab NAME   switch tab
+  /tabs           list tabs with status and costs                /close [NAME] close a tab
+  /model [N]      list models or change this tab's model         /cancel     stop this tab's reply
+  /costs          cost summary for this tab and all tabs         /timings, /limits, /help
+  quit            cancel anything still generating and exit
+Ctrl-C cancels the current tab's reply (or any running reply); when nothing is running it exits."""
+
+class Tab:
+    """One named conversation with its own history, model, prompt queue and costs"""
+
+    def __init__(self, name: str, model: str, log_file: str, anomalies: AnomalyDetector):
+        self.name = name
+        self.model = model
+        self.history: List[dict] = []
+        self.costs = CostTracker(MODEL_PRICING, log_file, load_history=False)
+        self.costs.anomalies = anomalies  # One detector for all tabs, trained once from the log
+        self.prompts: asyncio.Queue = asyncio.Queue()
+        self.current: Optional[asyncio.Task] = None  # Reply being generated
+        self.worker: Optional[asyncio.Task] = None
+        self.unseen: List[str] = []  # Output written while the tab was in the background
+        self.closed = False
+
+    def busy(self) -> bool:
+        return self.current is not None and not self.current.done()
+
+def _read_stdin(loop: asyncio.AbstractEventLoop, lines: asyncio.Queue):
+    """Blocking line reader feeding the event loop; None means end of input"""
+    while True:
+        try:
+            line = sys.stdin.readline()
+        except (OSError, ValueError):
+            line = ""
+        loop.call_soon_threadsafe(lines.put_nowait, line.rstrip("\n") if line else None)
+        if not line:
+            return
+
+class TabbedChat:
+    """Event-loop terminal chat running one reply worker per tab"""
+
+    def __init__(self, aclient: AsyncOpenAI, log_file: str = "chat_costs.log"):
+        self.aclient = aclient
+        self.log_file = log_file
+        self.models = ModelCache().filter_available(list(MODEL_PRICING.keys())) or list(MODEL_PRICING.keys())
+        self.tuner = MaxTokensTuner(max_tokens=MAX_TOKENS, pricing=MODEL_PRICING)
+        self.tuner.load_log(log_file)
+        # The log is read once at startup, not on every /new, which would stall the event loop
+        self.anomalies = CostTracker(MODEL_PRICING, log_file).anomalies
+        self.tabs: Dict[str, Tab] = {}
+        self.active: Optional[Tab] = None
+        self.lines: Optional[asyncio.Queue] = None
+
+    # Output
+
+    def emit(self, tab: Tab, text: str, end: str = "\n"):
+        """Print for the foreground tab, buffer for background tabs"""
+        if tab is self.active:
+            print(text, end=end, flush=True)
+        else:
+            tab.unseen.append(text + end)
+
+    def show_prompt(self):
+        print(f"\n[{self.active.name}] You: ", end="", flush=True)
+
+    # Tabs
+
+    def open_tab(self, name: str, model: str) -> Tab:
+        tab = Tab(name, model, self.log_file, self.anomalies)
+        tab.worker = asyncio.ensure_future(self._work(tab))
+        self.tabs[name] = tab
+        return tab
+
+    def switch(self, tab: Tab):
+        self.active = tab
+        print(f"--- tab {tab.name} :: {MODEL_PRICING[tab.model]['name']} ---")
+        if tab.unseen:
+            print("".join(tab.unseen), end="", flush=True)
+            tab.unseen.clear()
+
+    def close_tab(self, tab: Tab):
+        tab.closed = True
+        if tab.busy():
+            tab.current.cancel()
+        tab.prompts.put_nowait(None)  # Wakes the worker so it can exit
+        del self.tabs[tab.name]
+
+    # Replies
+
+    async def _work(self, tab: Tab):
+        """Answer a tab's prompts one at a time, in the order they were typed"""
+        while True:
+            prompt = await tab.prompts.get()
+            if prompt is None or tab.closed:
+                return
+            tab.current = asyncio.ensure_future(self._reply(tab, prompt))
+            try:
+                await tab.current
+            except Exception as e:
+                self.emit(tab, f"\nError: {e}")
+            if tab is not self.active and not tab.closed:
+                print(f"\n[{tab.name}] reply ready - /tab {tab.name} to read it", flush=True)
+            if not tab.closed:
+                self.show_prompt()
+
+    async def _reply(self, tab: Tab, prompt: str):
+        """Stream one reply; cancelling this task stops it upstream and charges what was generated"""
+        tab.history.append({"role": "user", "content": prompt})
+        if len(tab.history) > HISTORY_LIMIT:
+            tab.history = tab.history[-HISTORY_LIMIT:]
+        model = tab.model
+        prompt_chars = sum(len(m["content"]) for m in tab.history)
+        prompt_estimate = estimator.estimate(model, tab.history)
+        plan = self.tuner.plan(model, prompt_estimate, tab.name)
+        try:
+            hold = budgets.reserve(model, f"tab:{tab.name}", prompt_estimate, plan["max_tokens"])
+        except BudgetExceeded as e:
+            tab.history.pop()
+            self.emit(tab, f"[{tab.name}] BLOCKED: {e}")
+            return
+        if hold.shrunk:
+            plan = dict(plan, max_tokens=hold.max_tokens, tuned=False)  # Budget cap, not the tuner's
+            self.emit(tab, f"[{tab.name}] Budget nearly spent - reply limited to {hold.max_tokens} tokens")
+        started = time.time()
+        timer = PhaseTimer()
+        parts = []
+        usage = None
+        finish_reason = None
+        stream = None
+        cancelled = False
+        error = None
+
+        self.emit(tab, f"[{tab.name}] AI: ", end="")
+        phase_start = time.perf_counter()
+        try:
+            stream = await self.aclient.chat.completions.create(
+                model=model,
+                messages=list(tab.history),
+                max_tokens=plan["max_tokens"],
+                temperature=0.7,
+                stream=True,
+                stream_options={"include_usage": True}  # Final chunk carries exact token counts
+            )
+            timer.record("connect", time.perf_counter() - phase_start)
+            phase_start = time.perf_counter()
+            try:
+                async for chunk in stream:
+                    if chunk.usage:
+                        usage = chunk.usage
+                    if chunk.choices and chunk.choices[0].finish_reason:
+                        finish_reason = chunk.choices[0].finish_reason
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        parts.append(chunk.choices[0].delta.content)
+                        self.emit(tab, chunk.choices[0].delta.content, end="")
+            finally:
+                timer.record("generate", time.perf_counter() - phase_start)
+        except asyncio.CancelledError:
+            cancelled = True
+        except Exception as e:
+            error = str(e)
+        finally:
+            if stream is not None:
+                # Closing the response drops the upstream connection so the proxy stops generating
+                await stream.close()
+        self.emit(tab, "")
+
+        ai_message = "".join(parts)
+        if usage is not None:
+            prompt_tokens, completion_tokens = usage.prompt_tokens, usage.completion_tokens
+            estimated = False
+        elif parts or (cancelled and stream is not None):
+            # Stopped before the usage chunk - charge an estimate (~4 characters per token)
+            prompt_tokens, completion_tokens = max(1, prompt_chars // 4), len(ai_message) // 4
+            estimated = True
+        else:
+            # Nothing was generated - drop the prompt so the conversation stays consistent
+            budgets.release(hold)
+            tab.history.pop()
+            self.emit(tab, f"Error: {error}" if error else "   (cancelled before the model started replying)")
+            return
+        if ai_message:
+            tab.history.append({"role": "assistant", "content": ai_message})
+        else:
+            tab.history.pop()
+
+        with timer.phase("cost"):
+            cost_info = tab.costs.track_usage(model, prompt_tokens, completion_tokens, log=False,
+                                              latency=upstream_seconds(timer.as_dict()),
+                                              detect=not (estimated or cancelled or error))
+            budgets.settle(hold, cost_info["request_cost"])
+            if not estimated:
+                estimator.observe(model, prompt_estimate, prompt_tokens)
+        with timer.phase("log"):
+            tab.costs.log_usage(model, prompt_tokens, completion_tokens, cost_info["request_cost"],
+                                timer.as_dict(), max_tokens=plan["max_tokens"], finish_reason=finish_reason,
+                                max_tokens_tuned=plan["tuned"], session=f"tab:{tab.name}")
+        phase_stats.add(timer)
+        timings = timer.as_dict()
+        upstream_ms = round(timings.get("connect", 0) + timings.get("generate", 0), 3) if timings else None
+        status = "error" if error else "cancelled" if cancelled else "ok"
+        if status == "ok":
+            self.tuner.observe(model, completion_tokens, finish_reason, plan["max_tokens"], plan["tuned"],
+                               tab.name, latency=upstream_ms / 1000 if upstream_ms else None)
+        capture(started, src="cli", status=status, stream=True, sess=anonymize(tab.name), model=model,
+                req_model=model, prompt_chars=prompt_chars, prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens, max_tokens=plan["max_tokens"],
+                latency_ms=round((time.time() - started) * 1000, 3), upstream_ms=upstream_ms,
+                cost=cost_info["request_cost"])
+
+        if cancelled:
+            self.emit(tab, "   (generation cancelled)")
+        elif error:
+            self.emit(tab, f"   (interrupted by an upstream error: {error[:120]})")
+        elif finish_reason == "length":
+            self.emit(tab, f"   (reply cut off at max_tokens={plan['max_tokens']} - caps widen automatically if this repeats)")
+        self.emit(tab, f"   Cost: ${cost_info['request_cost']:.6f}{' (estimated)' if estimated else ''} | "
+                       f"Tab: ${cost_info['session_cost']:.6f} | "
+                       f"Tokens: {prompt_tokens + completion_tokens} | "
+                       f"Msg #{cost_info['message_count']}")
+        if cost_info['session_cost'] > 0.01:  # 1 cent
+            self.emit(tab, "   WARNING: Tab cost exceeded $0.01")
+        for alert in cost_info.get("anomalies", []):
+            self.emit(tab, f"   ANOMALY: {alert['message']}")
+
+    # Control
+
+    def interrupt(self):
+        """Ctrl-C: cancel the foreground reply, else every running reply, else quit"""
+        if self.active is not None and self.active.busy():
+            self.active.current.cancel()
+            return
+        running = [tab for tab in self.tabs.values() if tab.busy()]
+        for tab in running:
+            tab.current.cancel()
+            print(f"\n[{tab.name}] cancelling reply", flush=True)
+        if not running:
+            self.lines.put_nowait(None)
+
+    def pick_model(self, arg: str) -> Optional[str]:
+        try:
+            number = int(arg)
+        except ValueError:
+            number = 0
+        if 1 <= number <= len(self.models):
+            return self.models[number - 1]
+        print(f"Model number must be between 1 and {len(self.models)}")
+        return None
+
+    def total_cost(self) -> float:
+        return sum(tab.costs.session_costs.session_cost for tab in self.tabs.values())
+
+    def handle_command(self, line: str) -> bool:
+        """Run a /command; returns False if the line was not one"""
+        command, _, arg = line[1:].partition(" ")
+        arg = arg.strip()
+        tab = self.active
+        if command == "new":
+            name, _, number = arg.partition(" ")
+            if not name or name in self.tabs:
+                print("Usage: /new NAME [model number] (name must be unused)")
+                return True
+            model = self.pick_model(number) if number else tab.model
+            if model:
+                self.switch(self.open_tab(name, model))
+        elif command == "tab":
+            if arg in self.tabs:
+                self.switch(self.tabs[arg])
+            else:
+                print(f"No tab named {arg!r} - open tabs: {', '.join(self.tabs)}")
+        elif command == "tabs":
+            for t in self.tabs.values():
+                state = "generating" if t.busy() else "idle"
+                if t.prompts.qsize():
+                    state += f", {t.prompts.qsize()} queued"
+                marker = "*" if t is tab else "+" if t.unseen else " "
+                print(f"{marker} {t.name:<12} {MODEL_PRICING[t.model]['name']:<26} {state:<22} "
+                      f"{t.costs.session_costs.message_count:>4} msgs ${t.costs.session_costs.session_cost:.6f}")
+            print(f"All tabs: ${self.total_cost():.6f}  (* current, + unread replies)")
+        elif command == "close":
+            target = self.tabs.get(arg or tab.name)
+            if target is None or len(self.tabs) == 1:
+                print("Usage: /close [NAME] (the last tab cannot be closed)")
+                return True
+            self.close_tab(target)
+            print(f"Closed {target.name}: ${target.costs.session_costs.session_cost:.6f} spent")
+            if target is tab:
+                self.switch(next(iter(self.tabs.values())))
+        elif command == "model":
+            if not arg:
+                for i, model in enumerate(self.models, 1):
+                    print(f"{i}. {MODEL_PRICING[model]['name']}{'  (current)' if model == tab.model else ''}")
+            else:
+                model = self.pick_model(arg)
+                if model:
+                    tab.model = model
+                    print(f"Switched {tab.name} to: {MODEL_PRICING[model]['name']}")
+        elif command == "cancel":
+            if tab.busy():
+                tab.current.cancel()
+            else:
+                print("Nothing is generating in this tab")
+        elif command == "costs":
+            print(f"[{tab.name}]" + tab.costs.get_cost_summary())
+            print(f"All {len(self.tabs)} tabs: ${self.total_cost():.6f}")
+            if budgets.enabled:
+                print(budgets.describe(f"tab:{tab.name}"))
+        elif command == "timings":
+            print(phase_stats.report())
+        elif command == "limits":
+            print(self.tuner.report())
+        elif command == "help":
+            print(HELP)
+        else:
+            return False
+        return True
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.lines = asyncio.Queue()
+        threading.Thread(target=_read_stdin, args=(loop, self.lines), daemon=True, name="stdin").start()
+        try:
+            loop.add_signal_handler(signal.SIGINT, self.interrupt)
+            restore = lambda: loop.remove_signal_handler(signal.SIGINT)
+        except (NotImplementedError, RuntimeError):
+            # Windows event loops: route the signal through a plain handler
+            previous = signal.signal(signal.SIGINT, lambda *_: loop.call_soon_threadsafe(self.interrupt))
+            restore = lambda: signal.signal(signal.SIGINT, previous)
+
+        self.switch(self.open_tab("main", self.models[0]))
+        print(HELP)
+        print("=" * 70)
+        self.show_prompt()
+        try:
+            while True:
+                line = await self.lines.get()
+                if line is None or line.strip().lower() in ("quit", "exit", "bye", "q", "/quit"):
+                    break
+                line = line.strip()
+                if not line:
+                    self.show_prompt()
+                elif line.startswith("/") and self.handle_command(line):
+                    self.show_prompt()
+                else:
+                    if self.active.busy() or self.active.prompts.qsize():
+                        print(f"   (queued - {self.active.name} is still answering)")
+                    self.active.prompts.put_nowait(line)
+        finally:
+            restore()
+            await self.shutdown()
+
+    async def shutdown(self):
+        """Cancel anything still generating, wait for its cost to be logged, then summarize"""
+        print()
+        running = [tab.current for tab in self.tabs.values() if tab.busy()]
+        for task in running:
+            task.cancel()
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+        for tab in self.tabs.values():
+            tab.closed = True
+            tab.prompts.put_nowait(None)
+            if tab.costs.session_costs.message_count:
+                print(f"[{tab.name}]" + tab.costs.get_cost_summary())
+        print(f"\nAll tabs: ${self.total_cost():.6f}")
+        print(f"Costs logged to: {self.log_file}")
+        await self.aclient.close()
+
+def run_tabs(log_file: str = "chat_costs.log"):
+    """Start the asyncio chat against the same proxy as chat_with_costs.client"""
+    aclient = AsyncOpenAI(base_url=str(client.base_url), api_key=client.api_key)
+    asyncio.run(TabbedChat(aclient, log_file).run())
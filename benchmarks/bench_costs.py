@@ -0,0 +1,429 @@
+# bench_costs.py - Microbenchmarks for Cost Computation and Log Processing
+#
+# Times the hot paths that run on every request or every startup -
+# CostTracker.calculate_cost, track_usage, log_usage and
+# load_historical_costs, the show_cost_analysis log parser - plus
+# ChatHandler request handling against an in-process stub upstream. Log
+# processing runs over synthetic chat_costs.log files of 10^3 to 10^7
+# records (generated once and cached in the temp directory), so nothing
+# touches the network or the real log. Each benchmark is sampled several
+# times in each of several fresh interpreter processes, because samples
+# from one process share its memory layout and CPU state and are not
+# independent. `run --save` keeps the samples as a JSON baseline and
+# `compare` flags medians that moved by more than the threshold in every
+# process AND differ significantly (Mann-Whitney U test); `run
+# --baseline` re-runs a flagged benchmark and exits 1 only when the
+# regression reproduces
+# Dependencies: pip install openai (imported by chat_with_costs.py and web_chat.py)
+# Usage: python benchmarks/bench_costs.py run [--sizes 1e3,1e4,1e5] [--processes 3] [--save base.json]
+#                                             [--baseline base.json]
+#        python benchmarks/bench_costs.py compare base.json new.json
+
+import argparse
+import contextlib
+import datetime
+import gc
+import io
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chat_with_costs
+from anomaly_detector import AnomalyDetector
+from cost_tracking import MODEL_PRICING, CostTracker
+
+DEFAULT_SIZES = "1e3,1e4,1e5"
+MAX_SIZE = 10 ** 7
+REPEATS = 7
+PROCESSES = 3       # Fresh interpreters per run - the unit of independence between samples
+THRESHOLD = 0.10    # Median change smaller than this is never a regression (run-to-run noise)
+ALPHA = 0.05        # Significance level of the Mann-Whitney U test
+DATA_DIR = os.path.join(tempfile.gettempdir(), "goop-bench")
+
+# Synthetic logs
+
+def synthetic_log(n: int, seed: int = 1) -> str:
+    """Path of a chat_costs.log with n realistic records over the last 60 days (cached)"""
+    directory = os.path.join(DATA_DIR, str(n))
+    path = os.path.join(directory, "chat_costs.log")
+    if os.path.exists(path + ".done"):
+        return path
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    models = list(MODEL_PRICING)
+    now = datetime.datetime.now()
+    start = now - datetime.timedelta(days=60)
+    step = (now - start).total_seconds() / n
+    session_total = 0.0
+    with open(path, "w", encoding="utf-8") as f:
+        lines = []
+        for i in range(n):
+            model = models[rng.randrange(len(models))]
+            price = MODEL_PRICING[model]
+            prompt = int(rng.lognormvariate(5, 1)) + 1
+            completion = int(rng.lognormvariate(5.5, 0.8)) + 1
+            cost = prompt / 1000 * price["input_per_1k"] + completion / 1000 * price["output_per_1k"]
+            session_total += cost
+            timestamp = (start + datetime.timedelta(seconds=i * step)).isoformat()
+            upstream = round(rng.lognormvariate(6.5, 0.5), 3)
+            lines.append(f'{{"timestamp": "{timestamp}", "model": "{model}", "prompt_tokens": {prompt}, '
+                         f'"completion_tokens": {completion}, "total_tokens": {prompt + completion}, '
+                         f'"cost_usd": {cost!r}, "session_total": {session_total!r}, '
+                         f'"timings_ms": {{"upstream": {upstream}, "cost": 0.004, "log": 0.05}}, '
+                         f'"max_tokens": 500, "finish_reason": "stop", "max_tokens_tuned": false}}\n')
+            if len(lines) >= 10000:
+                f.write("".join(lines))
+                lines.clear()
+        f.write("".join(lines))
+    open(path + ".done", "w").close()  # An interrupted generation is redone next time
+    return path
+
+# Measurement
+
+def measure(fn: Callable[[], None], repeats: int, ops: int = 1, setup: Optional[Callable[[], None]] = None) -> List[float]:
+    """Seconds per operation for each of `repeats` samples of fn (which performs `ops` operations)"""
+    samples = []
+    for i in range(repeats + 1):
+        if setup:
+            setup()
+        gc.collect()
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        if i:  # The first run warms caches and imports and is thrown away
+            samples.append(elapsed / ops)
+    return samples
+
+def size_label(n: int) -> str:
+    """1000 -> "1e3", 25000 -> "2.5e4" - short names for log sizes"""
+    exponent = len(str(n)) - 1
+    mantissa = n / 10 ** exponent
+    return f"{mantissa:g}e{exponent}" if float(f"{mantissa:g}") * 10 ** exponent == n else str(n)
+
+def quiet():
+    return contextlib.redirect_stdout(io.StringIO())
+
+def tracker(log_file: str) -> CostTracker:
+    with quiet():
+        result = CostTracker(pricing=MODEL_PRICING, log_file=log_file)
+    result.anomalies = AnomalyDetector(log_file=None)
+    return result
+
+def bench_per_request(work: str, repeats: int) -> Dict[str, dict]:
+    """calculate_cost, track_usage and log_usage on an empty log"""
+    results = {}
+    models = list(MODEL_PRICING)
+    cost_tracker = tracker(os.path.join(work, "requests.log"))
+    calls = [(models[i % len(models)], 50 + i % 400, 100 + i % 900) for i in range(1000)]
+
+    def calculate():
+        for _ in range(20):
+            for model, prompt, completion in calls:
+                cost_tracker.calculate_cost(model, prompt, completion)
+    results["calculate_cost"] = {"unit": "op", "samples": measure(calculate, repeats, 20 * len(calls))}
+
+    def track():
+        for model, prompt, completion in calls:
+            cost_tracker.track_usage(model, prompt, completion, log=False, latency=0.8)
+    results["track_usage"] = {"unit": "op", "samples": measure(track, repeats, len(calls))}
+
+    log_path = os.path.join(work, "requests.log")
+    timings = {"upstream": 812.3, "cost": 0.004}
+
+    def log():
+        for model, prompt, completion in calls:
+            cost_tracker.log_usage(model, prompt, completion, 0.0001, timings, max_tokens=500,
+                                   finish_reason="stop", max_tokens_tuned=True)
+    results["log_usage"] = {"unit": "op", "samples": measure(log, repeats, len(calls),
+                                                             setup=lambda: open(log_path, "w").close())}
+    return results
+
+def bench_log(n: int, repeats: int) -> Dict[str, dict]:
+    """load_historical_costs and show_cost_analysis over an n-record log"""
+    path = synthetic_log(n)
+    results = {}
+    cost_tracker = tracker(os.path.join(os.path.dirname(path), "empty.log"))
+    cost_tracker.log_file = path
+
+    def reset():
+        cost_tracker.anomalies = AnomalyDetector(log_file=None)
+
+    def load():
+        with quiet():
+            cost_tracker.load_historical_costs()
+    results[f"load_historical_costs[{size_label(n)}]"] = {"unit": "run", "records": n,
+                                                  "samples": measure(load, repeats, setup=reset)}
+
+    columns_cache = os.path.join(os.path.dirname(path), ".chat_costs.log.columns")
+
+    def uncache():
+        # Measure the full parse, not a read of reprice.py's column cache from the previous sample
+        if os.path.exists(columns_cache):
+            os.remove(columns_cache)
+
+    def analyze():
+        with quiet():
+            chat_with_costs.show_cost_analysis()
+    cwd = os.getcwd()
+    os.chdir(os.path.dirname(path))  # show_cost_analysis reads ./chat_costs.log
+    try:
+        results[f"show_cost_analysis[{size_label(n)}]"] = {"unit": "run", "records": n,
+                                                   "samples": measure(analyze, repeats, setup=uncache)}
+    finally:
+        os.chdir(cwd)
+    return results
+
+def bench_handler(work: str, repeats: int, requests: int = 200) -> Dict[str, dict]:
+    """POST /chat through ChatHandler with a stub upstream, keep-alive, overhead per request"""
+    from types import SimpleNamespace
+    import web_chat
+    from bench_server import StubCompletions, run_mode
+
+    stub = StubCompletions(0.0, 2000)
+    web_chat.client = SimpleNamespace(chat=SimpleNamespace(completions=stub))
+    web_chat.print = lambda *args, **kwargs: None
+    web_chat.cost_tracker.log_file = os.path.join(work, "handler.log")
+    web_chat.cost_tracker.anomalies = AnomalyDetector(log_file=None)  # Not ./anomalies.log
+    server = web_chat.ThreadingHTTPServer(("127.0.0.1", 0), web_chat.ChatHandler)
+    port = server.server_address[1]
+    web_chat.threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        run_mode(port, stub, requests, True, False)  # Warm-up
+        samples = [run_mode(port, stub, requests, True, False)["overhead_p50_ms"] / 1000 for _ in range(repeats)]
+    finally:
+        server.shutdown()
+        server.server_close()
+    return {"chat_handler": {"unit": "request", "samples": samples}}
+
+def run_once(sizes: List[int], repeats: int = REPEATS, only: Optional[str] = None, handler: bool = True) -> dict:
+    """Every benchmark in this process as {"name": {"unit", "samples", "median"}} plus environment details"""
+    work = tempfile.mkdtemp(prefix="goop-bench-")
+    results: Dict[str, dict] = {}
+    try:
+        # (names a step produces, the step) - steps with no wanted benchmark are skipped
+        steps = [(["calculate_cost", "track_usage", "log_usage"], lambda: bench_per_request(work, repeats))]
+        steps += [([f"load_historical_costs[{size_label(n)}]", f"show_cost_analysis[{size_label(n)}]"],
+                   lambda n=n: bench_log(n, repeats)) for n in sizes]
+        if handler:
+            steps.append((["chat_handler"], lambda: bench_handler(work, repeats)))
+        for names, step in steps:
+            if only and not any(only in name for name in names):
+                continue
+            for name, result in step().items():
+                if only and only not in name:
+                    continue
+                result["median"] = statistics.median(result["samples"])
+                results[name] = result
+                print(f"  {name:<32} {describe(result['median'], result['unit'])}", flush=True)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+    return {"created": datetime.datetime.now().isoformat(timespec="seconds"), "python": platform.python_version(),
+            "platform": platform.platform(), "repeats": repeats, "benchmarks": results}
+
+def run(sizes: List[int], repeats: int = REPEATS, only: Optional[str] = None, handler: bool = True,
+        processes: int = PROCESSES) -> dict:
+    """run_once() in `processes` fresh interpreters, one after another, with each process's samples under "runs"""
+    runs = []
+    for i in range(processes):
+        print(f"Process {i + 1} of {processes}", flush=True)
+        fd, path = tempfile.mkstemp(prefix="goop-bench-", suffix=".json")
+        os.close(fd)
+        try:
+            command = [sys.executable, os.path.abspath(__file__), "run", "--child", "--processes", "1",
+                       "--sizes", ",".join(map(str, sizes)), "--repeats", str(repeats), "--save", path]
+            if only:
+                command += ["--only", only]
+            if not handler:
+                command.append("--no-server")
+            subprocess.run(command, check=True)
+            with open(path) as f:
+                runs.append(json.load(f))
+        finally:
+            os.remove(path)
+    result = dict(runs[0], processes=processes, benchmarks={})
+    for name, first in runs[0]["benchmarks"].items():
+        per_process = [r["benchmarks"][name]["samples"] for r in runs if name in r["benchmarks"]]
+        samples = [sample for samples in per_process for sample in samples]
+        result["benchmarks"][name] = dict(first, runs=per_process, samples=samples,
+                                          median=statistics.median(samples))
+    if processes > 1:
+        print("\nAll processes:")
+        for name, bench in result["benchmarks"].items():
+            print(f"  {name:<32} {describe(bench['median'], bench['unit'])}")
+    return result
+
+def describe(seconds: float, unit: str) -> str:
+    if seconds < 1e-6:
+        return f"{seconds * 1e9:8.1f} ns/{unit}"
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:8.2f} us/{unit}"
+    if seconds < 1:
+        return f"{seconds * 1e3:8.2f} ms/{unit}"
+    return f"{seconds:8.3f} s/{unit}"
+
+# Comparison
+
+def mann_whitney_p(a: List[float], b: List[float]) -> float:
+    """Two-sided p-value of the Mann-Whitney U test (normal approximation with tie and continuity correction)"""
+    n1, n2 = len(a), len(b)
+    if not n1 or not n2:
+        return 1.0
+    combined = sorted([(value, 0) for value in a] + [(value, 1) for value in b])
+    ranks = [0.0] * len(combined)
+    ties = 0.0
+    i = 0
+    while i < len(combined):
+        j = i
+        while j + 1 < len(combined) and combined[j + 1][0] == combined[i][0]:
+            j += 1
+        for k in range(i, j + 1):
+            ranks[k] = (i + j) / 2 + 1
+        t = j - i + 1
+        ties += t ** 3 - t
+        i = j + 1
+    u = sum(rank for rank, (_, group) in zip(ranks, combined) if group == 0) - n1 * (n1 + 1) / 2
+    n = n1 + n2
+    sigma = math.sqrt(n1 * n2 / 12 * ((n + 1) - ties / (n * (n - 1))))
+    if sigma == 0:
+        return 1.0
+    z = (abs(u - n1 * n2 / 2) - 0.5) / sigma
+    return min(1.0, math.erfc(max(0.0, z) / math.sqrt(2)))
+
+def process_medians(bench: dict) -> List[float]:
+    """Median of each process's samples (files saved before --processes hold one process)"""
+    return [statistics.median(samples) for samples in bench.get("runs") or [bench["samples"]]]
+
+def compare(baseline: dict, current: dict, threshold: float = THRESHOLD, alpha: float = ALPHA) -> List[dict]:
+    """Per-benchmark change of the median and whether it is a significant regression or improvement
+
+    Beyond the pooled test, the change must hold for every process: each
+    current process slower than every baseline process by the threshold,
+    so one unlucky process (or one lucky baseline) decides nothing.
+    """
+    rows = []
+    for name, new in current["benchmarks"].items():
+        old = baseline["benchmarks"].get(name)
+        if old is None:
+            continue
+        change = new["median"] / old["median"] - 1 if old["median"] else 0.0
+        p = mann_whitney_p(old["samples"], new["samples"])
+        old_medians, new_medians = process_medians(old), process_medians(new)
+        if p < alpha and change > threshold and min(new_medians) > max(old_medians) * (1 + threshold):
+            verdict = "REGRESSION"
+        elif p < alpha and change < -threshold and max(new_medians) < min(old_medians) * (1 - threshold):
+            verdict = "faster"
+        else:
+            verdict = "same"
+        rows.append({"name": name, "unit": new["unit"], "old": old["median"], "new": new["median"],
+                     "change": change, "p": p, "verdict": verdict})
+    return rows
+
+def print_comparison(rows: List[dict], alpha: float = ALPHA, samples: int = REPEATS,
+                     processes: int = PROCESSES) -> int:
+    """Print the comparison table and return the number of regressions"""
+    print(f"{'benchmark':<32} {'baseline':>19} {'current':>19} {'change':>8} {'p':>7}  verdict")
+    for row in rows:
+        print(f"{row['name']:<32} {describe(row['old'], row['unit']):>19} {describe(row['new'], row['unit']):>19} "
+              f"{row['change']:>+7.1%} {row['p']:>7.4f}  {row['verdict']}")
+    regressions = sum(1 for row in rows if row["verdict"] == "REGRESSION")
+    print(f"\n{regressions} significant regression(s) (p < {alpha:g} and slower by more than the threshold)")
+    if samples < 4:
+        print(f"Only {samples} samples per benchmark - too few for any change to be significant")
+    if processes < 2:
+        print("Only one process per run - its samples are not independent, so treat a regression as a hint")
+    return regressions
+
+def confirm(rows: List[dict], baseline: dict, args) -> int:
+    """Re-run each flagged benchmark in fresh processes; return how many regressions reproduce"""
+    flagged = [row["name"] for row in rows if row["verdict"] == "REGRESSION"]
+    if not flagged:
+        return 0
+    print(f"\nRe-running {len(flagged)} flagged benchmark(s) to confirm...")
+    confirmed = 0
+    for name in flagged:
+        rerun = run(args.sizes, args.repeats, name, handler=not args.no_server, processes=max(1, args.processes))
+        row = next((row for row in compare(baseline, rerun, args.threshold) if row["name"] == name), None)
+        reproduced = row is not None and row["verdict"] == "REGRESSION"
+        print(f"  {name}: {'regression reproduced' if reproduced else 'did not reproduce - noise'}")
+        confirmed += reproduced
+    print(f"\n{confirmed} confirmed regression(s)")
+    return confirmed
+
+def runs_in(data: dict) -> int:
+    return data.get("processes", 1)
+
+def parse_sizes(text: str) -> List[int]:
+    sizes = sorted({int(float(part)) for part in text.split(",") if part.strip()})
+    if not sizes or sizes[0] < 1 or sizes[-1] > MAX_SIZE:
+        raise argparse.ArgumentTypeError(f"sizes must be between 1 and {MAX_SIZE:.0e}")
+    return sizes
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline microbenchmarks for cost tracking and log processing")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument("--sizes", type=parse_sizes, default=parse_sizes(DEFAULT_SIZES),
+                            help=f"synthetic log sizes in records, up to 1e7 (default {DEFAULT_SIZES})")
+    run_parser.add_argument("--repeats", type=int, default=REPEATS,
+                            help=f"samples per benchmark (default {REPEATS}; fewer than 4 can never be significant)")
+    run_parser.add_argument("--processes", type=int, default=PROCESSES,
+                            help=f"fresh interpreter processes to sample in (default {PROCESSES})")
+    run_parser.add_argument("--only", metavar="TEXT", help="run only benchmarks whose name contains TEXT")
+    run_parser.add_argument("--no-server", action="store_true", help="skip the ChatHandler benchmark")
+    run_parser.add_argument("--save", metavar="FILE", help="write the samples as a JSON baseline")
+    run_parser.add_argument("--baseline", metavar="FILE", help="compare with a saved baseline; exit 1 on a regression")
+    run_parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                            help=f"smallest median slowdown reported as a regression (default {THRESHOLD:.0%})")
+    run_parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)  # One process of a run
+    compare_parser = commands.add_parser("compare", help="compare two saved runs")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                                help=f"smallest median slowdown reported as a regression (default {THRESHOLD:.0%})")
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        sys.exit(1 if print_comparison(compare(baseline, current, args.threshold), samples=min(
+            baseline.get("repeats", REPEATS), current.get("repeats", REPEATS)),
+            processes=min(runs_in(baseline), runs_in(current))) else 0)
+
+    if args.child:
+        current = run_once(args.sizes, args.repeats, args.only, handler=not args.no_server)
+        with open(args.save, "w") as f:
+            json.dump(current, f)
+        return
+
+    print("COST AND LOG PROCESSING BENCHMARKS")
+    print("=" * 60)
+    print(f"Synthetic logs in {DATA_DIR} (generated on first use)")
+    current = run(args.sizes, args.repeats, args.only, handler=not args.no_server, processes=max(1, args.processes))
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(current, f, indent=2)
+        print(f"\nSaved to {args.save}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print()
+        rows = compare(baseline, current, args.threshold)
+        print_comparison(rows, samples=min(baseline.get("repeats", REPEATS), args.repeats),
+                         processes=min(runs_in(baseline), runs_in(current)))
+        sys.exit(1 if confirm(rows, baseline, args) else 0)
+
+if __name__ == "__main__":
+    main()
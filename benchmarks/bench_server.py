@@ -0,0 +1,129 @@
+# bench_server.py - Per-request Server Overhead for web_chat.py
+#
+# Runs ChatHandler on a local port against an in-process stub upstream, so
+# the numbers measure our own request handling rather than model latency
+# Dependencies: pip install openai (imported by web_chat.py)
+# Usage: python benchmarks/bench_server.py [--requests 2000] [--upstream-delay 0.0]
+
+import argparse
+import http.client
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import web_chat
+
+class StubCompletions:
+    """Stands in for client.chat.completions and records time spent 'upstream'"""
+
+    def __init__(self, delay: float, response_chars: int):
+        self.delay = delay
+        self.text = ("lorem ipsum " * (response_chars // 12 + 1))[:response_chars]
+        self.upstream_time = 0.0
+        self.lock = threading.Lock()
+
+    def create(self, **kwargs):
+        start_time = time.perf_counter()
+        if self.delay:
+            time.sleep(self.delay)
+        response = SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=self.text), finish_reason="stop")],
+            usage=SimpleNamespace(prompt_tokens=12, completion_tokens=len(self.text) // 4,
+                                  total_tokens=12 + len(self.text) // 4)
+        )
+        with self.lock:
+            self.upstream_time += time.perf_counter() - start_time
+        return response
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def run_mode(port: int, stub: StubCompletions, requests: int, keep_alive: bool, gzip_ok: bool) -> dict:
+    """Issue sequential /chat requests and split wall time into upstream and server overhead"""
+    body = json.dumps({"message": "benchmark", "model": "vertex/gemini-2.0-flash-lite-001"}).encode()
+    headers = {"Content-Type": "application/json"}
+    if gzip_ok:
+        headers["Accept-Encoding"] = "gzip"
+    if not keep_alive:
+        headers["Connection"] = "close"
+
+    stub.upstream_time = 0.0
+    latencies = []
+    conn = None
+    start_all = time.perf_counter()
+    for _ in range(requests):
+        if conn is None:
+            conn = http.client.HTTPConnection("127.0.0.1", port)
+        start_time = time.perf_counter()
+        conn.request("POST", "/chat", body=body, headers=headers)
+        response = conn.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - start_time)
+        if not keep_alive:
+            conn.close()
+            conn = None
+    wall = time.perf_counter() - start_all
+    if conn is not None:
+        conn.close()
+
+    upstream_per_request = stub.upstream_time / requests
+    overheads = [max(0.0, l - upstream_per_request) for l in latencies]
+    return {
+        "mode": ("keep-alive" if keep_alive else "new-connection") + (" +gzip" if gzip_ok else ""),
+        "requests": requests,
+        "requests_per_sec": requests / wall,
+        "upstream_ms": upstream_per_request * 1000,
+        "overhead_p50_ms": statistics.median(overheads) * 1000,
+        "overhead_p95_ms": percentile(overheads, 95) * 1000,
+        "overhead_p99_ms": percentile(overheads, 99) * 1000,
+    }
+
+def run(requests: int = 2000, upstream_delay: float = 0.0, response_chars: int = 2000) -> list:
+    """Start a throwaway server and benchmark every connection mode"""
+    stub = StubCompletions(upstream_delay, response_chars)
+    web_chat.client = SimpleNamespace(chat=SimpleNamespace(completions=stub))
+    web_chat.print = lambda *args, **kwargs: None  # Silence per-request console logging
+    log_dir = tempfile.TemporaryDirectory()
+    web_chat.cost_tracker.log_file = os.path.join(log_dir.name, "chat_costs.log")  # Keep the real log clean
+
+    server = web_chat.ThreadingHTTPServer(("127.0.0.1", 0), web_chat.ChatHandler)
+    port = server.server_address[1]
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        run_mode(port, stub, min(100, requests), True, False)  # Warm-up
+        return [run_mode(port, stub, requests, keep_alive, gzip_ok)
+                for keep_alive, gzip_ok in ((True, False), (True, True), (False, False))]
+    finally:
+        server.shutdown()
+        server.server_close()
+        log_dir.cleanup()
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure web_chat per-request server overhead")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--upstream-delay", type=float, default=0.0,
+                        help="simulated model latency in seconds (excluded from overhead)")
+    parser.add_argument("--response-chars", type=int, default=2000)
+    args = parser.parse_args()
+
+    print("WEB_CHAT SERVER OVERHEAD BENCHMARK")
+    print("=" * 60)
+    for result in run(args.requests, args.upstream_delay, args.response_chars):
+        print(f"{result['mode']:<22} {result['requests_per_sec']:8.0f} req/s | "
+              f"overhead p50 {result['overhead_p50_ms']:.3f}ms "
+              f"p95 {result['overhead_p95_ms']:.3f}ms p99 {result['overhead_p99_ms']:.3f}ms | "
+              f"upstream {result['upstream_ms']:.3f}ms")
+    print()
+    print(web_chat.phase_stats.report())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+# replay_traffic.py - Replay Captured Traffic Against a Stub Proxy
+#
+# Re-issues the requests recorded with `web_chat.py --capture` or
+# `chat_with_costs.py --capture` through web_chat's ChatHandler, whose
+# OpenAI client points at a local stub proxy that answers each request with
+# the recorded upstream latency and token counts. Compares throughput,
+# latency percentiles and cost accounting with the captured baseline (or a
+# previously saved replay)
+# Dependencies: pip install openai (imported by web_chat.py)
+# Usage: python benchmarks/replay_traffic.py traffic.jsonl.gz [--speed 10] [--save run.json] [--baseline old.json]
+
+import argparse
+import http.client
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from openai import OpenAI
+
+import web_chat
+from traffic_capture import load_capture, summarize
+
+REPLAYED_STATUSES = ("ok", "cancelled")  # Requests that reached the proxy
+STREAM_CHUNKS = 10
+
+class StubProxy(BaseHTTPRequestHandler):
+    """Answers chat completions like goop, using the recorded trace named in the prompt"""
+
+    protocol_version = "HTTP/1.1"
+    records = []
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        prompt = body["messages"][-1]["content"]
+        record = self.records[int(prompt[1:prompt.index("|")])]
+        delay = (record.get("upstream_ms") or record.get("latency_ms") or 0) / 1000
+        text = "x" * (record.get("completion_tokens", 0) * 4)
+        usage = {"prompt_tokens": record.get("prompt_tokens", 0),
+                 "completion_tokens": record.get("completion_tokens", 0),
+                 "total_tokens": record.get("prompt_tokens", 0) + record.get("completion_tokens", 0)}
+        base = {"id": "replay", "created": int(time.time()), "model": body["model"]}
+
+        if not body.get("stream"):
+            time.sleep(delay)
+            self._send(json.dumps(dict(base, object="chat.completion", usage=usage, choices=[
+                {"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}
+            ])).encode(), "application/json")
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        time.sleep(delay * 0.2)  # Time to first token
+        step = max(1, len(text) // STREAM_CHUNKS)
+        for i in range(0, len(text), step):
+            time.sleep(delay * 0.8 / STREAM_CHUNKS)
+            self._chunk(dict(base, object="chat.completion.chunk", choices=[
+                {"index": 0, "delta": {"content": text[i:i + step]}, "finish_reason": None}]))
+        self._chunk(dict(base, object="chat.completion.chunk", choices=[], usage=usage))
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+    def _send(self, payload: bytes, content_type: str):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _chunk(self, data: dict):
+        self._write_chunk(b"data: " + json.dumps(data).encode() + b"\n\n")
+
+    def _write_chunk(self, payload: bytes):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(payload), payload))
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+class CollectingSocket:
+    """Stands in for a WebSocket so streamed replies can be replayed through stream_chat"""
+
+    def __init__(self):
+        self.messages = []
+
+    def send_text(self, text: str) -> bool:
+        self.messages.append(json.loads(text))
+        return True
+
+def start_server(handler, **attributes) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    for name, value in attributes.items():
+        setattr(handler, name, value)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def prompt_for(index: int, record: dict) -> str:
+    """Synthetic prompt of the recorded size that tells the stub which trace to answer with"""
+    tag = f"#{index}|"
+    return tag + "x" * max(0, (record.get("prompt_chars") or 0) - len(tag))
+
+def replay_one(port: int, index: int, record: dict, start: float) -> dict:
+    prompt = prompt_for(index, record)
+    model = record.get("req_model") or record.get("model")
+    session = record.get("sess") or "replay"
+    started = time.perf_counter()
+    result = {"t": round(start, 4), "status": "error", "stream": bool(record.get("stream"))}
+
+    if record.get("stream"):
+        ws = CollectingSocket()
+        web_chat.stream_chat(ws, index, prompt, model, threading.Event(), queue_key=session)
+        final = ws.messages[-1] if ws.messages else {}
+        if final.get("type") == "done":
+            result.update(status="ok", cost=final["cost_info"]["last_cost"])
+        elif final.get("retry_after"):
+            result["status"] = "rejected"
+    else:
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=300)
+        try:
+            conn.request("POST", "/chat", body=json.dumps({"message": prompt, "model": model, "session": session}),
+                         headers={"Content-Type": "application/json"})
+            response = conn.getresponse()
+            data = json.loads(response.read())
+            if response.status == 429:
+                result["status"] = "rejected"
+            elif data.get("success"):
+                result.update(status="ok", cost=data["cost_info"]["last_cost"])
+        finally:
+            conn.close()
+
+    result["latency_ms"] = round((time.perf_counter() - started) * 1000, 3)
+    if result["status"] == "ok":
+        result["prompt_tokens"] = record.get("prompt_tokens", 0)
+        result["completion_tokens"] = record.get("completion_tokens", 0)
+    return result
+
+def replay(records: list, speed: float = 1.0, workers: int = 128) -> list:
+    """Re-issue the traces on their original schedule (compressed by `speed`)"""
+    stub = start_server(StubProxy, records=records)
+    web_chat.client = OpenAI(base_url=f"http://127.0.0.1:{stub.server_address[1]}/openai-proxy/v1",
+                             api_key="replay", max_retries=0, http_client=web_chat.warmer.http_client())
+    web_chat.print = lambda *args, **kwargs: None
+    log_dir = tempfile.TemporaryDirectory()
+    web_chat.cost_tracker.log_file = os.path.join(log_dir.name, "chat_costs.log")
+    server = start_server(web_chat.ChatHandler)
+    port = server.server_address[1]
+
+    origin = records[0]["t"] if records else 0.0
+    begin = time.perf_counter()
+    futures = []
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for index, record in enumerate(records):
+                due = (record["t"] - origin) / speed
+                wait = due - (time.perf_counter() - begin)
+                if wait > 0:
+                    time.sleep(wait)
+                futures.append(pool.submit(replay_one, port, index, record, time.perf_counter() - begin))
+        return [future.result() for future in futures]
+    finally:
+        server.shutdown()
+        server.server_close()
+        stub.shutdown()
+        stub.server_close()
+        log_dir.cleanup()
+
+def cost_mismatches(records: list, results: list) -> int:
+    """Requests whose replayed cost differs from what was charged originally"""
+    return sum(1 for record, result in zip(records, results)
+               if record.get("status") == "ok" and result["status"] == "ok"
+               and abs(record.get("cost", 0.0) - result.get("cost", 0.0)) > 1e-12)
+
+def print_comparison(baseline: dict, current: dict, baseline_name: str):
+    print(f"{'metric':<20} {baseline_name:>14} {'replay':>14} {'change':>9}")
+    for key in ("requests", "ok", "rejected", "errors", "duration_s", "requests_per_sec", "latency_p50_ms",
+                "latency_p95_ms", "latency_p99_ms", "prompt_tokens", "completion_tokens", "cost_usd"):
+        old, new = baseline.get(key, 0), current.get(key, 0)
+        change = f"{(new - old) / old * 100:+.1f}%" if old else "-"
+        print(f"{key:<20} {old:>14g} {new:>14g} {change:>9}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured chat traffic against a stub proxy")
+    parser.add_argument("capture", help="file written by --capture")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="arrival-rate multiplier (10 = replay ten times faster)")
+    parser.add_argument("--workers", type=int, default=128, help="max requests in flight from the replayer")
+    parser.add_argument("--save", metavar="FILE", help="write this run's summary as JSON")
+    parser.add_argument("--baseline", metavar="FILE", help="compare with a saved replay instead of the capture")
+    args = parser.parse_args()
+
+    header, captured = load_capture(args.capture)
+    records = [r for r in captured if r.get("status") in REPLAYED_STATUSES]
+    print("TRAFFIC REPLAY")
+    print("=" * 60)
+    print(f"Capture started {header.get('started', '?')}: {len(captured)} requests, "
+          f"{len(records)} replayed at {args.speed:g}x")
+
+    results = replay(records, args.speed, args.workers)
+    current = summarize(results)
+    current["cost_mismatches"] = cost_mismatches(records, results)
+    current["speed"] = args.speed
+    # Stub requests that had to open a connection vs ones that reused a pooled one
+    upstream = web_chat.warmer.snapshot()
+    current["upstream_cold"] = upstream["cold"]["count"]
+    current["upstream_cold_avg_ms"] = upstream["cold"].get("avg_ms", 0.0)
+    current["upstream_warm_avg_ms"] = upstream["warm"].get("avg_ms", 0.0)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        baseline_name = "baseline"
+    else:
+        # Captured latencies include real model time; the stub reproduces the upstream part
+        baseline = summarize(records, args.speed)
+        baseline_name = "capture"
+    print()
+    print_comparison(baseline, current, baseline_name)
+    print(f"\nCost accounting: {current['cost_mismatches']} of {current['ok']} requests "
+          f"charged differently than recorded")
+    print(web_chat.warmer.describe())
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(current, f, indent=2)
+        print(f"Summary saved to {args.save}")
+
+if __name__ == "__main__":
+    main()
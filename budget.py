@@ -0,0 +1,321 @@
+# budget.py - Pre-Flight Token Estimation and Hard Spending Budgets
+#
+# Estimates a request's prompt tokens locally before it is sent (memoized
+# per message, so re-estimating a growing conversation only costs the new
+# turns, and calibrated per model against the token counts the API
+# reports) and its worst-case cost from max_tokens. BudgetManager checks
+# that worst case against per-session, per-day and global limits and
+# reserves it under one lock, so concurrent requests cannot jointly
+# overshoot. When a budget is nearly spent max_tokens is shrunk to what
+# is still affordable; when not even a short reply fits the request is
+# rejected before any money is spent. The reservation is replaced by the
+# real cost when the reply finishes. Given a worker pool's shared
+# counters, the global and day budgets are checked against the whole
+# pool's spend and holds instead of this process's
+# Used by: chat_with_costs.py, async_chat.py, model_compare.py, web_chat.py
+# Dependencies: none (standard library only)
+
+import datetime
+import json
+import math
+import os
+import re
+import threading
+from collections import OrderedDict
+from contextlib import nullcontext
+from typing import Dict, List, Optional
+
+MESSAGE_OVERHEAD = 4        # Role and formatting tokens per chat message
+SAFETY_MARGIN = 1.1         # Reserve for a slightly longer prompt than estimated
+MIN_COMPLETION_TOKENS = 16  # A reply shrunk below this is not worth paying for
+MAX_SESSIONS = 10000        # Least recently active session budgets are forgotten beyond this
+PIECES = re.compile(r"\w+|[^\w\s]")
+
+class BudgetExceeded(Exception):
+    """Raised before the upstream call when a request cannot fit a budget"""
+
+    def __init__(self, scope: str, limit: float, spent: float, needed: float):
+        self.scope = scope
+        self.limit = limit
+        self.spent = spent
+        self.needed = needed
+        super().__init__(f"{scope} budget of ${limit:.4f} reached (${spent:.6f} spent or reserved, "
+                         f"this request needs up to ${needed:.6f})")
+
+class TokenEstimator:
+    """Local prompt-token estimates: memoized per message text, calibrated per model"""
+
+    def __init__(self, size: int = 4096):
+        self.size = size
+        self.cache: "OrderedDict[str, int]" = OrderedDict()
+        self.scale: Dict[str, float] = {}  # model -> EWMA of actual / estimated prompt tokens
+        self.lock = threading.Lock()
+
+    def _text_tokens(self, text: str) -> int:
+        # Words split into ~6 character pieces and every punctuation mark is a token - close to
+        # what BPE tokenizers produce for prose and code, and never below the 4-chars rule
+        count = self.cache.get(text)
+        if count is None:
+            count = max(len(text) // 4, sum((len(piece) + 5) // 6 for piece in PIECES.findall(text)))
+            self.cache[text] = count
+            if len(self.cache) > self.size:
+                self.cache.popitem(last=False)
+        else:
+            self.cache.move_to_end(text)
+        return count
+
+    def estimate(self, model: str, messages: List[dict]) -> int:
+        """Estimated prompt tokens for a conversation"""
+        with self.lock:
+            raw = sum(self._text_tokens(m["content"]) + MESSAGE_OVERHEAD for m in messages)
+            return max(1, math.ceil(raw * self.scale.get(model, 1.0)))
+
+    def observe(self, model: str, estimated: int, actual: int):
+        """Calibrate against the prompt_tokens the API reported for an estimated request"""
+        if estimated <= 0 or actual <= 0:
+            return
+        with self.lock:
+            scale = self.scale.get(model, 1.0)
+            ratio = actual / (estimated / scale)  # Against the uncalibrated estimate
+            self.scale[model] = min(3.0, max(0.33, 0.8 * scale + 0.2 * ratio))
+
+class Reservation:
+    """Worst-case cost held against every budget a request counts toward"""
+
+    def __init__(self, model: str, keys: List[tuple], cost: float, prompt_tokens: int, max_tokens: int,
+                 shrunk: bool):
+        self.model = model
+        self.keys = keys
+        self.cost = cost
+        self.prompt_tokens = prompt_tokens
+        self.max_tokens = max_tokens
+        self.shrunk = shrunk  # max_tokens was lowered to fit a budget
+        self.done = False
+
+class BudgetManager:
+    """Per-session, per-day and global spending limits in USD, enforced before each call
+
+    A limit of None disables that budget. The day budget follows the local
+    calendar day and can be seeded from today's records in the cost log;
+    session and global spend count from when the process started (or the
+    worker pool, when `counters` is shared between workers).
+    """
+
+    def __init__(self, pricing: Dict[str, dict], session_limit: Optional[float] = None,
+                 daily_limit: Optional[float] = None, global_limit: Optional[float] = None,
+                 min_completion_tokens: int = MIN_COMPLETION_TOKENS):
+        self.pricing = pricing
+        self.limits = {"session": session_limit, "day": daily_limit, "global": global_limit}
+        self.min_completion_tokens = min_completion_tokens
+        self.spent: Dict[tuple, float] = {}
+        self.reserved: Dict[tuple, float] = {}
+        self.sessions: "OrderedDict[str, None]" = OrderedDict()
+        self.counters = None  # worker_pool.SharedCounters holding the pool's global and day spend
+        self.rejected = 0
+        self.shrunk = 0
+        self.lock = threading.Lock()
+
+    def configure(self, args, log_file: str = "chat_costs.log", counters=None, seed: bool = True):
+        """Take limits from add_budget_args() options and seed today's spend
+
+        With a worker pool's counters the global and day budgets count every
+        worker's spend; the master seeds the day once before forking, and
+        workers pass seed=False so a restarted worker does not add it again.
+        Session limits stay per process: a session whose connections land on
+        different workers is held to the limit by each of them separately.
+        """
+        with self.lock:
+            self.limits = {"session": args.session_budget, "day": args.daily_budget, "global": args.budget}
+            self.counters = counters
+        return self.load_log(log_file) if seed else 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return any(limit is not None for limit in self.limits.values())
+
+    def _price(self, model: str) -> dict:
+        # Unknown models are costed at the most expensive known rates - this is a worst case
+        return self.pricing.get(model) or max(self.pricing.values(), key=lambda p: p["output_per_1k"])
+
+    def _keys(self, session: Optional[str]) -> List[tuple]:
+        keys = [("global", ""), ("day", datetime.date.today().isoformat())]
+        if session:
+            keys.append(("session", session))
+        return [key for key in keys if self.limits[key[0]] is not None]
+
+    def _pooled(self, keys: List[tuple]) -> bool:
+        """True when one of the budgets is kept in the pool's shared counters"""
+        return self.counters is not None and any(key[0] != "session" for key in keys)
+
+    def _shared(self, keys: List[tuple]) -> Optional[dict]:
+        """The pool's budget totals when a shared budget applies, else None"""
+        if not self._pooled(keys):
+            return None
+        return self.counters.budget_totals(datetime.date.today().toordinal())
+
+    def _usage(self, key: tuple, shared: Optional[dict]) -> tuple:
+        """(spent, reserved) toward one budget"""
+        if shared is not None and key[0] != "session":
+            return shared["spent" if key[0] == "global" else "day_spent"], shared["reserved"]
+        return self.spent.get(key, 0.0), self.reserved.get(key, 0.0)
+
+    def _share(self, keys: List[tuple], spent: float = 0.0, reserved: float = 0.0):
+        """Publish a change in spend or holds to the pool's counters"""
+        if not self._pooled(keys):
+            return
+        days = [key[1] for key in keys if key[0] == "day"]
+        day = datetime.date.fromisoformat(days[0]) if days else datetime.date.today()
+        self.counters.add_budget(day.toordinal(), spent, reserved)
+
+    def _touch_session(self, session: Optional[str]):
+        if not session or self.limits["session"] is None:
+            return
+        self.sessions[session] = None
+        self.sessions.move_to_end(session)
+        while len(self.sessions) > MAX_SESSIONS:
+            old = self.sessions.popitem(last=False)[0]
+            if not self.reserved.get(("session", old)):
+                self.spent.pop(("session", old), None)
+
+    def _prune_days(self, today: str):
+        for key in [k for k in self.spent if k[0] == "day" and k[1] != today and not self.reserved.get(k)]:
+            del self.spent[key]
+
+    def reserve(self, model: str, session: Optional[str], prompt_tokens: int, max_tokens: int) -> Reservation:
+        """Hold the worst-case cost or raise BudgetExceeded; max_tokens may come back lower"""
+        price = self._price(model)
+        input_cost = prompt_tokens * SAFETY_MARGIN / 1000 * price["input_per_1k"]
+        per_output_token = price["output_per_1k"] / 1000
+        with self.lock:
+            keys = self._keys(session)
+            if not keys:
+                return Reservation(model, [], 0.0, prompt_tokens, max_tokens, False)
+            with self.counters.budget_lock() if self._pooled(keys) else nullcontext():
+                return self._reserve(model, session, keys, prompt_tokens, max_tokens, input_cost, per_output_token)
+
+    def _reserve(self, model: str, session: Optional[str], keys: List[tuple], prompt_tokens: int, max_tokens: int,
+                 input_cost: float, per_output_token: float) -> Reservation:
+        self._prune_days(datetime.date.today().isoformat())
+        self._touch_session(session)
+        shared = self._shared(keys)  # Read under the pool's lock, so no other worker's hold is missed
+        # The tightest budget decides how much this request may cost
+        scope, limit, used = min(((key[0], self.limits[key[0]], sum(self._usage(key, shared))) for key in keys),
+                                 key=lambda item: item[1] - item[2])
+        headroom = limit - used
+        tokens = max_tokens
+        if input_cost + tokens * per_output_token > headroom:
+            tokens = int((headroom - input_cost) / per_output_token) if per_output_token else max_tokens
+            if tokens < min(self.min_completion_tokens, max_tokens):
+                self.rejected += 1
+                raise BudgetExceeded(scope, limit, used,
+                                     input_cost + min(self.min_completion_tokens, max_tokens) * per_output_token)
+            self.shrunk += 1
+        cost = input_cost + tokens * per_output_token
+        for key in keys:
+            self.reserved[key] = self.reserved.get(key, 0.0) + cost
+        self._share(keys, reserved=cost)
+        return Reservation(model, keys, cost, prompt_tokens, tokens, tokens < max_tokens)
+
+    def extend(self, reservation: Reservation, model: str):
+        """Re-price a hold for another model (a failover target) before calling it
+
+        Raises BudgetExceeded if that model's worst case no longer fits; a
+        cheaper model keeps the larger hold, which settle() replaces anyway.
+        """
+        price = self._price(model)
+        cost = reservation.prompt_tokens * SAFETY_MARGIN / 1000 * price["input_per_1k"] + \
+            reservation.max_tokens * price["output_per_1k"] / 1000
+        with self.lock:
+            if reservation.done or cost <= reservation.cost:
+                return
+            extra = cost - reservation.cost
+            with self.counters.budget_lock() if self._pooled(reservation.keys) else nullcontext():
+                shared = self._shared(reservation.keys)
+                for key in reservation.keys:
+                    used = sum(self._usage(key, shared))
+                    if used + extra > self.limits[key[0]]:
+                        self.rejected += 1
+                        raise BudgetExceeded(key[0], self.limits[key[0]], used, cost)
+                for key in reservation.keys:
+                    self.reserved[key] = self.reserved.get(key, 0.0) + extra
+                self._share(reservation.keys, reserved=extra)
+            reservation.model = model
+            reservation.cost = cost
+
+    def settle(self, reservation: Reservation, cost: float):
+        """Replace the hold with what the request really cost"""
+        with self.lock:
+            if reservation.done:
+                return
+            reservation.done = True
+            for key in reservation.keys:
+                self._unreserve(key, reservation.cost)
+                self.spent[key] = self.spent.get(key, 0.0) + cost
+            self._share(reservation.keys, spent=cost, reserved=-reservation.cost)
+
+    def release(self, reservation: Reservation):
+        """Drop the hold of a request that failed before anything was charged"""
+        with self.lock:
+            if reservation.done:
+                return
+            reservation.done = True
+            for key in reservation.keys:
+                self._unreserve(key, reservation.cost)
+            self._share(reservation.keys, reserved=-reservation.cost)
+
+    def _unreserve(self, key: tuple, cost: float):
+        remaining = self.reserved.get(key, 0.0) - cost
+        if remaining > 1e-12:
+            self.reserved[key] = remaining
+        else:
+            self.reserved.pop(key, None)
+
+    def load_log(self, path: str = "chat_costs.log") -> float:
+        """Seed today's spend from the cost log so restarting does not reset the day budget"""
+        if self.limits["day"] is None or not os.path.exists(path):
+            return 0.0
+        today = datetime.date.today().isoformat()
+        marker = f'"timestamp": "{today}'
+        total = 0.0
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                if marker not in line:
+                    continue  # Cheap filter - most lines are from other days
+                try:
+                    total += float(json.loads(line)["cost_usd"])
+                except (ValueError, KeyError, TypeError):
+                    continue
+        with self.lock:
+            if self.counters is not None:
+                self.counters.seed_day(datetime.date.today().toordinal(), total)
+            else:
+                key = ("day", today)
+                self.spent[key] = self.spent.get(key, 0.0) + total
+        return total
+
+    def snapshot(self, session: Optional[str] = None) -> dict:
+        """Limits, spend and holds per budget (one session's, if given) for /metrics and the 'costs' command"""
+        with self.lock:
+            result = {"rejected": self.rejected, "shrunk": self.shrunk}
+            keys = self._keys(session)
+            shared = self._shared(keys)
+            for key in keys:
+                spent, reserved = self._usage(key, shared)
+                result[key[0]] = {"limit": self.limits[key[0]], "spent": round(spent, 9),
+                                  "reserved": round(reserved, 9)}
+            return result
+
+    def describe(self, session: Optional[str] = None) -> str:
+        snapshot = self.snapshot(session)
+        parts = [f"{scope} ${info['spent']:.6f} of ${info['limit']:.4f}" for scope, info in snapshot.items()
+                 if isinstance(info, dict)]
+        return "Budgets: " + (" | ".join(parts) if parts else "none set")
+
+def add_budget_args(parser):
+    """--session-budget, --daily-budget and --budget (USD) for a tool's argument parser"""
+    parser.add_argument("--session-budget", type=float, metavar="USD",
+                        help="refuse requests once one session would spend more than this")
+    parser.add_argument("--daily-budget", type=float, metavar="USD",
+                        help="refuse requests once today's spend (including earlier runs in the log) would exceed this")
+    parser.add_argument("--budget", type=float, metavar="USD",
+                        help="refuse requests once this process (or worker pool) would spend more than this in total")
@@ -6,157 +6,63 @@
 # Setup: Follow goop setup instructions, then run this script
 
 from openai import OpenAI
+import argparse
 import json
-import datetime
-from dataclasses import dataclass
-from typing import Dict, List
+from typing import List, Optional
 import os
+import sys
+import threading
+import time
+
+from anomaly_detector import upstream_seconds
+from budget import BudgetExceeded, BudgetManager, TokenEstimator, add_budget_args
+from connection_warmer import ConnectionWarmer, add_warm_args
+from conversation_store import CONTEXT_TOKENS, DEFAULT_DIR, ConversationStore
+from cost_tracking import MODEL_PRICING, CostTracker
+from max_tokens_tuner import MaxTokensTuner
+from model_cache import ModelCache
+from model_compare import compare_models, metrics_table, side_by_side
+from phase_timer import PhaseTimer, phase_stats
+from profiler import profile_run
+from tracing import KIND_INTERNAL, NULL_SPAN, add_trace_args, tracer
+from traffic_capture import capture, start_capture, stop_capture
+import reprice
+import usage_store
 
 # Configure for your goop proxy setup
 # Default goop proxy runs on localhost:8080
-client = OpenAI(base_url="http://localhost:8080/openai-proxy/v1", api_key="your-api-key")
-
-# Vertex AI Pricing (as of January 2025) - verify current rates at cloud.google.com
-# Update these rates based on your region and current Google Cloud pricing
-MODEL_PRICING = {
-    "vertex/gemini-2.0-flash-lite-001": {
-        "input_per_1k": 0.000075,   # Cheapest option
-        "output_per_1k": 0.0003,
-        "name": "Gemini 2.0 Flash Lite",
-        "speed": "Fastest (0.56s)",
-        "description": "Best for quick chat, high-volume usage"
-    },
-    "vertex/gemini-2.5-flash-preview-05-20": {
-        "input_per_1k": 0.00015,    # Preview pricing
-        "output_per_1k": 0.0006,
-        "name": "Gemini 2.5 Flash Preview", 
-        "speed": "Fast (0.70s)",
-        "description": "Latest features, experimental"
-    },
-    "vertex/gemini-2.0-flash-001": {
-        "input_per_1k": 0.00015,    # Standard pricing
-        "output_per_1k": 0.0006,
-        "name": "Gemini 2.0 Flash",
-        "speed": "Reliable (2.04s)", 
-        "description": "Most reliable, production-ready"
-    }
-}
+# The warmer keeps pooled connections open between messages (set with --warm-connections/--warm-interval)
+warmer = ConnectionWarmer()
+client = OpenAI(base_url="http://localhost:8080/openai-proxy/v1", api_key="your-api-key",
+                http_client=warmer.http_client())
+MAX_TOKENS = 500
 
-@dataclass
-class ChatCosts:
-    session_cost: float = 0.0
-    total_tokens: int = 0
-    message_count: int = 0
-    model_usage: Dict[str, float] = None
-    
-    def __post_init__(self):
-        if self.model_usage is None:
-            self.model_usage = {}
+# Chats are saved here and can be picked up again with --resume
+conversations = ConversationStore()
 
-class CostTracker:
-    def __init__(self):
-        self.session_costs = ChatCosts()
-        self.load_historical_costs()
-    
-    def calculate_cost(self, model: str, prompt_tokens: int, completion_tokens: int) -> float:
-        """Calculate cost for a single request"""
-        if model not in MODEL_PRICING:
-            print(f"Unknown model {model}, using default pricing")
-            model = "vertex/gemini-2.0-flash-001"  # Fallback to known model
-        
-        pricing = MODEL_PRICING[model]
-        input_cost = (prompt_tokens / 1000) * pricing["input_per_1k"]
-        output_cost = (completion_tokens / 1000) * pricing["output_per_1k"]
-        total_cost = input_cost + output_cost
-        
-        return total_cost
-    
-    def track_usage(self, model: str, prompt_tokens: int, completion_tokens: int) -> dict:
-        """Track usage and return cost info"""
-        cost = self.calculate_cost(model, prompt_tokens, completion_tokens)
-        
-        # Update session totals
-        self.session_costs.session_cost += cost
-        self.session_costs.total_tokens += (prompt_tokens + completion_tokens)
-        self.session_costs.message_count += 1
-        
-        # Track per-model usage
-        if model not in self.session_costs.model_usage:
-            self.session_costs.model_usage[model] = 0.0
-        self.session_costs.model_usage[model] += cost
-        
-        # Log to file for historical tracking
-        self.log_usage(model, prompt_tokens, completion_tokens, cost)
-        
-        return {
-            "request_cost": cost,
-            "session_cost": self.session_costs.session_cost,
-            "session_tokens": self.session_costs.total_tokens,
-            "message_count": self.session_costs.message_count,
-            "cost_per_message": self.session_costs.session_cost / self.session_costs.message_count if self.session_costs.message_count > 0 else 0
-        }
-    
-    def log_usage(self, model: str, prompt_tokens: int, completion_tokens: int, cost: float):
-        """Log usage to file for historical tracking"""
-        log_entry = {
-            "timestamp": datetime.datetime.now().isoformat(),
-            "model": model,
-            "prompt_tokens": prompt_tokens,
-            "completion_tokens": completion_tokens,
-            "total_tokens": prompt_tokens + completion_tokens,
-            "cost_usd": cost,
-            "session_total": self.session_costs.session_cost
-        }
-        
-        try:
-            with open("chat_costs.log", "a") as f:
-                f.write(json.dumps(log_entry) + "\n")
-        except Exception as e:
-            print(f"Could not log usage: {e}")
-    
-    def load_historical_costs(self):
-        """Load historical costs from log file"""
-        try:
-            if os.path.exists("chat_costs.log"):
-                total_historical = 0.0
-                with open("chat_costs.log", "r") as f:
-                    for line in f:
-                        try:
-                            entry = json.loads(line.strip())
-                            total_historical = entry.get("session_total", 0.0)
-                        except:
-                            continue
-                if total_historical > 0:
-                    print(f"Historical total costs: ${total_historical:.6f}")
-        except Exception:
-            pass
-    
-    def get_cost_summary(self) -> str:
-        """Get formatted cost summary"""
-        if self.session_costs.message_count == 0:
-            return "No usage yet"
-        
-        summary = f"""
-Cost Summary:
-This session: ${self.session_costs.session_cost:.6f}
-Total tokens: {self.session_costs.total_tokens:,}
-Messages: {self.session_costs.message_count}
-Avg per message: ${self.session_costs.cost_per_message:.6f}
-Models used: {len(self.session_costs.model_usage)}"""
-        
-        return summary
+# Pre-flight prompt estimates and spending limits (set with --session-budget/--daily-budget/--budget)
+estimator = TokenEstimator()
+budgets = BudgetManager(MODEL_PRICING)
 
 def select_model() -> str:
     """Let user select which model to use"""
     print("\nAvailable Models:")
-    models = list(MODEL_PRICING.keys())
+    # Hide models that verify_models.py recently found unavailable
+    cache = ModelCache()
+    models = cache.filter_available(list(MODEL_PRICING.keys()))
+    hidden = len(MODEL_PRICING) - len(models)
     
     for i, model in enumerate(models, 1):
         info = MODEL_PRICING[model]
         cost_estimate = (info["input_per_1k"] + info["output_per_1k"]) * 0.1  # Rough estimate for 100 tokens
+        latency = cache.latency(model)
+        speed = f"Verified ({latency:.2f}s)" if latency is not None else info['description']
         print(f"{i}. {info['name']}")
-        print(f"   {info['speed']} | ~${cost_estimate:.6f} per 100 tokens")
-        print(f"   {info['description']}")
+        print(f"   {speed} | ~${cost_estimate:.6f} per 100 tokens")
+        print(f"   {info['use']}")
+    
+    if hidden:
+        print(f"\n({hidden} model(s) hidden - unavailable at last check, run verify_models.py to refresh)")
     
     while True:
         try:
@@ -172,29 +78,122 @@ def select_model() -> str:
         except ValueError:
             print("Please enter a valid number")
 
-def chat():
+def select_models() -> List[str]:
+    """Let user pick several models for a side-by-side comparison"""
+    models = ModelCache().filter_available(list(MODEL_PRICING.keys()))
+    print("\nCompare which models?")
+    for i, model in enumerate(models, 1):
+        print(f"{i}. {MODEL_PRICING[model]['name']}")
+    
+    while True:
+        choice = input(f"\nModels (e.g. 1,3) or press Enter for all: ").strip().lower()
+        if not choice or choice == "all":
+            return models
+        try:
+            numbers = [int(part) for part in choice.replace(" ", "").split(",") if part]
+        except ValueError:
+            numbers = []
+        if numbers and all(1 <= n <= len(models) for n in numbers):
+            return [models[n - 1] for n in dict.fromkeys(numbers)]
+        print(f"Please enter numbers between 1 and {len(models)}, separated by commas")
+
+COMPARE_PANEL_LINES = 6  # Streaming preview rows per model while a comparison runs
+
+def run_compare(cost_tracker: CostTracker):
+    """Ask one prompt of several models at once and show the replies side by side"""
+    models = select_models()
+    prompt = input("Prompt: ").strip()
+    if not prompt:
+        return
+    names = {model: MODEL_PRICING[model]["name"] for model in models}
+    texts = {model: "" for model in models}
+    status = {model: "waiting" for model in models}
+    lock = threading.Lock()
+    live = sys.stdout.isatty()
+    drawn = [0]  # Lines of the live panel currently on screen
+    last_draw = [0.0]
+    
+    def draw(force=False):
+        # Redraw the panel in place at most ~10 times a second
+        now = time.perf_counter()
+        if not live or (not force and now - last_draw[0] < 0.1):
+            return
+        last_draw[0] = now
+        columns = [(f"{names[m]} [{status[m]}]", texts[m]) for m in models]
+        panel = side_by_side(columns, tail=COMPARE_PANEL_LINES)
+        out = f"\033[{drawn[0]}F" if drawn[0] else ""
+        out += "".join(f"\033[2K{line}\n" for line in panel)
+        sys.stdout.write(out)
+        sys.stdout.flush()
+        drawn[0] = len(panel)
+    
+    def on_event(kind, model, payload):
+        with lock:
+            if kind == "delta":
+                texts[model] += payload
+                status[model] = "streaming"
+            else:
+                status[model] = "error" if payload["error"] else f"{payload['latency_s']:.2f}s"
+            draw(force=kind == "done")
+    
+    print(f"Asking {len(models)} models...")
+    summary = compare_models(client, models, [{"role": "user", "content": prompt}], cost_tracker,
+                             max_tokens=MAX_TOKENS, on_event=on_event, budgets=budgets, session="cli",
+                             estimator=estimator)
+    with lock:
+        if drawn[0]:
+            # Swap the live preview for the full replies
+            sys.stdout.write(f"\033[{drawn[0]}F\033[J")
+        live = False
+    print()
+    print("\n".join(side_by_side([(names[r["model"]], r["text"] or r["error"] or "") for r in summary["results"]])))
+    print()
+    print(metrics_table(summary, names))
+    for result in summary["results"]:
+        for alert in result.get("anomalies", []):
+            print(f"ANOMALY: {alert['message']}")
+
+def chat(resume: Optional[str] = None, context_tokens: int = CONTEXT_TOKENS, save: bool = True):
     print("AI Chat with Cost Tracking")
     print("=" * 50)
     
     # Initialize cost tracker
     cost_tracker = CostTracker()
     
+    # Learn per-model reply lengths so max_tokens fits what each model actually needs
+    tuner = MaxTokensTuner(max_tokens=MAX_TOKENS, pricing=MODEL_PRICING)
+    tuner.load_log(cost_tracker.log_file)
+    
     # Let user select model
     selected_model = select_model()
     model_info = MODEL_PRICING[selected_model]
     
     print(f"\nUsing: {model_info['name']}")
-    print(f"Speed: {model_info['speed']}")
+    print(f"Speed: {model_info['description']}")
     print(f"Input: ${model_info['input_per_1k']}/1K tokens | Output: ${model_info['output_per_1k']}/1K tokens")
-    print(f"{model_info['description']}")
+    print(f"{model_info['use']}")
     
-    print("\nCommands: 'quit', 'exit', 'bye' to exit | 'switch' to change model | 'costs' for summary")
+    print("\nCommands: 'quit', 'exit', 'bye' to exit | 'switch' to change model | 'costs' for summary | "
+          "'timings' for phase timings | 'limits' for max_tokens caps | 'compare' to ask several models at once")
     print("=" * 70)
     
     conversation_history = []
+    conversation = None  # Opened on resume, or created on the first reply
+    if resume:
+        conversation_id = conversations.latest() if resume == "latest" else resume
+        if not conversation_id or not conversations.exists(conversation_id):
+            print(f"No saved conversation {resume!r} in {conversations.root}/ - starting a new one")
+        else:
+            conversation = conversations.open(conversation_id, create=False)
+            # Only the newest messages that fit the token budget are read, however long the conversation is
+            conversation_history = [{"role": m["role"], "content": m["content"]}
+                                    for m in conversation.tail(max_tokens=context_tokens)]
+            print(f"Resumed {conversation_id}: last {len(conversation_history)} of {len(conversation)} messages "
+                  f"(~{estimator.estimate(selected_model, conversation_history)} tokens of context)")
     
     try:
         while True:
+            span = NULL_SPAN  # This message's trace, once it is sent
             try:
                 user_message = input("\nYou: ")
                 
@@ -212,12 +211,30 @@ def chat():
                 
                 if user_message.lower().strip() == 'costs':
                     print(cost_tracker.get_cost_summary())
+                    if budgets.enabled:
+                        print(budgets.describe("cli"))
+                    continue
+                
+                if user_message.lower().strip() == 'timings':
+                    print(phase_stats.report())
+                    print(warmer.describe())
+                    continue
+                
+                if user_message.lower().strip() == 'limits':
+                    print(tuner.report())
+                    continue
+                
+                if user_message.lower().strip() == 'compare':
+                    run_compare(cost_tracker)
                     continue
                 
                 if not user_message.strip():
                     print("Please enter a message, or type 'quit' to exit.")
                     continue
                 
+                span = tracer.trace("chat message", kind=KIND_INTERNAL,
+                                    attributes={"gen_ai.request.model": selected_model})
+                
                 # Add to conversation history
                 conversation_history.append({"role": "user", "content": user_message})
                 
@@ -225,29 +242,88 @@ def chat():
                 if len(conversation_history) > 20:
                     conversation_history = conversation_history[-20:]
                 
-                print("AI is thinking...", end="", flush=True)
+                prompt_chars = sum(len(m["content"]) for m in conversation_history)
+                prompt_estimate = estimator.estimate(selected_model, conversation_history)
+                plan = tuner.plan(selected_model, prompt_estimate)
+                try:
+                    hold = budgets.reserve(selected_model, "cli", prompt_estimate, plan["max_tokens"])
+                except BudgetExceeded as e:
+                    conversation_history.pop()  # Never sent - keep the conversation consistent
+                    print(f"   BLOCKED: {e}")
+                    span.set({"goop.blocked": e.scope})
+                    continue
+                if hold.shrunk:
+                    # The budget's cap, not the tuner's - a truncation here says nothing about reply lengths
+                    plan = dict(plan, max_tokens=hold.max_tokens, tuned=False)
+                    print(f"   Budget nearly spent - reply limited to {hold.max_tokens} tokens")
+                thinking = "AI is thinking..."
+                if plan["tuned"]:
+                    thinking += f" (est. ~{plan['expected_completion_tokens']} tokens, ~${plan['expected_cost']:.6f}"
+                    if plan["expected_latency_s"] is not None:
+                        thinking += f", ~{plan['expected_latency_s']:.1f}s"
+                    thinking += ")"
+                print(thinking, end="", flush=True)
+                started = time.time()
+                timer = PhaseTimer()
                 
                 # Get AI response
-                response = client.chat.completions.create(
-                    model=selected_model,
-                    messages=conversation_history,
-                    max_tokens=500,
-                    temperature=0.7
-                )
+                try:
+                    with timer.phase("upstream"):
+                        response = client.chat.completions.create(
+                            model=selected_model,
+                            messages=conversation_history,
+                            max_tokens=plan["max_tokens"],
+                            temperature=0.7
+                        )
+                except BaseException:
+                    budgets.release(hold)
+                    raise
                 
                 ai_message = response.choices[0].message.content
+                finish_reason = response.choices[0].finish_reason
                 conversation_history.append({"role": "assistant", "content": ai_message})
                 
                 # Calculate and track costs
                 usage = response.usage
-                cost_info = cost_tracker.track_usage(
-                    selected_model,
-                    usage.prompt_tokens,
-                    usage.completion_tokens
-                )
+                with timer.phase("cost"):
+                    cost_info = cost_tracker.track_usage(
+                        selected_model,
+                        usage.prompt_tokens,
+                        usage.completion_tokens,
+                        log=False,
+                        latency=upstream_seconds(timer.as_dict())
+                    )
+                    budgets.settle(hold, cost_info["request_cost"])
+                    estimator.observe(selected_model, prompt_estimate, usage.prompt_tokens)
+                with timer.phase("log"):
+                    cost_tracker.log_usage(selected_model, usage.prompt_tokens, usage.completion_tokens,
+                                           cost_info["request_cost"], timer.as_dict(),
+                                           max_tokens=plan["max_tokens"], finish_reason=finish_reason,
+                                           max_tokens_tuned=plan["tuned"])
+                phase_stats.add(timer)
+                span.set({"gen_ai.usage.input_tokens": usage.prompt_tokens,
+                          "gen_ai.usage.output_tokens": usage.completion_tokens,
+                          "gen_ai.response.finish_reasons": [finish_reason], "goop.cost_usd": cost_info["request_cost"]})
+                upstream_ms = timer.as_dict().get("upstream")
+                tuner.observe(selected_model, usage.completion_tokens, finish_reason, plan["max_tokens"],
+                              plan["tuned"], latency=upstream_ms / 1000 if upstream_ms else None)
+                capture(started, src="cli", status="ok", model=selected_model, req_model=selected_model,
+                        prompt_chars=prompt_chars, prompt_tokens=usage.prompt_tokens,
+                        completion_tokens=usage.completion_tokens, max_tokens=plan["max_tokens"],
+                        latency_ms=round((time.time() - started) * 1000, 3),
+                        upstream_ms=upstream_ms, cost=cost_info["request_cost"])
+                
+                if save:
+                    if conversation is None:
+                        conversation = conversations.create(title=user_message, model=selected_model)
+                    conversation.append("user", user_message)
+                    conversation.append("assistant", ai_message, selected_model, tokens=usage.completion_tokens)
                 
                 # Clear thinking message and show response
-                print(f"\rAI: {ai_message}")
+                print("\r" + " " * len(thinking) + "\r", end="")
+                print(f"AI: {ai_message}")
+                if finish_reason == "length":
+                    print(f"   (reply cut off at max_tokens={plan['max_tokens']} - caps widen automatically if this repeats)")
                 
                 # Show cost information
                 print(f"   Cost: ${cost_info['request_cost']:.6f} | "
@@ -259,25 +335,34 @@ def chat():
                 if cost_info['session_cost'] > 0.01:  # 1 cent
                     print(f"   WARNING: Session cost exceeded $0.01")
                 
-                if cost_info['request_cost'] > 0.001:  # 0.1 cent per message
-                    print(f"   HIGH COST: Message cost ${cost_info['request_cost']:.6f}")
+                # Unusual for this model, rather than above a fixed dollar amount
+                for alert in cost_info.get("anomalies", []):
+                    print(f"   ANOMALY: {alert['message']}")
                 
             except KeyboardInterrupt:
                 print(cost_tracker.get_cost_summary())
                 print("\nChat interrupted. Cost log saved!")
                 break
             except Exception as e:
+                span.fail(e)
                 print(f"\nError: {e}")
                 print("Continuing chat... (type 'quit' to exit)")
+            finally:
+                span.end()
                 
     except Exception as e:
         print(f"\nFatal error: {e}")
     
     print(f"\nChat session ended.")
     print(f"Costs logged to: chat_costs.log")
+    if conversation is not None:
+        print(f"Conversation saved as {conversation.id} (resume with --resume {conversation.id})")
 
 def show_cost_analysis():
-    """Analyze historical costs from log file"""
+    """Analyze historical costs from the usage store if open, else the log file"""
+    if usage_store.store is not None:
+        show_store_analysis(usage_store.store)
+        return
     try:
         if not os.path.exists("chat_costs.log"):
             print("No cost history found. Start chatting to generate data!")
@@ -323,10 +408,11 @@ def show_cost_analysis():
             print(f"- {model_name}")
             print(f"  ${stats['cost']:.6f} | {stats['tokens']:,} tokens | {stats['messages']} messages")
         
-        # Monthly projection
+        # Monthly burn from the last 30 days of history, and what the same traffic costs on other models
         if message_count > 0:
-            avg_daily = total_cost  # Assuming this is daily usage
-            monthly_projection = avg_daily * 30
+            simulation = reprice.simulate(reprice.UsageColumns().load_log("chat_costs.log"), MODEL_PRICING)
+            reprice.print_simulation(simulation)
+            monthly_projection = simulation["scenarios"][0]["monthly_burn_usd"]
             print(f"\nMonthly projection: ${monthly_projection:.2f}")
             if monthly_projection > 10:
                 print("WARNING: High projected monthly cost!")
@@ -334,7 +420,51 @@ def show_cost_analysis():
     except Exception as e:
         print(f"Error analyzing costs: {e}")
 
-def main():
+def show_store_analysis(store: usage_store.UsageStore):
+    """Time-range and per-model cost queries against the SQLite usage store"""
+    if os.path.exists("chat_costs.log"):
+        imported = store.import_log("chat_costs.log")  # Records written before the store was enabled
+        if imported:
+            print(f"Imported {imported:,} records from chat_costs.log")
+    period = input("Period (Enter for all time, e.g. today, 7d, tuesday, 2025-01-14, 2025-01-01..2025-01-31): ")
+    try:
+        start, end, label = usage_store.parse_period(period)
+    except ValueError:
+        print(f"Unrecognized period {period!r} - showing all time")
+        start, end, label = None, None, "all time"
+    models = store.models()
+    for i, model in enumerate(models, 1):
+        print(f"{i}. {MODEL_PRICING.get(model, {}).get('name', model)}")
+    choice = input("Model number (Enter for all): ").strip()
+    model = models[int(choice) - 1] if choice.isdigit() and 1 <= int(choice) <= len(models) else None
+    usage_store.print_report(store, start, end, model, label=label)
+    store.flush()
+    reprice.print_simulation(reprice.simulate(reprice.UsageColumns().load_db(store.path), MODEL_PRICING))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="AI chat with real-time cost tracking through goop proxy")
+    parser.add_argument("--profile", action="store_true",
+                        help="profile the session and write collapsed stacks plus a cProfile dump to profiles/")
+    parser.add_argument("--capture", metavar="FILE",
+                        help="record sanitized request traces for benchmarks/replay_traffic.py (.gz to compress)")
+    parser.add_argument("--tabs", action="store_true",
+                        help="non-blocking chat: Ctrl-C cancels a reply, several named conversations at once")
+    parser.add_argument("--usage-db", metavar="FILE", default=os.environ.get("GOOP_USAGE_DB"),
+                        help="also record usage in an indexed SQLite database (e.g. chat_costs.db; env GOOP_USAGE_DB)")
+    parser.add_argument("--resume", nargs="?", const="latest", metavar="ID",
+                        help="continue a saved conversation (the most recent one if no id is given)")
+    parser.add_argument("--context-tokens", type=int, default=CONTEXT_TOKENS, metavar="N",
+                        help=f"on --resume, send back only the newest messages that fit N tokens "
+                             f"(default {CONTEXT_TOKENS})")
+    parser.add_argument("--conversations", default=DEFAULT_DIR, metavar="DIR",
+                        help=f"where conversations are saved (default {DEFAULT_DIR}/)")
+    parser.add_argument("--no-save", action="store_true", help="don't save this conversation")
+    add_budget_args(parser)
+    add_warm_args(parser)
+    add_trace_args(parser)
+    return parser.parse_args()
+
+def run(tabs: bool = False, resume: Optional[str] = None, context_tokens: int = CONTEXT_TOKENS, save: bool = True):
     print("AI Chat with Cost Tracking")
     print("Built for goop proxy: https://github.com/robertprast/goop")
     print("\nOptions:")
@@ -354,11 +484,37 @@ def main():
                 max_tokens=5
             )
             print("Connection to goop proxy working")
-            chat()
         except Exception as e:
             print(f"Cannot connect to goop proxy: {e}")
             print("Make sure goop proxy is running on http://localhost:8080")
             print("Follow setup instructions: https://github.com/robertprast/goop")
+            return
+        if tabs:
+            from async_chat import run_tabs  # Imports this module, so load it on demand
+            run_tabs()
+        else:
+            warmer.start(client)
+            chat(resume, context_tokens, save)
+
+def main():
+    args = parse_args()
+    if args.capture:
+        start_capture(args.capture)
+    if args.usage_db:
+        usage_store.open_store(args.usage_db)
+    budgets.configure(args)
+    if budgets.enabled:
+        print(budgets.describe("cli"))
+    warmer.configure(args)
+    tracer.configure(args, "chat_with_costs")
+    conversations.root = args.conversations
+    try:
+        with profile_run("chat_with_costs", enabled=args.profile):
+            run(tabs=args.tabs, resume=args.resume, context_tokens=args.context_tokens, save=not args.no_save)
+    finally:
+        stop_capture()
+        conversations.close()
+        tracer.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,157 @@
+# concurrency_sweep.py - Per-Model Concurrency Scaling Sweep
+#
+# Ramps concurrent requests to each model through the goop proxy (1, 4, 16,
+# 64 by default) and measures requests/sec, tokens/sec, latency
+# percentiles and error/throttle rates at every level, then reports where
+# throughput stops scaling. Runs are appended to a JSON history file so
+# capacity can be compared across proxy, quota or region changes
+# Used by: verify_models.py --sweep
+# Dependencies: pip install openai
+
+import datetime
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+DEFAULT_LEVELS = [1, 4, 16, 64]
+HISTORY_FILE = "concurrency_sweep.json"
+SWEEP_PROMPT = "Count from 1 to 20, separated by spaces."
+SWEEP_MAX_TOKENS = 64
+SCALING_THRESHOLD = 1.10  # A level must add 10% throughput to count as scaling
+MAX_ERROR_RATE = 0.05     # Levels with more failures than this are past saturation
+ABORT_ERROR_RATE = 0.5    # Stop ramping a model that mostly fails
+
+def is_throttle(error: Exception) -> bool:
+    """Rate limiting / quota errors, as opposed to other failures"""
+    if getattr(error, "status_code", None) == 429:
+        return True
+    text = str(error).upper()
+    return "429" in text or "RESOURCE_EXHAUSTED" in text or "RATE LIMIT" in text or "QUOTA" in text
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def run_level(client, model: str, concurrency: int, requests: int, timeout: float = 60) -> dict:
+    """Closed-loop load: `concurrency` workers issue `requests` calls back to back"""
+    latencies = []
+    completion_tokens = 0
+    errors = 0
+    throttled = 0
+    remaining = [requests]
+    lock = threading.Lock()
+
+    def worker():
+        nonlocal completion_tokens, errors, throttled
+        while True:
+            with lock:
+                if remaining[0] == 0:
+                    return
+                remaining[0] -= 1
+            start_time = time.perf_counter()
+            try:
+                response = client.chat.completions.create(
+                    model=model,
+                    messages=[{"role": "user", "content": SWEEP_PROMPT}],
+                    max_tokens=SWEEP_MAX_TOKENS,
+                    timeout=timeout
+                )
+                latency = time.perf_counter() - start_time
+                tokens = response.usage.completion_tokens if response.usage else 0
+                with lock:
+                    latencies.append(latency)
+                    completion_tokens += tokens
+            except Exception as e:
+                with lock:
+                    errors += 1
+                    if is_throttle(e):
+                        throttled += 1
+
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    wall = time.perf_counter() - wall_start
+
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "ok": len(latencies),
+        "wall_s": round(wall, 3),
+        "requests_per_sec": round(len(latencies) / wall, 3),
+        "tokens_per_sec": round(completion_tokens / wall, 1),
+        "latency_p50": round(percentile(latencies, 50), 3),
+        "latency_p95": round(percentile(latencies, 95), 3),
+        "latency_p99": round(percentile(latencies, 99), 3),
+        "error_rate": round(errors / requests, 4),
+        "throttle_rate": round(throttled / requests, 4),
+    }
+
+def find_saturation(levels: List[dict]) -> dict:
+    """Highest level that still added throughput without excess errors"""
+    best = None
+    reason = "still scaling at highest level tested"
+    for level in levels:
+        if level["error_rate"] > MAX_ERROR_RATE:
+            reason = f"{level['error_rate']:.0%} errors at {level['concurrency']}"
+            break
+        if best is not None and level["requests_per_sec"] < best["requests_per_sec"] * SCALING_THRESHOLD:
+            reason = f"throughput flattened at {level['concurrency']}"
+            break
+        best = level
+    if best is None:
+        return {"concurrency": None, "requests_per_sec": 0.0, "reason": reason}
+    return {
+        "concurrency": best["concurrency"],
+        "requests_per_sec": best["requests_per_sec"],
+        "tokens_per_sec": best["tokens_per_sec"],
+        "reason": reason,
+    }
+
+def sweep_model(client, model: str, levels: List[int] = None, requests_per_level: Optional[int] = None,
+                on_level=None) -> dict:
+    """Run every concurrency level for one model (stops early if it mostly fails)"""
+    results = []
+    for concurrency in levels or DEFAULT_LEVELS:
+        # Enough requests that every worker completes several
+        requests = requests_per_level or max(20, concurrency * 4)
+        level = run_level(client, model, concurrency, requests)
+        results.append(level)
+        if on_level:
+            on_level(level)
+        if level["error_rate"] >= ABORT_ERROR_RATE:
+            break
+    return {"model": model, "levels": results, "saturation": find_saturation(results)}
+
+def load_history(path: str = HISTORY_FILE) -> List[dict]:
+    if not os.path.exists(path):
+        return []
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+def save_run(models: List[dict], path: str = HISTORY_FILE) -> dict:
+    """Append this sweep to the history file (atomically) and return the stored run"""
+    history = load_history(path)
+    run = {"time": datetime.datetime.now().isoformat(timespec="seconds"), "models": models}
+    history.append(run)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(history, f, indent=2)
+    os.replace(tmp_path, path)
+    return run
+
+def previous_levels(history: List[dict], model: str) -> Dict[int, dict]:
+    """Level results for `model` from the most recent earlier run that tested it"""
+    for run in reversed(history):
+        for entry in run["models"]:
+            if entry["model"] == model:
+                return {level["concurrency"]: level for level in entry["levels"]}
+    return {}
@@ -0,0 +1,198 @@
+# connection_warmer.py - Upstream Connection Pre-Warming and Keep-Warm
+#
+# The first request after startup or an idle spell pays for a new TCP
+# connection (and a TLS handshake, for a remote proxy) plus the proxy's own
+# cold paths. ConnectionWarmer.http_client() gives the OpenAI client a
+# connection pool whose idle connections live long enough to be kept warm;
+# warm() opens several of them at startup and a background thread pings
+# the proxy (GET {base_url}/models - no tokens, no cost) whenever the pool
+# has been idle, within a pings-per-hour budget. Every request through the
+# client is classed cold (it had to open a connection) or warm (it reused
+# one) from the HTTP client's connection trace, and latency to response
+# headers is kept separately for each. The client also carries tracing.py's
+# hooks, which send a traceparent header with requests made inside a trace
+# Used by: chat_with_costs.py, web_chat.py, verify_models.py, benchmarks/replay_traffic.py
+# Dependencies: pip install openai (uses its bundled HTTP client)
+
+import collections
+import threading
+import time
+
+import openai
+
+from phase_timer import PhaseStats, PhaseTimer
+from tracing import tracer
+
+WARM_CONNECTIONS = 2    # Connections opened at startup and pinged when idle (0 disables warming)
+WARM_INTERVAL = 30.0    # Seconds of idle time before a keep-warm ping
+WARM_BUDGET = 240       # Pings per hour, at most
+KEEPALIVE_EXPIRY = 120  # Seconds an idle pooled connection is kept (the HTTP client's default is 5)
+PING_TIMEOUT = 5.0
+
+class _CallTrace:
+    """Connection trace for one HTTP request: when it started and whether it opened a connection"""
+    __slots__ = ("started", "cold", "ping")
+
+    def __init__(self, ping: bool):
+        self.started = time.perf_counter()
+        self.cold = False
+        self.ping = ping
+
+    def __call__(self, event_name: str, info: dict):
+        if event_name in ("connection.connect_tcp.started", "connection.connect_unix_socket.started"):
+            self.cold = True
+
+class ConnectionWarmer:
+    """Opens upstream connections ahead of time, keeps them alive and measures cold vs warm latency"""
+
+    def __init__(self, connections: int = WARM_CONNECTIONS, interval: float = WARM_INTERVAL,
+                 budget: int = WARM_BUDGET, keepalive: float = KEEPALIVE_EXPIRY):
+        self.connections = connections
+        self.interval = interval
+        self.budget = budget
+        self.keepalive = keepalive
+        self.stats = PhaseStats()  # "cold" and "warm" for real requests, "ping" for keep-warm pings
+        self.ping_times = collections.deque()  # Monotonic times of pings in the last hour
+        self.last_activity = 0.0
+        self.pings = 0
+        self.ping_failures = 0
+        self.skipped = 0  # Pings the budget did not allow
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def configure(self, args):
+        """Take settings from add_warm_args() options"""
+        self.connections = args.warm_connections
+        self.interval = args.warm_interval
+        self.budget = args.warm_budget
+
+    # HTTP client hooks - they run on the thread that makes the request
+
+    def http_client(self, **kwargs):
+        """HTTP client for OpenAI(http_client=...) with long-lived keep-alive and cold/warm tracking"""
+        defaults = openai.DEFAULT_CONNECTION_LIMITS
+        limits = type(defaults)(max_connections=defaults.max_connections,
+                                max_keepalive_connections=defaults.max_keepalive_connections,
+                                keepalive_expiry=self.keepalive)
+        return openai.DefaultHttpxClient(limits=limits, event_hooks={"request": [self._on_request, tracer.on_request],
+                                                                      "response": [self._on_response,
+                                                                                   tracer.on_response]}, **kwargs)
+
+    def _on_request(self, request):
+        request.extensions["trace"] = _CallTrace(getattr(self.local, "pinging", False))
+
+    def _on_response(self, response):
+        trace = response.request.extensions.get("trace")
+        if not isinstance(trace, _CallTrace):
+            return
+        elapsed = time.perf_counter() - trace.started
+        timer = PhaseTimer(enabled=True)
+        timer.record("ping" if trace.ping else "cold" if trace.cold else "warm", elapsed)
+        self.stats.add(timer)
+        self.local.last_cold = trace.cold
+        self.last_activity = time.monotonic()
+
+    def last_request_cold(self):
+        """Whether the latest request made on this thread had to open a connection (None before any)"""
+        return getattr(self.local, "last_cold", None)
+
+    # Pinging
+
+    def _allow_ping(self) -> bool:
+        now = time.monotonic()
+        with self.lock:
+            while self.ping_times and now - self.ping_times[0] > 3600:
+                self.ping_times.popleft()
+            if len(self.ping_times) >= self.budget:
+                self.skipped += 1
+                return False
+            self.ping_times.append(now)
+            return True
+
+    def ping(self, client) -> bool:
+        """One cheap request that keeps (or opens) a pooled connection; any HTTP answer counts"""
+        if not self._allow_ping():
+            return False
+        self.local.pinging = True
+        try:
+            client.with_options(timeout=PING_TIMEOUT, max_retries=0).models.list()
+        except openai.APIStatusError:
+            pass  # The proxy answered - the connection is up even if it has no /models
+        except Exception:
+            with self.lock:
+                self.ping_failures += 1
+            return False
+        finally:
+            self.local.pinging = False
+            with self.lock:
+                self.pings += 1
+        return True
+
+    def warm(self, client) -> int:
+        """Open up to `connections` pooled connections at once; returns how many pings succeeded"""
+        if self.connections <= 0:
+            return 0
+        results = []
+        # Concurrent pings so each needs its own connection instead of reusing the first
+        threads = [threading.Thread(target=lambda: results.append(self.ping(client)), daemon=True)
+                   for _ in range(self.connections)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(PING_TIMEOUT + 1)
+        return sum(1 for ok in results if ok)
+
+    def start(self, client):
+        """Warm the pool now, then keep it warm in the background while idle"""
+        if self.connections <= 0 or (self.thread and self.thread.is_alive()):
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, args=(client,), daemon=True, name="connection-warmer")
+        self.thread.start()
+
+    def _run(self, client):
+        interval = min(self.interval, self.keepalive / 2)  # Ping before the pool lets connections expire
+        self.warm(client)
+        while not self.stop_event.wait(interval):
+            if time.monotonic() - self.last_activity >= interval:
+                self.warm(client)  # Real traffic keeps the pool warm on its own; only idle spells need pings
+
+    def stop(self):
+        self.stop_event.set()
+
+    # Reporting
+
+    def snapshot(self) -> dict:
+        """Cold and warm request latency (to response headers) plus ping accounting, for /metrics"""
+        with self.lock:
+            pings = {"sent": self.pings, "failed": self.ping_failures, "skipped": self.skipped,
+                     "last_hour": len(self.ping_times), "budget_per_hour": self.budget}
+        phases = self.stats.snapshot()
+        return {"cold": phases.get("cold", {"count": 0}), "warm": phases.get("warm", {"count": 0}),
+                "ping": phases.get("ping", {"count": 0}), "pings": pings, "connections": self.connections,
+                "interval_s": self.interval,
+                "idle_s": round(time.monotonic() - self.last_activity, 1) if self.last_activity else None}
+
+    def describe(self) -> str:
+        snapshot = self.snapshot()
+        parts = []
+        for kind in ("cold", "warm"):
+            stats = snapshot[kind]
+            if stats["count"]:
+                parts.append(f"{kind} {stats['count']} avg {stats['avg_ms']:.0f}ms p95 <={stats['p95_ms']:g}ms")
+            else:
+                parts.append(f"{kind} 0")
+        return (f"Upstream connections: {' | '.join(parts)} | "
+                f"{snapshot['pings']['sent']} keep-warm pings ({snapshot['pings']['last_hour']} in the last hour)")
+
+def add_warm_args(parser):
+    """--warm-connections, --warm-interval and --warm-budget for a tool's argument parser"""
+    parser.add_argument("--warm-connections", type=int, default=WARM_CONNECTIONS, metavar="N",
+                        help=f"upstream connections to open at startup and keep warm while idle, 0 to disable "
+                             f"(default {WARM_CONNECTIONS})")
+    parser.add_argument("--warm-interval", type=float, default=WARM_INTERVAL, metavar="SECONDS",
+                        help=f"idle time before a keep-warm ping (default {WARM_INTERVAL:g}s)")
+    parser.add_argument("--warm-budget", type=int, default=WARM_BUDGET, metavar="PINGS",
+                        help=f"at most this many keep-warm pings per hour (default {WARM_BUDGET})")
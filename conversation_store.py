@@ -0,0 +1,470 @@
+# conversation_store.py - Persistent, Resumable Conversations in Append-Only Segments
+#
+# Each conversation is one segment file of JSON lines - a header line, then
+# one line per message, only ever appended to - plus an index of fixed-size
+# entries (byte offset, length and estimated tokens of every message).
+# Resuming walks the index backwards from the end until a token budget is
+# spent and reads just that tail through a memory map, so opening a
+# conversation costs the same however long it is. Listing reads one header
+# line per conversation; search scans the mapped segments with a regex.
+# Conversations idle for a while can be compacted: the segment is gzipped
+# and the index kept, and the first resume unpacks it again. An open
+# conversation holds a shared lock on its index, so compaction skips
+# conversations any process has open. A crash between the segment and
+# index writes is repaired on open
+# Used by: chat_with_costs.py (--resume), transcript_store.py (web_chat.py --conversations)
+# Dependencies: none (standard library only)
+# Usage: python conversation_store.py list | show ID | search TEXT | compact [--days 30]
+
+import argparse
+import bisect
+import datetime
+import gzip
+import json
+import mmap
+import os
+import re
+import secrets
+import shutil
+import struct
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows - one writer per conversation is assumed there
+    fcntl = None
+
+DEFAULT_DIR = "conversations"
+ENTRY = struct.Struct("<QII")   # Offset of the message line in the segment, its length, estimated tokens
+MESSAGE_OVERHEAD = 4            # Role and formatting tokens per message, as budget.TokenEstimator counts them
+CONTEXT_TOKENS = 4000           # Default token budget for a resumed tail
+MAX_OPEN = 64                   # Conversations kept open (file handles and maps) at once
+COMPACT_DAYS = 30
+VALID_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token) plus per-message overhead"""
+    return max(1, len(text) // 4) + MESSAGE_OVERHEAD
+
+def _pread(fd: int, size: int, offset: int) -> bytes:
+    if hasattr(os, "pread"):
+        return os.pread(fd, size, offset)
+    os.lseek(fd, offset, os.SEEK_SET)  # Windows - callers hold the conversation lock
+    return os.read(fd, size)
+
+class Conversation:
+    """One open conversation: appends go to the segment and index, reads come from a memory map"""
+
+    def __init__(self, root: str, conversation_id: str):
+        self.id = conversation_id
+        self.segment_path = os.path.join(root, conversation_id + ".seg")
+        self.index_path = os.path.join(root, conversation_id + ".idx")
+        self.lock = threading.RLock()
+        self.segment = None
+        self.map = None
+        self.mapped_size = 0
+        with self.lock:
+            self._open()
+
+    def _open(self):
+        # Also reopens a conversation the store closed to stay under MAX_OPEN while it was still in use
+        if self.segment is not None:
+            return
+        self.index = os.open(self.index_path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o600)
+        if fcntl is not None:
+            fcntl.flock(self.index, fcntl.LOCK_SH)  # Held while open: compact() leaves the segment alone
+        self._unpack()
+        self.segment = os.open(self.segment_path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o600)
+        with self._file_lock():
+            self._repair()
+
+    def _unpack(self):
+        """Restore a compacted segment; a process opening it at the same moment waits and finds it done"""
+        packed = self.segment_path + ".gz"
+        try:
+            fd = os.open(packed, os.O_RDONLY)
+        except FileNotFoundError:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            if os.fstat(fd).st_nlink == 0:
+                return  # Another process unpacked it while we waited
+            tmp_path = f"{self.segment_path}.{os.getpid()}.tmp"
+            with open(fd, "rb", closefd=False) as raw, gzip.GzipFile(fileobj=raw) as source, \
+                    open(tmp_path, "wb") as target:
+                shutil.copyfileobj(source, target)
+            os.replace(tmp_path, self.segment_path)
+            os.remove(packed)
+        finally:
+            os.close(fd)
+
+    @contextmanager
+    def _file_lock(self):
+        # Serializes writers in other processes (e.g. several web_chat workers) on the same conversation
+        if fcntl is None:
+            yield
+            return
+        fcntl.flock(self.segment, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self.segment, fcntl.LOCK_UN)
+
+    def _repair(self):
+        """Make the index and segment agree after a crash between (or during) their writes"""
+        segment_size = os.fstat(self.segment).st_size
+        index_size = os.fstat(self.index).st_size
+        entries = index_size // ENTRY.size
+        # Index entries whose message never fully reached the segment
+        while entries:
+            offset, length, _ = self._entry(entries - 1)
+            if offset + length <= segment_size:
+                break
+            entries -= 1
+        if entries * ENTRY.size != index_size:
+            os.ftruncate(self.index, entries * ENTRY.size)
+        end = sum(self._entry(entries - 1)[:2]) if entries else self._header_end(segment_size)
+        if end >= segment_size:
+            return
+        # Messages written to the segment but not the index - index complete lines, drop a torn last one
+        os.lseek(self.segment, end, os.SEEK_SET)
+        tail = os.read(self.segment, segment_size - end)
+        position = 0
+        while True:
+            newline = tail.find(b"\n", position)
+            if newline < 0:
+                break
+            line = tail[position:newline + 1]
+            try:
+                content = json.loads(line).get("content", "")
+            except ValueError:
+                break
+            os.write(self.index, ENTRY.pack(end + position, len(line), estimate_tokens(content)))
+            position = newline + 1
+        if end + position < segment_size:
+            os.ftruncate(self.segment, end + position)
+
+    def _header_end(self, segment_size: int) -> int:
+        if not segment_size:
+            return 0
+        os.lseek(self.segment, 0, os.SEEK_SET)
+        first = os.read(self.segment, min(segment_size, 8192))
+        newline = first.find(b"\n")
+        return newline + 1 if newline >= 0 else segment_size
+
+    def _entry(self, position: int) -> tuple:
+        return ENTRY.unpack(_pread(self.index, ENTRY.size, position * ENTRY.size))
+
+    def _entries(self, first: int, last: int) -> List[tuple]:
+        return list(ENTRY.iter_unpack(_pread(self.index, (last - first) * ENTRY.size, first * ENTRY.size)))
+
+    def __len__(self) -> int:
+        with self.lock:
+            self._open()
+            return os.fstat(self.index).st_size // ENTRY.size
+
+    def _view(self):
+        """The segment mapped read-only, remapped when it has grown"""
+        size = os.fstat(self.segment).st_size
+        if size != self.mapped_size:
+            if self.map is not None:
+                self.map.close()
+            self.map = mmap.mmap(self.segment, size, access=mmap.ACCESS_READ) if size else None
+            self.mapped_size = size
+        return self.map
+
+    def write_header(self, header: dict):
+        with self.lock:
+            self._open()
+            with self._file_lock():
+                if os.fstat(self.segment).st_size == 0:
+                    os.write(self.segment, (json.dumps(header, ensure_ascii=False) + "\n").encode("utf-8"))
+
+    def append(self, role: str, content: str, model: Optional[str] = None, tokens: Optional[int] = None) -> int:
+        """Add a message and return its sequence number (1-based)"""
+        record = {"role": role, "content": content, "time": round(time.time(), 3)}
+        if model:
+            record["model"] = model
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        tokens = tokens + MESSAGE_OVERHEAD if tokens is not None else estimate_tokens(content)
+        with self.lock:
+            self._open()
+            with self._file_lock():
+                offset = os.fstat(self.segment).st_size
+                os.write(self.segment, line)
+                # Segment first: an index entry never points at a message that isn't there
+                os.write(self.index, ENTRY.pack(offset, len(line), tokens))
+                return len(self)
+
+    def _read(self, first: int, last: int) -> List[dict]:
+        """Messages first..last-1 (0-based) as dicts with their sequence numbers"""
+        if first >= last:
+            return []
+        with self.lock:
+            self._open()
+            view = self._view()
+            messages = []
+            for seq, (offset, length, _) in enumerate(self._entries(first, last), first + 1):
+                message = json.loads(view[offset:offset + length])
+                message["seq"] = seq
+                messages.append(message)
+            return messages
+
+    def tail(self, max_tokens: Optional[int] = CONTEXT_TOKENS, max_messages: Optional[int] = None) -> List[dict]:
+        """The most recent messages that fit the token budget - never reads past them"""
+        with self.lock:
+            count = len(self)
+            first = count
+            spent = 0
+            while first > 0:
+                # Index entries are read backwards 256 at a time
+                chunk_start = max(0, first - 256)
+                for _, _, tokens in reversed(self._entries(chunk_start, first)):
+                    if (max_messages is not None and count - first >= max_messages) or \
+                            (max_tokens is not None and spent + tokens > max_tokens and first < count):
+                        return self._read(first, count)
+                    spent += tokens
+                    first -= 1
+            return self._read(first, count)
+
+    def page(self, before: Optional[int] = None, after: Optional[int] = None, limit: int = 50) -> List[dict]:
+        """Up to `limit` messages before/after a sequence number (default: the newest)"""
+        count = len(self)
+        if before is not None and before < 1:
+            return []
+        if after is not None:
+            return self._read(max(0, after), min(count, after + limit))
+        end = min(count, before - 1) if before is not None else count
+        return self._read(max(0, end - limit), max(0, end))
+
+    def tokens(self) -> int:
+        with self.lock:
+            return sum(entry[2] for entry in self._entries(0, len(self)))
+
+    def close(self):
+        with self.lock:
+            if self.map is not None:
+                self.map.close()
+                self.map = None
+                self.mapped_size = 0
+            if self.segment is not None:
+                os.close(self.segment)
+                os.close(self.index)
+                self.segment = None
+
+class ConversationStore:
+    """A directory of conversations: create, resume, list, search and compact"""
+
+    def __init__(self, root: str = DEFAULT_DIR, max_open: int = MAX_OPEN):
+        self.root = root
+        self.max_open = max_open
+        self.open_conversations: "OrderedDict[str, Conversation]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def new_id(self) -> str:
+        return datetime.datetime.now().strftime("%Y%m%d-%H%M%S-") + secrets.token_hex(3)
+
+    def exists(self, conversation_id: str) -> bool:
+        # An id like ../x is not a conversation, rather than an error or a path outside the store
+        return bool(VALID_ID.match(conversation_id)) and \
+            os.path.exists(os.path.join(self.root, conversation_id + ".idx"))
+
+    def open(self, conversation_id: str, title: Optional[str] = None, create: bool = True, **meta) -> Conversation:
+        """An open conversation, created (with a header line) if new; compacted ones are unpacked"""
+        if not VALID_ID.match(conversation_id):
+            raise ValueError(f"Invalid conversation id: {conversation_id!r}")
+        with self.lock:
+            conversation = self.open_conversations.get(conversation_id)
+            if conversation is not None:
+                self.open_conversations.move_to_end(conversation_id)
+                return conversation
+            if not create and not self.exists(conversation_id):
+                raise KeyError(conversation_id)
+            os.makedirs(self.root, exist_ok=True)
+            conversation = Conversation(self.root, conversation_id)  # Unpacks a compacted segment
+            self.open_conversations[conversation_id] = conversation
+            while len(self.open_conversations) > self.max_open:
+                self.open_conversations.popitem(last=False)[1].close()
+        conversation.write_header(dict({"id": conversation_id, "created": datetime.datetime.now().isoformat(),
+                                        "title": (title or "")[:80]}, **meta))
+        return conversation
+
+    def create(self, title: Optional[str] = None, **meta) -> Conversation:
+        return self.open(self.new_id(), title, **meta)
+
+    def latest(self) -> Optional[str]:
+        conversations = self.list(limit=1)
+        return conversations[0]["id"] if conversations else None
+
+    def _header(self, conversation_id: str) -> dict:
+        path = os.path.join(self.root, conversation_id + ".seg")
+        opener = open
+        if not os.path.exists(path):
+            path, opener = path + ".gz", gzip.open
+        try:
+            with opener(path, "rb") as f:
+                return json.loads(f.readline(65536))
+        except (OSError, ValueError):
+            return {}
+
+    def list(self, limit: Optional[int] = None) -> List[dict]:
+        """Conversations, most recently updated first"""
+        if not os.path.isdir(self.root):
+            return []
+        found = []
+        for entry in os.scandir(self.root):
+            if entry.name.endswith(".idx"):
+                stat = entry.stat()
+                found.append((stat.st_mtime, entry.name[:-4], stat.st_size // ENTRY.size))
+        found.sort(reverse=True)
+        result = []
+        for mtime, conversation_id, count in found[:limit]:
+            header = self._header(conversation_id)
+            result.append({"id": conversation_id, "title": header.get("title", ""), "messages": count,
+                           "created": header.get("created"),
+                           "updated": datetime.datetime.fromtimestamp(mtime).isoformat(timespec="seconds"),
+                           "compacted": os.path.exists(os.path.join(self.root, conversation_id + ".seg.gz"))})
+        return result
+
+    def search(self, query: str, limit: int = 20) -> List[dict]:
+        """Messages containing the text (case-insensitive), newest conversations first"""
+        # Records are written with ensure_ascii=False, so only JSON's own escapes need matching. A bytes
+        # regex folds only ASCII case, so other characters match either case explicitly
+        parts = []
+        for char in json.dumps(query, ensure_ascii=False)[1:-1]:
+            if ord(char) < 128:
+                parts.append(re.escape(char.encode("ascii")))
+            else:
+                parts.append(b"(?:" + re.escape(char.lower().encode("utf-8")) + b"|" +
+                             re.escape(char.upper().encode("utf-8")) + b")")
+        pattern = re.compile(b"".join(parts), re.IGNORECASE)
+        needle = query.lower()
+        results = []
+        for info in self.list():
+            data = self._segment_bytes(info["id"])
+            if data is None:
+                continue
+            try:
+                offsets = None
+                for match in pattern.finditer(data):
+                    if offsets is None:
+                        with open(os.path.join(self.root, info["id"] + ".idx"), "rb") as f:
+                            offsets = [entry[0] for entry in ENTRY.iter_unpack(f.read())]
+                    seq = bisect.bisect_right(offsets, match.start())
+                    if seq == 0 or (results and results[-1]["id"] == info["id"] and results[-1]["seq"] == seq):
+                        continue  # In the header, or a second hit in the same message
+                    start = offsets[seq - 1]
+                    end = data.find(b"\n", start) + 1 or len(data)
+                    message = json.loads(data[start:end])
+                    content = message.get("content", "")
+                    at = content.lower().find(needle)
+                    if at < 0:
+                        continue  # Matched the role or model, not the text
+                    results.append({"id": info["id"], "title": info["title"], "seq": seq, "role": message["role"],
+                                    "snippet": content[max(0, at - 40):at + len(query) + 40]})
+                    if len(results) >= limit:
+                        return results
+            finally:
+                if isinstance(data, mmap.mmap):
+                    data.close()
+        return results
+
+    def _segment_bytes(self, conversation_id: str):
+        path = os.path.join(self.root, conversation_id + ".seg")
+        if os.path.exists(path):
+            if not os.path.getsize(path):
+                return None
+            with open(path, "rb") as f:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            with gzip.open(path + ".gz", "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    @contextmanager
+    def _unless_open(self, conversation_id: str):
+        """Yields False if any process has the conversation open, else True with it locked against opening"""
+        index = os.open(os.path.join(self.root, conversation_id + ".idx"), os.O_RDONLY)
+        try:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(index, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    yield False
+                    return
+            yield True
+        finally:
+            os.close(index)
+
+    def compact(self, older_than_days: float = COMPACT_DAYS) -> dict:
+        """Gzip the segments of conversations idle for longer than the given days; indexes stay"""
+        cutoff = time.time() - older_than_days * 86400
+        packed = 0
+        saved = 0
+        in_use = 0
+        for info in self.list():
+            path = os.path.join(self.root, info["id"] + ".seg")
+            if info["compacted"] or info["id"] in self.open_conversations or not os.path.exists(path):
+                continue
+            if os.path.getmtime(path) > cutoff:
+                continue
+            # A process holding it open would keep appending to the unlinked segment
+            with self._unless_open(info["id"]) as free:
+                if not free:
+                    in_use += 1
+                    continue
+                size = os.path.getsize(path)
+                with open(path, "rb") as source, gzip.open(path + ".gz.tmp", "wb") as target:
+                    shutil.copyfileobj(source, target)
+                os.replace(path + ".gz.tmp", path + ".gz")
+                saved += size - os.path.getsize(path + ".gz")
+                os.remove(path)
+                packed += 1
+        return {"compacted": packed, "bytes_saved": saved, "in_use": in_use}
+
+    def close(self):
+        with self.lock:
+            for conversation in self.open_conversations.values():
+                conversation.close()
+            self.open_conversations.clear()
+
+def main():
+    parser = argparse.ArgumentParser(description="List, show, search or compact saved conversations")
+    parser.add_argument("command", choices=["list", "show", "search", "compact"])
+    parser.add_argument("argument", nargs="?", help="conversation id for show, text for search")
+    parser.add_argument("--dir", default=DEFAULT_DIR, help=f"conversation directory (default {DEFAULT_DIR})")
+    parser.add_argument("--days", type=float, default=COMPACT_DAYS,
+                        help=f"compact conversations idle for longer than this (default {COMPACT_DAYS:g})")
+    parser.add_argument("--tokens", type=int, default=None, help="show only the tail that fits this many tokens")
+    parser.add_argument("--limit", type=int, default=20, help="conversations to list or search hits to show")
+    args = parser.parse_args()
+
+    store = ConversationStore(args.dir)
+    if args.command == "list":
+        for info in store.list(args.limit):
+            flag = " (compacted)" if info["compacted"] else ""
+            print(f"{info['id']}  {info['updated']}  {info['messages']:>5} msgs  {info['title']}{flag}")
+    elif args.command == "show":
+        if not args.argument or not store.exists(args.argument):
+            parser.error("show needs the id of an existing conversation")
+        for message in store.open(args.argument, create=False).tail(max_tokens=args.tokens):
+            print(f"[{message['seq']}] {message['role']}: {message['content']}")
+    elif args.command == "search":
+        if not args.argument:
+            parser.error("search needs the text to look for")
+        for hit in store.search(args.argument, args.limit):
+            print(f"{hit['id']} #{hit['seq']} {hit['role']}: ...{hit['snippet']}...")
+    else:
+        result = store.compact(args.days)
+        print(f"Compacted {result['compacted']} conversations, saved {result['bytes_saved']:,} bytes" +
+              (f" ({result['in_use']} skipped - open in another process)" if result["in_use"] else ""))
+    store.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+# cost_attribution.py - Fixed-Memory Cost Attribution by Tag
+#
+# Attributes spend to arbitrary request tags (user, team, feature, session,
+# prompt fingerprint, ...) without a dict entry per distinct value. Each tag
+# dimension keeps a Space-Saving summary of its top-K heavy hitters, a
+# count-min sketch for point estimates of any value, and a HyperLogLog of
+# distinct values - all fixed size, and all mergeable, so snapshots from
+# several processes or hosts combine into one "who is driving spend" report
+# Dependencies: none (standard library only)
+# Usage: python cost_attribution.py SNAPSHOT_OR_LOG [...] [--top 20] [--json]
+
+import argparse
+import base64
+import hashlib
+import heapq
+import json
+import math
+import os
+import threading
+from array import array
+from typing import Dict, List, Optional
+
+DEFAULT_CAPACITY = 100     # Heavy hitters tracked per dimension
+CMS_WIDTH = 2048           # Count-min overestimate <= 2/width of the dimension's total spend (~0.1%)
+CMS_DEPTH = 4              # ... with probability 1 - 2^-depth
+HLL_PRECISION = 12         # 4096 registers, ~1.6% standard error on distinct counts
+MAX_DIMENSIONS = 16        # Further tag names are counted as dropped
+MAX_TAG_LENGTH = 128
+
+def _hash64(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little")
+
+def prompt_fingerprint(text: str) -> str:
+    """Stable short id for a prompt (whitespace and case normalized) - the text itself is never kept"""
+    normalized = " ".join(text.lower().split())
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:12]
+
+class SpaceSaving:
+    """Weighted Space-Saving: the `capacity` keys with the most spend
+
+    A key's recorded cost never underestimates its true cost and overestimates
+    it by at most its `error`; keys that were never evicted (error 0) are exact.
+    """
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.counters: Dict[str, list] = {}  # key -> [cost, error, requests, tokens]
+        self.heap: List[tuple] = []  # (cost when pushed, key) - entries go stale as counters grow
+
+    def add(self, key: str, cost: float, tokens: int = 0):
+        counter = self.counters.get(key)
+        if counter is not None:
+            counter[0] += cost
+            counter[2] += 1
+            counter[3] += tokens
+        elif len(self.counters) < self.capacity:
+            self.counters[key] = [cost, 0.0, 1, tokens]
+            heapq.heappush(self.heap, (cost, key))
+        else:
+            # Replace the smallest counter; the newcomer inherits its count as possible error
+            floor = self._pop_min()
+            self.counters[key] = [floor + cost, floor, 1, tokens]
+            heapq.heappush(self.heap, (floor + cost, key))
+
+    def _pop_min(self) -> float:
+        """Evict the key with the least spend and return that spend"""
+        while True:
+            pushed, key = heapq.heappop(self.heap)
+            current = self.counters[key][0]
+            if current == pushed:
+                del self.counters[key]
+                return current
+            heapq.heappush(self.heap, (current, key))  # Grew since it was pushed - re-file it
+
+    def _rebuild_heap(self):
+        self.heap = [(counter[0], key) for key, counter in self.counters.items()]
+        heapq.heapify(self.heap)
+
+    def floor(self) -> float:
+        """Most spend an untracked key can have had"""
+        if len(self.counters) < self.capacity:
+            return 0.0
+        return min(counter[0] for counter in self.counters.values())
+
+    def merge(self, other: "SpaceSaving"):
+        mine, theirs = self.floor(), other.floor()
+        merged = {}
+        for key in set(self.counters) | set(other.counters):
+            a = self.counters.get(key, [mine, mine, 0, 0])
+            b = other.counters.get(key, [theirs, theirs, 0, 0])
+            merged[key] = [a[0] + b[0], a[1] + b[1], a[2] + b[2], a[3] + b[3]]
+        keep = sorted(merged, key=lambda k: merged[k][0], reverse=True)[:self.capacity]
+        self.counters = {key: merged[key] for key in keep}
+        self._rebuild_heap()
+
+    def top(self, n: int) -> List[tuple]:
+        return sorted(self.counters.items(), key=lambda item: item[1][0], reverse=True)[:n]
+
+class CountMinSketch:
+    """Spend per key in width x depth counters (conservative update)"""
+
+    def __init__(self, width: int = CMS_WIDTH, depth: int = CMS_DEPTH):
+        self.width = width
+        self.depth = depth
+        self.rows = [array("d", bytes(8 * width)) for _ in range(depth)]
+
+    def _slots(self, h: int) -> List[int]:
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        return [(h1 + i * h2) % self.width for i in range(self.depth)]
+
+    def add(self, h: int, amount: float):
+        """Add spend for the key whose _hash64 is h"""
+        slots = self._slots(h)
+        target = min(row[slot] for row, slot in zip(self.rows, slots)) + amount
+        for row, slot in zip(self.rows, slots):
+            if row[slot] < target:
+                row[slot] = target
+
+    def estimate(self, key: str) -> float:
+        return min(row[slot] for row, slot in zip(self.rows, self._slots(_hash64(key))))
+
+    def merge(self, other: "CountMinSketch"):
+        for row, other_row in zip(self.rows, other.rows):
+            for i, value in enumerate(other_row):
+                if value:
+                    row[i] += value
+
+class HyperLogLog:
+    """Approximate count of distinct keys in 2^precision one-byte registers"""
+
+    def __init__(self, precision: int = HLL_PRECISION):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, h: int):
+        """Count the key whose _hash64 is h"""
+        index = h >> (64 - self.precision)
+        rest = h & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self) -> int:
+        m = len(self.registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)  # Linear counting is better for small sets
+        return int(round(estimate))
+
+    def merge(self, other: "HyperLogLog"):
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+
+class Dimension:
+    """Sketches for one tag name (e.g. all values of "team")"""
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        self.heavy = SpaceSaving(capacity)
+        self.sketch = CountMinSketch()
+        self.distinct = HyperLogLog()
+        self.cost = 0.0
+        self.requests = 0
+        self.tokens = 0
+
+    def add(self, value: str, cost: float, tokens: int):
+        h = _hash64(value)
+        self.heavy.add(value, cost, tokens)
+        self.sketch.add(h, cost)
+        self.distinct.add(h)
+        self.cost += cost
+        self.requests += 1
+        self.tokens += tokens
+
+    def merge(self, other: "Dimension"):
+        self.heavy.merge(other.heavy)
+        self.sketch.merge(other.sketch)
+        self.distinct.merge(other.distinct)
+        self.cost += other.cost
+        self.requests += other.requests
+        self.tokens += other.tokens
+
+    def to_dict(self) -> dict:
+        return {
+            "cost": self.cost, "requests": self.requests, "tokens": self.tokens,
+            "capacity": self.heavy.capacity, "heavy": self.heavy.counters,
+            "cms": {"width": self.sketch.width, "depth": self.sketch.depth,
+                    "rows": [base64.b64encode(row.tobytes()).decode("ascii") for row in self.sketch.rows]},
+            "hll": {"precision": self.distinct.precision,
+                    "registers": base64.b64encode(bytes(self.distinct.registers)).decode("ascii")},
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Dimension":
+        dimension = cls(data["capacity"])
+        dimension.cost, dimension.requests, dimension.tokens = data["cost"], data["requests"], data["tokens"]
+        dimension.heavy.counters = {key: list(counter) for key, counter in data["heavy"].items()}
+        dimension.heavy._rebuild_heap()
+        dimension.sketch = CountMinSketch(data["cms"]["width"], data["cms"]["depth"])
+        for row, encoded in zip(dimension.sketch.rows, data["cms"]["rows"]):
+            row[:] = array("d", base64.b64decode(encoded))
+        dimension.distinct = HyperLogLog(data["hll"]["precision"])
+        dimension.distinct.registers = bytearray(base64.b64decode(data["hll"]["registers"]))
+        return dimension
+
+class CostAttribution:
+    """Spend by arbitrary request tags in bounded memory; thread-safe and mergeable"""
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.dimensions: Dict[str, Dimension] = {}
+        self.dropped = 0  # Tags ignored because MAX_DIMENSIONS names were already in use
+        self.lock = threading.Lock()
+
+    def add(self, tags: Dict[str, str], cost: float, tokens: int = 0):
+        with self.lock:
+            for name, value in tags.items():
+                if value is None:
+                    continue
+                dimension = self.dimensions.get(name)
+                if dimension is None:
+                    if len(self.dimensions) >= MAX_DIMENSIONS:
+                        self.dropped += 1
+                        continue
+                    dimension = self.dimensions[name] = Dimension(self.capacity)
+                dimension.add(str(value)[:MAX_TAG_LENGTH], cost, tokens)
+
+    def estimate(self, name: str, value: str) -> Optional[float]:
+        """Approximate spend for any tag value, tracked as a heavy hitter or not"""
+        with self.lock:
+            dimension = self.dimensions.get(name)
+            if dimension is None:
+                return None
+            counter = dimension.heavy.counters.get(value)
+            if counter is not None:
+                return min(counter[0], dimension.sketch.estimate(value))
+            return dimension.sketch.estimate(value)
+
+    def merge(self, other: "CostAttribution"):
+        with self.lock:
+            for name, theirs in other.dimensions.items():
+                mine = self.dimensions.get(name)
+                if mine is None:
+                    self.dimensions[name] = Dimension.from_dict(theirs.to_dict())
+                else:
+                    mine.merge(theirs)
+            self.dropped += other.dropped
+
+    def report(self, top: int = 10) -> dict:
+        """Per dimension: totals, distinct values and the heaviest values with their share of spend"""
+        with self.lock:
+            result = {}
+            for name, dimension in sorted(self.dimensions.items()):
+                result[name] = {
+                    "cost_usd": round(dimension.cost, 9),
+                    "requests": dimension.requests,
+                    "tokens": dimension.tokens,
+                    "distinct": dimension.distinct.count(),
+                    "top": [{"value": value,
+                             "cost_usd": round(cost, 9),
+                             "max_error": round(error, 9),  # cost - max_error is a guaranteed lower bound
+                             "share": round(cost / dimension.cost, 4) if dimension.cost else 0.0,
+                             "requests": requests,
+                             "tokens": tokens}
+                            for value, (cost, error, requests, tokens) in dimension.heavy.top(top)],
+                }
+            return result
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {"attribution": 1, "dropped": self.dropped,
+                    "dimensions": {name: d.to_dict() for name, d in self.dimensions.items()}}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "CostAttribution":
+        attribution = cls()
+        attribution.dropped = data.get("dropped", 0)
+        for name, encoded in data["dimensions"].items():
+            attribution.dimensions[name] = Dimension.from_dict(encoded)
+        if attribution.dimensions:
+            attribution.capacity = next(iter(attribution.dimensions.values())).heavy.capacity
+        return attribution
+
+    def save(self, path: str):
+        """Write a mergeable snapshot (atomically)"""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.to_dict(), f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+def load(path: str) -> CostAttribution:
+    """A snapshot written by save(), or one built from a chat_costs.log's tagged records"""
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        first = f.readline()
+        try:
+            data = json.loads(first)
+        except ValueError:
+            data = None
+        if isinstance(data, dict) and "attribution" in data:
+            return CostAttribution.from_dict(data)
+        attribution = CostAttribution()
+        _add_log_line(attribution, first)
+        for line in f:
+            _add_log_line(attribution, line)
+        return attribution
+
+def _add_log_line(attribution: CostAttribution, line: str):
+    try:
+        entry = json.loads(line)
+        tags = entry.get("tags")
+        if tags:
+            attribution.add(tags, float(entry["cost_usd"]), int(entry.get("total_tokens", 0)))
+    except (ValueError, KeyError, TypeError, AttributeError):
+        pass
+
+def print_report(report: dict, dropped: int = 0):
+    print("\nCOST ATTRIBUTION")
+    print("=" * 78)
+    if not report:
+        print("No tagged usage recorded.")
+        return
+    for name, dimension in report.items():
+        print(f"\n{name}: ~{dimension['distinct']:,} distinct values | ${dimension['cost_usd']:.6f} | "
+              f"{dimension['requests']:,} requests")
+        for row in dimension["top"]:
+            bound = f" (>= ${row['cost_usd'] - row['max_error']:.6f})" if row["max_error"] else ""
+            print(f"  {row['value'][:32]:<32} ${row['cost_usd']:>11.6f} {row['share']:>7.1%} "
+                  f"{row['requests']:>7} req{bound}")
+    if dropped:
+        print(f"\n{dropped} tags dropped (more than {MAX_DIMENSIONS} tag names)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge attribution snapshots (or tagged cost logs) into one report")
+    parser.add_argument("paths", nargs="+", help="snapshots from web_chat.py --attribution, or chat_costs.log files")
+    parser.add_argument("--top", type=int, default=10, help="heavy hitters to show per tag")
+    parser.add_argument("--json", action="store_true", help="print the merged report as JSON")
+    parser.add_argument("--save", metavar="FILE", help="also write the merged snapshot")
+    args = parser.parse_args()
+
+    merged = CostAttribution()
+    for path in args.paths:
+        merged.merge(load(path))
+    if args.save:
+        merged.save(args.save)
+    if args.json:
+        print(json.dumps(merged.report(args.top), indent=2))
+    else:
+        print_report(merged.report(args.top), merged.dropped)
+
+if __name__ == "__main__":
+    main()
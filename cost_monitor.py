@@ -0,0 +1,265 @@
+# cost_monitor.py - Live Cost Monitor for chat_costs.log
+#
+# Follows chat_costs.log like `tail -f` (surviving rotation and truncation)
+# and keeps sliding-window spend, token and request rates for the last
+# minute, hour and day in fixed-size ring buffers, so memory stays constant
+# however long it runs. Renders a refreshing terminal dashboard or prints
+# JSON snapshots for other tools
+# Dependencies: none (standard library only)
+# Usage: python cost_monitor.py [--log chat_costs.log] [--json] [--interval 2]
+
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+from typing import Dict, Iterator, List, Optional
+
+from cost_tracking import MODEL_PRICING
+
+# (name, window length in seconds, number of buckets)
+WINDOWS = [("1m", 60, 60), ("1h", 3600, 60), ("24h", 86400, 96)]
+
+READ_CHUNK = 64 * 1024
+MAX_LINE = 1024 * 1024  # Usage records are a few hundred bytes; a longer line is dropped, not buffered
+
+class LogFollower:
+    """Yields complete new lines appended to a file, reopening it after rotation"""
+
+    def __init__(self, path: str, from_start: bool = False):
+        self.path = path
+        self.file = None
+        self.inode = None
+        self.partial = b""
+        self.discarding = False  # Skipping the rest of an oversized line
+        self.dropped = 0         # Oversized lines skipped
+        self.rotations = 0
+        self._open(seek_end=not from_start)
+
+    def _open(self, seek_end: bool):
+        try:
+            self.file = open(self.path, "rb")
+        except FileNotFoundError:
+            self.file = None
+            return
+        stat = os.fstat(self.file.fileno())
+        self.inode = (stat.st_dev, stat.st_ino)
+        if seek_end:
+            self.file.seek(0, os.SEEK_END)
+        self.partial = b""
+        self.discarding = False
+
+    def _rotated(self) -> bool:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False  # Rotated away but not recreated yet - keep draining the old file
+        if (stat.st_dev, stat.st_ino) != self.inode:
+            return True
+        return stat.st_size < self.file.tell()  # Truncated in place (copytruncate)
+
+    def read_lines(self) -> Iterator[str]:
+        """Every complete line written since the last call, read in bounded chunks"""
+        if self.file is None:
+            self._open(seek_end=False)
+            if self.file is None:
+                return
+        yield from self._drain()
+        if self._rotated():
+            yield from self._drain()  # Anything written to the old file before the switch
+            self.file.close()
+            self.rotations += 1
+            self._open(seek_end=False)
+            if self.file is not None:
+                yield from self._drain()
+
+    def _drain(self) -> Iterator[str]:
+        while True:
+            data = self.file.read(READ_CHUNK)
+            if not data:
+                return
+            if self.discarding:
+                newline = data.find(b"\n")
+                if newline < 0:
+                    continue
+                data = data[newline + 1:]
+                self.discarding = False
+            lines = (self.partial + data).split(b"\n")
+            self.partial = lines.pop()  # Incomplete last line waits for the rest of the write
+            if len(self.partial) > MAX_LINE:
+                # A line with no end in sight (binary junk, a runaway writer) must not grow memory
+                self.partial = b""
+                self.discarding = True
+                self.dropped += 1
+            for line in lines:
+                yield line.decode("utf-8", errors="replace")
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+class SlidingWindow:
+    """Ring buffer of time buckets summarizing the last `span` seconds"""
+
+    def __init__(self, span: int, buckets: int):
+        self.span = span
+        self.width = span / buckets
+        self.epochs = [-1] * buckets
+        self.cost = [0.0] * buckets
+        self.tokens = [0] * buckets
+        self.requests = [0] * buckets
+        self.models: List[Dict[str, list]] = [{} for _ in range(buckets)]
+
+    def add(self, timestamp: float, model: str, cost: float, tokens: int):
+        epoch = int(timestamp // self.width)
+        slot = epoch % len(self.epochs)
+        if self.epochs[slot] != epoch:
+            if epoch < self.epochs[slot]:
+                return  # Older than anything the buffer still covers
+            self.epochs[slot] = epoch
+            self.cost[slot] = 0.0
+            self.tokens[slot] = 0
+            self.requests[slot] = 0
+            self.models[slot] = {}
+        self.cost[slot] += cost
+        self.tokens[slot] += tokens
+        self.requests[slot] += 1
+        per_model = self.models[slot].setdefault(model, [0.0, 0, 0])
+        per_model[0] += cost
+        per_model[1] += tokens
+        per_model[2] += 1
+
+    def totals(self, now: float, first_seen: Optional[float]) -> dict:
+        """Sums over buckets inside the window, with rates over the covered time"""
+        oldest = int(now // self.width) - len(self.epochs) + 1
+        cost, tokens, requests = 0.0, 0, 0
+        models: Dict[str, list] = {}
+        for slot, epoch in enumerate(self.epochs):
+            if epoch < oldest:
+                continue
+            cost += self.cost[slot]
+            tokens += self.tokens[slot]
+            requests += self.requests[slot]
+            for model, (m_cost, m_tokens, m_requests) in self.models[slot].items():
+                totals = models.setdefault(model, [0.0, 0, 0])
+                totals[0] += m_cost
+                totals[1] += m_tokens
+                totals[2] += m_requests
+        # Don't dilute rates with time before the first entry was seen (but don't
+        # extrapolate a whole window from its first few seconds either)
+        covered = self.span if first_seen is None else min(self.span, max(now - first_seen, self.span / 10))
+        return {
+            "cost_usd": round(cost, 9),
+            "tokens": tokens,
+            "requests": requests,
+            "tokens_per_sec": round(tokens / covered, 3),
+            "requests_per_sec": round(requests / covered, 4),
+            "cost_per_hour": round(cost / covered * 3600, 6),
+            "models": {
+                model: {"cost_usd": round(m[0], 9), "tokens": m[1], "requests": m[2],
+                        "tokens_per_sec": round(m[1] / covered, 3), "requests_per_sec": round(m[2] / covered, 4)}
+                for model, m in sorted(models.items(), key=lambda item: -item[1][0])
+            },
+        }
+
+class CostMonitor:
+    """Feeds log entries into every sliding window"""
+
+    def __init__(self):
+        self.windows = {name: SlidingWindow(span, buckets) for name, span, buckets in WINDOWS}
+        self.first_seen = None
+        self.entries = 0
+        self.skipped = 0
+
+    def add_line(self, line: str):
+        line = line.strip()
+        if not line:
+            return
+        try:
+            entry = json.loads(line)
+            model = entry["model"]
+            cost = float(entry["cost_usd"])
+            tokens = int(entry["total_tokens"])
+            timestamp = datetime.datetime.fromisoformat(entry["timestamp"]).timestamp()
+        except (ValueError, KeyError, TypeError):
+            self.skipped += 1
+            return
+        if self.first_seen is None or timestamp < self.first_seen:
+            self.first_seen = timestamp
+        self.entries += 1
+        for window in self.windows.values():
+            window.add(timestamp, model, cost, tokens)
+
+    def snapshot(self, now: float = None) -> dict:
+        now = time.time() if now is None else now
+        return {
+            "time": datetime.datetime.fromtimestamp(now).isoformat(timespec="seconds"),
+            "entries": self.entries,
+            "skipped": self.skipped,
+            "windows": {name: window.totals(now, self.first_seen) for name, window in self.windows.items()},
+        }
+
+def render(snapshot: dict, log_path: str, rotations: int) -> str:
+    """Terminal dashboard for one snapshot"""
+    lines = [f"LIVE COST MONITOR - {log_path} - {snapshot['time']}",
+             f"{snapshot['entries']} entries read, {rotations} rotations, {snapshot['skipped']} unparseable lines" +
+             (f", {snapshot['oversized']} oversized lines dropped" if snapshot.get("oversized") else ""),
+             "=" * 78,
+             f"{'window':<8} {'spend':>12} {'$/hour':>10} {'requests':>9} {'req/s':>8} {'tokens':>10} {'tok/s':>9}"]
+    for name, totals in snapshot["windows"].items():
+        lines.append(f"{name:<8} ${totals['cost_usd']:>11.6f} {totals['cost_per_hour']:>10.4f} "
+                     f"{totals['requests']:>9} {totals['requests_per_sec']:>8.3f} "
+                     f"{totals['tokens']:>10,} {totals['tokens_per_sec']:>9.1f}")
+    for name, totals in snapshot["windows"].items():
+        if not totals["models"]:
+            continue
+        lines.append("")
+        lines.append(f"By model, last {name}:")
+        for model, stats in totals["models"].items():
+            model_name = MODEL_PRICING.get(model, {}).get("name", model)
+            lines.append(f"  {model_name:<34} ${stats['cost_usd']:>11.6f} {stats['requests']:>7} req "
+                         f"{stats['requests_per_sec']:>8.3f} req/s {stats['tokens']:>10,} tok "
+                         f"{stats['tokens_per_sec']:>9.1f} tok/s")
+    return "\n".join(lines)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Follow chat_costs.log and show live spend rates")
+    parser.add_argument("--log", default="chat_costs.log", help="log file to follow")
+    parser.add_argument("--interval", type=float, default=2.0, help="seconds between refreshes")
+    parser.add_argument("--json", action="store_true", help="print one JSON snapshot per interval instead")
+    parser.add_argument("--no-backfill", action="store_true",
+                        help="only count entries written after startup (default reads the existing log)")
+    parser.add_argument("--once", action="store_true", help="print a single snapshot and exit")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    monitor = CostMonitor()
+    follower = LogFollower(args.log, from_start=not args.no_backfill)
+    next_render = 0.0
+    try:
+        while True:
+            for line in follower.read_lines():
+                monitor.add_line(line)
+            now = time.time()
+            if now >= next_render or args.once:
+                snapshot = monitor.snapshot(now)
+                snapshot["oversized"] = follower.dropped
+                if args.json:
+                    print(json.dumps(snapshot, separators=(",", ":")), flush=True)
+                else:
+                    if not args.once:
+                        sys.stdout.write("\033[H\033[J")  # Clear screen
+                    print(render(snapshot, args.log, follower.rotations), flush=True)
+                if args.once:
+                    return
+                next_render = now + args.interval
+            time.sleep(min(0.25, args.interval))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        follower.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+# cost_tracking.py - Model Prices and the Shared Cost Tracker
+#
+# The one price table (MODEL_PRICING - every model any tool sends to) and
+# CostTracker, which prices each request, keeps running totals, checks it
+# for anomalies and appends it to the cost log. Importing this module has
+# no side effects - no client, no files read, nothing printed - so every
+# tool and report can use the same prices without starting a chat
+# Used by: chat_with_costs.py, web_chat.py, async_chat.py, cost_monitor.py, log_aggregate.py,
+#          reprice.py, usage_store.py, benchmarks/bench_costs.py
+# Dependencies: none (standard library only)
+
+import datetime
+import json
+import os
+import threading
+from dataclasses import dataclass
+from typing import Dict
+
+import usage_store
+from anomaly_detector import AnomalyDetector
+
+# Vertex AI Pricing (as of January 2025) - verify current rates at cloud.google.com
+# Update these rates based on your region and current Google Cloud pricing.
+# speed is the scheduling tier web_chat.py gives the model; description and use are shown in the menus
+MODEL_PRICING = {
+    "vertex/gemini-2.0-flash-lite-001": {
+        "input_per_1k": 0.000075,   # Cheapest option
+        "output_per_1k": 0.0003,
+        "name": "Gemini 2.0 Flash Lite",
+        "description": "Fastest (0.51s)",
+        "use": "Best for quick chat, high-volume usage",
+        "speed": "fastest"
+    },
+    "vertex/gemini-2.5-flash-preview-05-20": {
+        "input_per_1k": 0.00015,    # Preview pricing
+        "output_per_1k": 0.0006,
+        "name": "Gemini 2.5 Flash Preview",
+        "description": "Newest (0.68s)",
+        "use": "Latest features, experimental",
+        "speed": "fast"
+    },
+    "vertex/gemini-2.0-flash-001": {
+        "input_per_1k": 0.00015,    # Standard pricing
+        "output_per_1k": 0.0006,
+        "name": "Gemini 2.0 Flash",
+        "description": "Reliable (0.83s)",
+        "use": "Most reliable, production-ready",
+        "speed": "medium"
+    },
+    "vertex/gemini-2.5-pro-preview-05-06": {
+        "input_per_1k": 0.0003,
+        "output_per_1k": 0.0012,
+        "name": "Gemini 2.5 Pro Preview",
+        "description": "Most Capable (1.26s)",
+        "use": "Hardest questions, highest cost",
+        "speed": "slower"
+    }
+}
+
+@dataclass
+class ChatCosts:
+    session_cost: float = 0.0
+    total_tokens: int = 0
+    message_count: int = 0
+    model_usage: Dict[str, float] = None
+    
+    def __post_init__(self):
+        if self.model_usage is None:
+            self.model_usage = {}
+
+class CostTracker:
+    def __init__(self, pricing: Dict[str, dict] = None, log_file: str = "chat_costs.log", attribution=None,
+                 load_history: bool = True):
+        self.pricing = pricing if pricing is not None else MODEL_PRICING
+        self.log_file = log_file
+        self.attribution = attribution  # Optional cost_attribution.CostAttribution fed by tagged requests
+        self.counters = None  # worker_pool.SharedCounters when running as one of several web_chat workers
+        # Per-model baselines of latency, tokens and cost; alerts go next to the cost log
+        self.anomalies = AnomalyDetector(log_file=os.path.join(os.path.dirname(log_file), "anomalies.log"))
+        self.session_costs = ChatCosts()
+        self.lock = threading.Lock()  # web_chat tracks usage from several threads
+        if load_history:
+            self.load_historical_costs()
+    
+    def calculate_cost(self, model: str, prompt_tokens: int, completion_tokens: int) -> float:
+        """Calculate cost for a single request"""
+        if model not in self.pricing:
+            print(f"Unknown model {model}, using default pricing")
+            model = "vertex/gemini-2.0-flash-001"  # Fallback to known model
+        
+        pricing = self.pricing[model]
+        input_cost = (prompt_tokens / 1000) * pricing["input_per_1k"]
+        output_cost = (completion_tokens / 1000) * pricing["output_per_1k"]
+        total_cost = input_cost + output_cost
+        
+        return total_cost
+    
+    def track_usage(self, model: str, prompt_tokens: int, completion_tokens: int,
+                    timings: Dict[str, float] = None, log: bool = True, tags: Dict[str, str] = None,
+                    latency: float = None, detect: bool = True) -> dict:
+        """Track usage and return cost info
+        
+        Pass log=False to write the log record later (e.g. once all phase timings are known).
+        latency (upstream seconds), tokens and cost are checked against the model's usual
+        levels; cost_info["anomalies"] lists any alerts. Pass detect=False for estimated
+        counts or cut-short replies, which would skew the baselines.
+        """
+        cost = self.calculate_cost(model, prompt_tokens, completion_tokens)
+        
+        with self.lock:
+            # Update session totals
+            self.session_costs.session_cost += cost
+            self.session_costs.total_tokens += (prompt_tokens + completion_tokens)
+            self.session_costs.message_count += 1
+            
+            # Track per-model usage
+            if model not in self.session_costs.model_usage:
+                self.session_costs.model_usage[model] = 0.0
+            self.session_costs.model_usage[model] += cost
+            if self.counters is not None:
+                self.counters.add(cost, prompt_tokens + completion_tokens)
+            
+            cost_info = {
+                "request_cost": cost,
+                "session_cost": self.session_costs.session_cost,
+                "session_tokens": self.session_costs.total_tokens,
+                "message_count": self.session_costs.message_count,
+                "cost_per_message": self.session_costs.session_cost / self.session_costs.message_count if self.session_costs.message_count > 0 else 0
+            }
+        
+        if detect:
+            alerts = self.anomalies.observe(model, latency=latency, prompt_tokens=prompt_tokens,
+                                            completion_tokens=completion_tokens, cost=cost)
+            if alerts:
+                cost_info["anomalies"] = alerts
+        
+        # Log to file for historical tracking
+        if log:
+            self.log_usage(model, prompt_tokens, completion_tokens, cost, timings, tags=tags)
+        
+        return cost_info
+    
+    def log_usage(self, model: str, prompt_tokens: int, completion_tokens: int, cost: float,
+                  timings: Dict[str, float] = None, max_tokens: int = None, finish_reason: str = None,
+                  max_tokens_tuned: bool = None, session: str = None, tags: Dict[str, str] = None):
+        """Log usage to file (and the SQLite usage store, if open) for historical tracking
+        
+        tags (user, team, feature, ...) are kept in the record and fed to the attribution sketches.
+        """
+        log_entry = {
+            "timestamp": datetime.datetime.now().isoformat(),
+            "model": model,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "cost_usd": cost,
+            "session_total": self.session_costs.session_cost
+        }
+        if timings:
+            log_entry["timings_ms"] = timings
+        if max_tokens is not None:
+            # Lets MaxTokensTuner tell truncated replies from naturally short ones
+            log_entry["max_tokens"] = max_tokens
+            log_entry["finish_reason"] = finish_reason
+            log_entry["max_tokens_tuned"] = bool(max_tokens_tuned)
+        if session:
+            log_entry["session"] = session
+        if tags:
+            log_entry["tags"] = tags = dict(tags, model=model)
+            if self.attribution is not None:
+                self.attribution.add(tags, cost, prompt_tokens + completion_tokens)
+        
+        usage_store.record(log_entry)
+        try:
+            # One O_APPEND write per record, so lines from concurrent processes never interleave
+            line = (json.dumps(log_entry) + "\n").encode("utf-8")
+            fd = os.open(self.log_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+        except Exception as e:
+            print(f"Could not log usage: {e}")
+    
+    def load_historical_costs(self):
+        """Load historical costs from log file"""
+        try:
+            if os.path.exists(self.log_file):
+                total_historical = 0.0
+                with open(self.log_file, "r") as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line.strip())
+                            total_historical = entry.get("session_total", 0.0)
+                            self.anomalies.learn(entry)  # Baselines are ready from the first request
+                        except:
+                            continue
+                if total_historical > 0:
+                    print(f"Historical total costs: ${total_historical:.6f}")
+        except Exception:
+            pass
+    
+    def get_cost_summary(self) -> str:
+        """Get formatted cost summary"""
+        if self.session_costs.message_count == 0:
+            return "No usage yet"
+        
+        summary = f"""
+Cost Summary:
+This session: ${self.session_costs.session_cost:.6f}
+Total tokens: {self.session_costs.total_tokens:,}
+Messages: {self.session_costs.message_count}
+Avg per message: ${self.session_costs.session_cost / self.session_costs.message_count:.6f}
+Models used: {len(self.session_costs.model_usage)}"""
+        
+        return summary
@@ -0,0 +1,150 @@
+# health_monitor.py - Background Model Health Monitor
+#
+# Periodically probes each model through the goop proxy with a tiny request
+# and tracks health state so callers can fail over before users notice
+# Dependencies: pip install openai (client is passed in)
+
+import threading
+import time
+from typing import Dict, List
+
+from model_cache import ModelCache
+
+# Health states, best first
+HEALTHY = "healthy"
+DEGRADED = "degraded"
+DOWN = "down"
+UNKNOWN = "unknown"
+STATE_RANK = {HEALTHY: 0, UNKNOWN: 1, DEGRADED: 2, DOWN: 3}
+
+class HealthMonitor:
+    """Tracks per-model health from canary probes and real traffic"""
+
+    def __init__(self, client, models: List[str], interval: float = 60.0,
+                 probe_timeout: float = 10.0, down_after: int = 2):
+        self.client = client
+        self.models = list(models)
+        self.interval = interval
+        self.probe_timeout = probe_timeout
+        self.down_after = down_after
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.state: Dict[str, dict] = {m: self._new_entry() for m in self.models}
+        self._seed_from_cache()
+
+    def _new_entry(self) -> dict:
+        return {
+            "status": UNKNOWN,
+            "latency": None,
+            "consecutive_failures": 0,
+            "last_success": 0.0,
+            "last_check": 0.0,
+            "last_error": None,
+            "probes": 0,
+            "failovers": 0,
+        }
+
+    def _seed_from_cache(self):
+        """Start from verify_models.py results instead of UNKNOWN where possible"""
+        cache = ModelCache()
+        for model in self.models:
+            available = cache.is_available(model)
+            if available is True:
+                self.state[model]["status"] = HEALTHY
+                self.state[model]["latency"] = cache.latency(model)
+            elif available is False:
+                self.state[model]["status"] = DOWN
+                self.state[model]["consecutive_failures"] = self.down_after
+
+    def start(self):
+        """Start the canary thread"""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="health-monitor", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            for model in self.models:
+                if self.stop_event.is_set():
+                    break
+                # Real traffic already proved the model is up - skip the paid probe
+                with self.lock:
+                    recently_ok = time.time() - self.state[model]["last_success"] < self.interval
+                if not recently_ok:
+                    self.probe(model)
+            self.stop_event.wait(self.interval)
+
+    def probe(self, model: str):
+        """Send a one-token canary request and record the outcome"""
+        start_time = time.time()
+        try:
+            self.client.chat.completions.create(
+                model=model,
+                messages=[{"role": "user", "content": "ping"}],
+                max_tokens=1,
+                timeout=self.probe_timeout
+            )
+            self.report_success(model, time.time() - start_time)
+        except Exception as e:
+            self.report_failure(model, e)
+        with self.lock:
+            self.state[model]["probes"] += 1
+
+    def report_success(self, model: str, latency: float):
+        with self.lock:
+            entry = self.state.setdefault(model, self._new_entry())
+            entry["status"] = HEALTHY
+            entry["latency"] = latency if entry["latency"] is None else 0.7 * entry["latency"] + 0.3 * latency
+            entry["consecutive_failures"] = 0
+            entry["last_success"] = entry["last_check"] = time.time()
+            entry["last_error"] = None
+
+    def report_failure(self, model: str, error: Exception):
+        with self.lock:
+            entry = self.state.setdefault(model, self._new_entry())
+            entry["consecutive_failures"] += 1
+            entry["status"] = DOWN if entry["consecutive_failures"] >= self.down_after else DEGRADED
+            entry["last_check"] = time.time()
+            entry["last_error"] = str(error)[:200]
+
+    def record_failover(self, model: str):
+        with self.lock:
+            self.state.setdefault(model, self._new_entry())["failovers"] += 1
+
+    def status(self, model: str) -> str:
+        with self.lock:
+            return self.state.get(model, {}).get("status", UNKNOWN)
+
+    def candidates(self, requested: str) -> List[str]:
+        """Models to try in order: the requested one unless down, then the best healthy others"""
+        with self.lock:
+            def rank(model):
+                entry = self.state[model]
+                latency = entry["latency"] if entry["latency"] is not None else float("inf")
+                return (STATE_RANK[entry["status"]], latency)
+
+            others = sorted((m for m in self.models if m != requested and self.state[m]["status"] != DOWN), key=rank)
+            requested_down = self.state.get(requested, {}).get("status") == DOWN
+        order = others if requested_down else [requested] + others
+        # Everything is down - still try the requested model rather than refusing outright
+        return order if order else [requested]
+
+    def snapshot(self) -> Dict[str, dict]:
+        """Copy of health state for /health and /metrics"""
+        with self.lock:
+            return {
+                model: {
+                    "status": entry["status"],
+                    "latency": round(entry["latency"], 3) if entry["latency"] is not None else None,
+                    "consecutive_failures": entry["consecutive_failures"],
+                    "last_check": entry["last_check"],
+                    "last_error": entry["last_error"],
+                    "probes": entry["probes"],
+                    "failovers": entry["failovers"],
+                }
+                for model, entry in self.state.items()
+            }
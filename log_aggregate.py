@@ -0,0 +1,231 @@
+# log_aggregate.py - Parallel Cost Log Aggregation Across Hosts
+#
+# Builds one cost report from many chat_costs.log files - e.g. one directory
+# per host, including rotated (.1) and gzip-compressed (.gz) segments.
+# Large plain files are split into byte ranges, every range or compressed
+# file is parsed in a separate process, and the partial aggregates are
+# merged, so analysis time scales with the number of cores
+# Dependencies: none (standard library only)
+# Usage: python log_aggregate.py LOG_OR_DIR [LOG_OR_DIR ...] [--jobs N] [--json]
+
+import argparse
+import fnmatch
+import gzip
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+
+DEFAULT_PATTERN = "chat_costs*.log*"
+CHUNK_SIZE = 32 * 1024 * 1024  # Plain files larger than this are split across workers
+SERIAL_LIMIT = 8 * 1024 * 1024  # Below this much input a process pool costs more than it saves
+
+class Aggregate:
+    """Mergeable totals for a set of log entries"""
+
+    def __init__(self):
+        self.cost = 0.0
+        self.tokens = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.messages = 0
+        self.skipped = 0
+        self.first = None
+        self.last = None
+        self.models: Dict[str, list] = {}   # model -> [cost, tokens, messages]
+        self.days: Dict[str, list] = {}     # YYYY-MM-DD -> [cost, tokens, messages]
+        self.sources: Dict[str, list] = {}  # input argument -> [cost, tokens, messages]
+
+    def add_line(self, line: bytes, source: str):
+        try:
+            entry = json.loads(line)
+            model = str(entry["model"])
+            cost = float(entry["cost_usd"])
+            tokens = int(entry["total_tokens"])
+            prompt_tokens = int(entry.get("prompt_tokens", 0))
+            completion_tokens = int(entry.get("completion_tokens", 0))
+            timestamp = str(entry["timestamp"])
+        except (ValueError, KeyError, TypeError):
+            if line.strip():
+                self.skipped += 1
+            return
+        self.cost += cost
+        self.tokens += tokens
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.messages += 1
+        # ISO timestamps compare correctly as strings
+        if self.first is None or timestamp < self.first:
+            self.first = timestamp
+        if self.last is None or timestamp > self.last:
+            self.last = timestamp
+        for table, key in ((self.models, model), (self.days, timestamp[:10]), (self.sources, source)):
+            totals = table.get(key)
+            if totals is None:
+                totals = table[key] = [0.0, 0, 0]
+            totals[0] += cost
+            totals[1] += tokens
+            totals[2] += 1
+
+    def merge(self, other: "Aggregate"):
+        self.cost += other.cost
+        self.tokens += other.tokens
+        self.prompt_tokens += other.prompt_tokens
+        self.completion_tokens += other.completion_tokens
+        self.messages += other.messages
+        self.skipped += other.skipped
+        if other.first is not None and (self.first is None or other.first < self.first):
+            self.first = other.first
+        if other.last is not None and (self.last is None or other.last > self.last):
+            self.last = other.last
+        for mine, theirs in ((self.models, other.models), (self.days, other.days),
+                             (self.sources, other.sources)):
+            for key, (cost, tokens, messages) in theirs.items():
+                totals = mine.setdefault(key, [0.0, 0, 0])
+                totals[0] += cost
+                totals[1] += tokens
+                totals[2] += messages
+
+    def to_dict(self) -> dict:
+        def table(rows):
+            return {key: {"cost_usd": round(c, 9), "tokens": t, "messages": m}
+                    for key, (c, t, m) in sorted(rows.items())}
+        return {
+            "total_cost_usd": round(self.cost, 9),
+            "total_tokens": self.tokens,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "messages": self.messages,
+            "skipped_lines": self.skipped,
+            "first_entry": self.first,
+            "last_entry": self.last,
+            "by_model": table(self.models),
+            "by_day": table(self.days),
+            "by_source": table(self.sources),
+        }
+
+def find_logs(paths: List[str], pattern: str = DEFAULT_PATTERN) -> List[Tuple[str, str]]:
+    """(file, source label) for every log file named or found under a directory"""
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in sorted(files):
+                    if fnmatch.fnmatch(name, pattern):
+                        found.append((os.path.join(root, name), path))
+        elif os.path.exists(path):
+            found.append((path, path))
+        else:
+            print(f"Skipping missing path: {path}")
+    return found
+
+def plan_tasks(logs: List[Tuple[str, str]], chunk_size: int = CHUNK_SIZE) -> List[tuple]:
+    """Split plain files into byte ranges; compressed files are read whole"""
+    tasks = []
+    for path, source in logs:
+        if path.endswith(".gz"):
+            tasks.append((path, source, 0, None))
+            continue
+        size = os.path.getsize(path)
+        for start in range(0, max(size, 1), chunk_size):
+            tasks.append((path, source, start, min(start + chunk_size, size)))
+    return tasks
+
+def aggregate_range(task: tuple) -> Aggregate:
+    """Parse the lines that start inside [start, end) of one file (worker entry point)"""
+    path, source, start, end = task
+    result = Aggregate()
+    if path.endswith(".gz"):
+        with gzip.open(path, "rb") as f:
+            for line in f:
+                result.add_line(line, source)
+        return result
+
+    with open(path, "rb") as f:
+        if start > 0:
+            # The line straddling `start` belongs to the previous range
+            f.seek(start - 1)
+            f.readline()
+        position = f.tell()
+        while position < end:
+            line = f.readline()
+            if not line:
+                break
+            position += len(line)
+            result.add_line(line, source)
+    return result
+
+def aggregate(paths: List[str], jobs: int = None, pattern: str = DEFAULT_PATTERN,
+              chunk_size: int = CHUNK_SIZE) -> Tuple[Aggregate, int]:
+    """Merged aggregate over every log under `paths`, and the number of files read"""
+    logs = find_logs(paths, pattern)
+    tasks = plan_tasks(logs, chunk_size)
+    total = Aggregate()
+    input_bytes = sum(os.path.getsize(path) for path, _ in logs)
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1 or len(tasks) == 1 or input_bytes < SERIAL_LIMIT:
+        for task in tasks:
+            total.merge(aggregate_range(task))
+    else:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(tasks))) as pool:
+            for partial in pool.map(aggregate_range, tasks):
+                total.merge(partial)
+    return total, len(logs)
+
+def print_report(result: Aggregate, file_count: int, elapsed: float):
+    from cost_tracking import MODEL_PRICING
+
+    print("\nAGGREGATED COST ANALYSIS")
+    print("=" * 60)
+    print(f"{file_count} log files, {result.messages:,} entries "
+          f"({result.skipped} unparseable lines) in {elapsed:.2f}s")
+    if result.messages == 0:
+        return
+    print(f"Period: {result.first[:19]} to {result.last[:19]}")
+    print(f"Total spent: ${result.cost:.6f}")
+    print(f"Total tokens: {result.tokens:,} ({result.prompt_tokens:,} prompt, {result.completion_tokens:,} completion)")
+    print(f"Average per message: ${result.cost / result.messages:.6f}")
+
+    print("\nCost by Model:")
+    for model, (cost, tokens, messages) in sorted(result.models.items(), key=lambda item: -item[1][0]):
+        model_name = MODEL_PRICING.get(model, {}).get("name", model)
+        print(f"- {model_name}")
+        print(f"  ${cost:.6f} | {tokens:,} tokens | {messages} messages")
+
+    if len(result.sources) > 1:
+        print("\nCost by Source:")
+        for source, (cost, tokens, messages) in sorted(result.sources.items(), key=lambda item: -item[1][0]):
+            print(f"- {source}: ${cost:.6f} | {tokens:,} tokens | {messages} messages")
+
+    days = sorted(result.days.items())
+    print("\nCost by Day:")
+    for day, (cost, tokens, messages) in days[-14:]:
+        print(f"  {day}  ${cost:.6f} | {messages} messages")
+    if len(days) > 14:
+        print(f"  ... {len(days) - 14} earlier days omitted")
+
+    avg_daily = result.cost / len(days)
+    print(f"\nAverage daily spend: ${avg_daily:.6f} | Monthly projection: ${avg_daily * 30:.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Aggregate chat_costs.log files from many hosts in parallel")
+    parser.add_argument("paths", nargs="+", help="log files or directories (searched recursively)")
+    parser.add_argument("--jobs", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--pattern", default=DEFAULT_PATTERN,
+                        help=f"file name pattern inside directories (default: {DEFAULT_PATTERN})")
+    parser.add_argument("--chunk-mb", type=float, default=CHUNK_SIZE / 1024 / 1024,
+                        help="split plain files into ranges of this size")
+    parser.add_argument("--json", action="store_true", help="print the merged aggregate as JSON")
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    result, file_count = aggregate(args.paths, args.jobs, args.pattern, int(args.chunk_mb * 1024 * 1024))
+    elapsed = time.perf_counter() - start_time
+    if args.json:
+        print(json.dumps(result.to_dict(), indent=2))
+    else:
+        print_report(result, file_count, elapsed)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+# max_tokens_tuner.py - Adaptive max_tokens from Observed Completion Lengths
+#
+# Learns how long each model's (and optionally each session's) replies
+# really are from chat_costs.log and live traffic, then picks a max_tokens
+# cap around the 95th percentile with headroom. Caps widen automatically
+# when too many replies get truncated (finish_reason "length"), so quality
+# is protected while chatty models can't run away with generation time and
+# spend. Also estimates completion tokens, cost and latency before a call
+# Dependencies: none (standard library only)
+
+import json
+import math
+import os
+import threading
+from collections import OrderedDict, deque
+from typing import Dict, Optional
+
+DEFAULT_MAX_TOKENS = 500  # Used until a model has enough history, and never exceeded
+MIN_MAX_TOKENS = 64
+MIN_SAMPLES = 30          # Per model before its cap is trusted
+MIN_SESSION_SAMPLES = 10  # Per session before it gets its own cap
+HEADROOM = 1.25           # Multiplier on the 95th percentile length
+TARGET_TRUNCATION = 0.02  # Acceptable share of replies cut off by the cap
+MAX_BOOST = 4.0
+HISTORY = 500             # Recent completions kept per model
+SESSION_HISTORY = 100
+MAX_SESSIONS = 1000
+
+def _percentile(values, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+class _Stats:
+    """Recent completion lengths, truncations and latencies for one model or session"""
+
+    def __init__(self, size: int):
+        self.lengths = deque(maxlen=size)
+        self.truncated = deque(maxlen=size)  # Only replies that ran under a learned cap
+        self.latencies = deque(maxlen=size)  # (completion tokens, seconds)
+        self.boost = 1.0
+
+    def add(self, tokens: int, truncated: Optional[bool], latency: Optional[float]):
+        self.lengths.append(tokens)
+        if truncated is not None:
+            self.truncated.append(truncated)
+        if latency:
+            self.latencies.append((tokens, latency))
+
+    def truncation_rate(self) -> float:
+        return sum(self.truncated) / len(self.truncated) if self.truncated else 0.0
+
+class MaxTokensTuner:
+    """Per-model / per-session max_tokens caps and up-front estimates"""
+
+    def __init__(self, max_tokens: int = DEFAULT_MAX_TOKENS, pricing: Optional[Dict[str, dict]] = None):
+        self.max_tokens = max_tokens
+        self.pricing = pricing or {}
+        self.models: Dict[str, _Stats] = {}
+        self.sessions: "OrderedDict[str, _Stats]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def load_log(self, path: str = "chat_costs.log") -> int:
+        """Seed history from a cost log; returns the number of entries used"""
+        if not os.path.exists(path):
+            return 0
+        count = 0
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    model = entry["model"]
+                    tokens = int(entry["completion_tokens"])
+                except (ValueError, KeyError, TypeError):
+                    continue
+                timings = entry.get("timings_ms") or {}
+                upstream_ms = timings.get("upstream") or (timings.get("connect", 0) + timings.get("generate", 0))
+                self.observe(model, tokens, entry.get("finish_reason"), entry.get("max_tokens"),
+                             tuned=entry.get("max_tokens_tuned", False),
+                             latency=upstream_ms / 1000 if upstream_ms else None)
+                count += 1
+        return count
+
+    def _model_stats(self, model: str) -> _Stats:
+        stats = self.models.get(model)
+        if stats is None:
+            stats = self.models[model] = _Stats(HISTORY)
+        return stats
+
+    def _session_stats(self, session: str) -> _Stats:
+        stats = self.sessions.get(session)
+        if stats is None:
+            stats = self.sessions[session] = _Stats(SESSION_HISTORY)
+            while len(self.sessions) > MAX_SESSIONS:
+                self.sessions.popitem(last=False)
+        self.sessions.move_to_end(session)
+        return stats
+
+    def observe(self, model: str, completion_tokens: int, finish_reason: Optional[str] = None,
+                max_tokens: Optional[int] = None, tuned: bool = False, session: Optional[str] = None,
+                latency: Optional[float] = None):
+        """Record a finished reply; adjusts the model's headroom if truncations drift
+        
+        Truncation only counts against caps the tuner chose (tuned=True) - the
+        default cap is a hard ceiling that headroom cannot raise.
+        """
+        truncated = None
+        if tuned and max_tokens:
+            truncated = finish_reason == "length" or (finish_reason is None and completion_tokens >= max_tokens)
+        with self.lock:
+            stats = self._model_stats(model)
+            stats.add(completion_tokens, truncated, latency)
+            if truncated is not None and len(stats.truncated) >= 20:
+                rate = stats.truncation_rate()
+                if rate > TARGET_TRUNCATION:
+                    stats.boost = min(MAX_BOOST, stats.boost * 1.25)
+                    stats.truncated.clear()  # Judge the new cap on fresh replies
+                elif rate == 0 and stats.boost > 1.0:
+                    stats.boost = max(1.0, stats.boost * 0.98)
+            if session:
+                self._session_stats(session).add(completion_tokens, truncated, latency)
+
+    def _cap(self, stats: _Stats, boost: float) -> int:
+        cap = math.ceil(_percentile(stats.lengths, 95) * HEADROOM * boost)
+        return max(MIN_MAX_TOKENS, min(self.max_tokens, cap))
+
+    def plan(self, model: str, prompt_tokens: int, session: Optional[str] = None) -> dict:
+        """max_tokens for the next request plus expected tokens, cost and latency"""
+        with self.lock:
+            stats = self.models.get(model)
+            session_stats = self.sessions.get(session) if session else None
+            if session_stats is not None and len(session_stats.lengths) >= MIN_SESSION_SAMPLES:
+                source, chosen = "session", session_stats
+            elif stats is not None and len(stats.lengths) >= MIN_SAMPLES:
+                source, chosen = "model", stats
+            else:
+                source, chosen = "default", None
+
+            boost = stats.boost if stats is not None else 1.0
+            if chosen is None:
+                max_tokens = self.max_tokens
+                expected = min(self.max_tokens, 64 + prompt_tokens)  # No history: longer prompts, longer answers
+            else:
+                max_tokens = self._cap(chosen, boost)
+                expected = min(max_tokens, int(_percentile(chosen.lengths, 50)))
+            latency = self._latency(stats, expected)
+
+        price = self.pricing.get(model)
+        result = {
+            "max_tokens": max_tokens,
+            "tuned": source != "default",
+            "source": source,
+            "expected_completion_tokens": expected,
+            "expected_latency_s": round(latency, 3) if latency is not None else None,
+        }
+        if price:
+            input_cost = prompt_tokens / 1000 * price["input_per_1k"]
+            result["expected_cost"] = round(input_cost + expected / 1000 * price["output_per_1k"], 9)
+            result["max_cost"] = round(input_cost + max_tokens / 1000 * price["output_per_1k"], 9)
+        return result
+
+    @staticmethod
+    def _latency(stats: Optional[_Stats], tokens: int) -> Optional[float]:
+        """Least-squares fit of latency = base + per_token * tokens over recent replies"""
+        if stats is None or len(stats.latencies) < 5:
+            return None
+        points = list(stats.latencies)
+        n = len(points)
+        mean_x = sum(x for x, _ in points) / n
+        mean_y = sum(y for _, y in points) / n
+        var_x = sum((x - mean_x) ** 2 for x, _ in points)
+        if var_x == 0:
+            return mean_y
+        slope = max(0.0, sum((x - mean_x) * (y - mean_y) for x, y in points) / var_x)
+        return max(0.0, mean_y + slope * (tokens - mean_x))
+
+    def report(self) -> str:
+        """Per-model caps, length percentiles and truncation rates"""
+        lines = [f"{'model':<40} {'n':>5} {'p50':>5} {'p95':>5} {'cap':>5} {'trunc':>6}"]
+        with self.lock:
+            for model, stats in sorted(self.models.items()):
+                if not stats.lengths:
+                    continue
+                cap = self._cap(stats, stats.boost) if len(stats.lengths) >= MIN_SAMPLES else self.max_tokens
+                lines.append(f"{model:<40} {len(stats.lengths):>5} {_percentile(stats.lengths, 50):>5.0f} "
+                             f"{_percentile(stats.lengths, 95):>5.0f} {cap:>5} {stats.truncation_rate():>6.1%}")
+        if len(lines) == 1:
+            return "No completion history yet - using max_tokens=%d" % self.max_tokens
+        return "\n".join(lines)
@@ -0,0 +1,91 @@
+# model_cache.py - Shared Model Availability Cache
+#
+# Machine-readable record of which models respond through the goop proxy
+# Written by verify_models.py, read by chat_with_costs.py and web_chat.py
+# Dependencies: none (standard library only)
+
+import json
+import os
+import time
+from typing import Dict, List, Optional
+
+CACHE_FILE = "model_cache.json"
+
+# How long a verification result stays fresh (seconds)
+DEFAULT_TTL = 6 * 60 * 60       # Working models are re-checked every 6 hours
+FAILURE_TTL = 15 * 60           # Failing models are retried after 15 minutes
+
+# Per-model overrides - preview models come and go more often
+MODEL_TTLS = {
+    "vertex/gemini-2.5-flash-preview-05-20": 60 * 60,
+    "vertex/gemini-2.5-pro-preview-05-06": 60 * 60,
+}
+
+class ModelCache:
+    """Availability and latency results keyed by model name"""
+
+    def __init__(self, path: str = CACHE_FILE):
+        self.path = path
+        self.entries: Dict[str, dict] = {}
+        self.load()
+
+    def load(self):
+        """Load cache from disk, starting empty if missing or unreadable"""
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                self.entries = data.get("models", {})
+        except Exception:
+            self.entries = {}
+
+    def save(self):
+        """Write cache atomically so readers never see a partial file"""
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": 1, "models": self.entries}, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def record(self, model: str, ok: bool, latency: float = 0.0,
+               error: Optional[str] = None, ttl: Optional[float] = None):
+        """Store the result of a single verification"""
+        if ttl is None:
+            ttl = MODEL_TTLS.get(model, DEFAULT_TTL) if ok else FAILURE_TTL
+        self.entries[model] = {
+            "ok": ok,
+            "latency": round(latency, 3),
+            "error": error[:200] if error else None,
+            "checked_at": time.time(),
+            "ttl": ttl,
+        }
+
+    def is_fresh(self, model: str, now: Optional[float] = None) -> bool:
+        """True if the model has a result that has not expired"""
+        entry = self.entries.get(model)
+        if not entry:
+            return False
+        now = time.time() if now is None else now
+        return now - entry.get("checked_at", 0) < entry.get("ttl", DEFAULT_TTL)
+
+    def needs_check(self, model: str, now: Optional[float] = None) -> bool:
+        """True for unknown, stale or previously failing models"""
+        if not self.is_fresh(model, now):
+            return True
+        return not self.entries[model].get("ok", False)
+
+    def is_available(self, model: str) -> Optional[bool]:
+        """True/False from a fresh result, None when we don't know"""
+        if not self.is_fresh(model):
+            return None
+        return bool(self.entries[model].get("ok"))
+
+    def latency(self, model: str) -> Optional[float]:
+        """Measured latency of a fresh, working model"""
+        if self.is_available(model):
+            return self.entries[model].get("latency")
+        return None
+
+    def filter_available(self, models: List[str]) -> List[str]:
+        """Drop models known to be down; keep working and unverified ones"""
+        usable = [m for m in models if self.is_available(m) is not False]
+        return usable if usable else list(models)
@@ -0,0 +1,195 @@
+# model_compare.py - Multi-Model Fan-Out Comparison
+#
+# Sends one prompt to several models at once and streams every reply in
+# parallel, measuring time to first token, total latency, tokens and cost
+# per model. Wall time is the slowest model's rather than the sum, so
+# comparing N models costs about as much waiting as asking the slowest one
+# Used by: chat_with_costs.py ('compare' command), web_chat.py (compare mode)
+# Dependencies: pip install openai
+
+import contextvars
+import shutil
+import textwrap
+import threading
+import time
+from contextlib import nullcontext
+from typing import Callable, Dict, List, Optional
+
+from budget import BudgetExceeded
+from tracing import KIND_CLIENT, tracer
+
+def _stream_one(client, model: str, messages: list, max_tokens: int, cost_tracker,
+                on_event: Optional[Callable], cancel_event: threading.Event, slot, tags: Optional[dict],
+                budgets, session: Optional[str], estimator) -> dict:
+    """Stream one model's reply; never raises - failures end up in result["error"]"""
+    result = {"model": model, "text": "", "ttft_s": None, "latency_s": None, "prompt_tokens": 0,
+              "completion_tokens": 0, "cost": 0.0, "finish_reason": None, "estimated": False,
+              "error": None, "cancelled": False}
+    parts = []
+    usage = None
+    stream = None
+    start = None
+    hold = None
+    prompt_estimate = estimator.estimate(model, messages) if estimator is not None else \
+        max(1, sum(len(m["content"]) for m in messages) // 4)
+    if budgets is not None:
+        try:
+            hold = budgets.reserve(model, session, prompt_estimate, max_tokens)
+            max_tokens = hold.max_tokens
+        except BudgetExceeded as e:
+            result["error"] = str(e)[:200]
+            if on_event:
+                on_event("done", model, result)
+            return result
+    try:
+        with slot(model) if slot else nullcontext():
+            start = time.perf_counter()
+            stream = client.chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=0.7,
+                stream=True,
+                stream_options={"include_usage": True}  # Final chunk carries exact token counts
+            )
+            for chunk in stream:
+                if cancel_event.is_set():
+                    result["cancelled"] = True
+                    break
+                if chunk.usage:
+                    usage = chunk.usage
+                if chunk.choices and chunk.choices[0].finish_reason:
+                    result["finish_reason"] = chunk.choices[0].finish_reason
+                if chunk.choices and chunk.choices[0].delta.content:
+                    text = chunk.choices[0].delta.content
+                    if result["ttft_s"] is None:
+                        result["ttft_s"] = round(time.perf_counter() - start, 3)
+                    parts.append(text)
+                    if on_event:
+                        on_event("delta", model, text)
+    except Exception as e:
+        result["error"] = str(e)[:200]
+    finally:
+        if stream is not None:
+            stream.close()  # Stops generation upstream if we left early
+    if start is not None:
+        result["latency_s"] = round(time.perf_counter() - start, 3)
+    result["text"] = "".join(parts)
+
+    if usage is not None:
+        result["prompt_tokens"], result["completion_tokens"] = usage.prompt_tokens, usage.completion_tokens
+        if estimator is not None:
+            estimator.observe(model, prompt_estimate, usage.prompt_tokens)
+    elif parts or result["cancelled"]:
+        # Cut short before the usage chunk - charge the prompt estimate and ~4 characters per reply token
+        result["prompt_tokens"] = prompt_estimate
+        result["completion_tokens"] = max(1, len(result["text"]) // 4) if parts else 0
+        result["estimated"] = True
+    if result["prompt_tokens"] or result["completion_tokens"]:
+        timings = {"ttft": round(result["ttft_s"] * 1000, 3)} if result["ttft_s"] is not None else {}
+        timings["upstream"] = round(result["latency_s"] * 1000, 3)
+        cost_info = cost_tracker.track_usage(model, result["prompt_tokens"], result["completion_tokens"], log=False,
+                                             latency=result["latency_s"],
+                                             detect=not (result["estimated"] or result["cancelled"] or result["error"]))
+        result["cost"] = cost_info["request_cost"]
+        if "anomalies" in cost_info:
+            result["anomalies"] = cost_info["anomalies"]
+        if hold is not None:
+            budgets.settle(hold, result["cost"])
+        cost_tracker.log_usage(model, result["prompt_tokens"], result["completion_tokens"], result["cost"],
+                               timings, max_tokens=max_tokens, finish_reason=result["finish_reason"], tags=tags)
+    elif hold is not None:
+        budgets.release(hold)
+    if on_event:
+        on_event("done", model, result)
+    return result
+
+def compare_models(client, models: List[str], messages: list, cost_tracker, max_tokens: int = 500,
+                   on_event: Optional[Callable] = None, cancel_event: threading.Event = None,
+                   slot: Optional[Callable] = None, tags: Optional[dict] = None, budgets=None,
+                   session: Optional[str] = None, estimator=None) -> dict:
+    """Fan one conversation out to every model concurrently and wait for all replies
+
+    on_event(kind, model, payload) is called from worker threads with kind
+    "delta" (payload: text) or "done" (payload: the model's result dict).
+    slot(model), if given, returns a context manager held while that model
+    streams (web_chat uses it to take upstream scheduler slots). tags are
+    attached to every model's log record for cost attribution. With a
+    budget.BudgetManager each model reserves its worst case first; a model
+    that does not fit is reported with the budget error and not called.
+    A budget.TokenEstimator estimates the prompt per model and is
+    calibrated with the prompt tokens each model reports.
+    """
+    cancel_event = cancel_event or threading.Event()
+    results: Dict[str, dict] = {}
+
+    def worker(model):
+        with tracer.span(f"chat {model}", KIND_CLIENT, {"gen_ai.request.model": model}) as span:
+            result = results[model] = _stream_one(client, model, messages, max_tokens, cost_tracker,
+                                                  on_event, cancel_event, slot, tags, budgets, session, estimator)
+            span.set({"gen_ai.usage.input_tokens": result["prompt_tokens"],
+                      "gen_ai.usage.output_tokens": result["completion_tokens"], "goop.cost_usd": result["cost"],
+                      "goop.ttft_s": result["ttft_s"], "goop.cancelled": result["cancelled"]})
+            if result["error"]:
+                span.fail(result["error"])
+
+    wall_start = time.perf_counter()
+    # Each thread runs in a copy of the caller's context, so its spans join the caller's trace
+    threads = [threading.Thread(target=contextvars.copy_context().run, args=(worker, model), daemon=True,
+                                name=f"compare-{model}")
+               for model in models]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(0.1)  # Short joins keep Ctrl-C responsive in the terminal
+    except KeyboardInterrupt:
+        cancel_event.set()
+        for thread in threads:
+            thread.join()
+    wall = time.perf_counter() - wall_start
+
+    ordered = [results[model] for model in models if model in results]
+    return {
+        "results": ordered,
+        "wall_s": round(wall, 3),
+        "sum_latency_s": round(sum(r["latency_s"] or 0 for r in ordered), 3),
+        "cost": sum(r["cost"] for r in ordered),
+        "tokens": sum(r["prompt_tokens"] + r["completion_tokens"] for r in ordered),
+    }
+
+def side_by_side(columns: List[tuple], width: int = None, tail: int = None) -> List[str]:
+    """Lay out (title, text) pairs as wrapped columns; tail keeps only the last N body lines"""
+    width = width or shutil.get_terminal_size((120, 24)).columns
+    col_width = max(12, (width - 3 * (len(columns) - 1)) // max(1, len(columns)))
+    wrapped = []
+    for _, text in columns:
+        lines = []
+        for paragraph in text.split("\n"):
+            lines.extend(textwrap.wrap(paragraph, col_width) or [""])
+        wrapped.append(lines[-tail:] if tail else lines)
+    height = tail or max((len(lines) for lines in wrapped), default=0)
+    out = [" | ".join(title[:col_width].ljust(col_width) for title, _ in columns),
+           "-+-".join("-" * col_width for _ in columns)]
+    for row in range(height):
+        out.append(" | ".join((lines[row] if row < len(lines) else "").ljust(col_width)
+                              for lines in wrapped).rstrip())
+    return out
+
+def metrics_table(summary: dict, names: Dict[str, str] = None) -> str:
+    """Per-model TTFT, latency, tokens and cost, plus wall time vs sequential time"""
+    names = names or {}
+    lines = [f"{'model':<28} {'ttft':>7} {'latency':>8} {'prompt':>7} {'compl':>6} {'cost':>11}  status"]
+    for r in summary["results"]:
+        ttft = f"{r['ttft_s']:.2f}s" if r["ttft_s"] is not None else "-"
+        latency = f"{r['latency_s']:.2f}s" if r["latency_s"] is not None else "-"
+        status = ("error: " + r["error"][:40]) if r["error"] else "cancelled" if r["cancelled"] else \
+            "truncated" if r["finish_reason"] == "length" else "ok"
+        if r["estimated"]:
+            status += " (est. tokens)"
+        lines.append(f"{names.get(r['model'], r['model'])[:28]:<28} {ttft:>7} {latency:>8} "
+                     f"{r['prompt_tokens']:>7} {r['completion_tokens']:>6} ${r['cost']:>10.6f}  {status}")
+    lines.append(f"Wall time {summary['wall_s']:.2f}s (sequential would be ~{summary['sum_latency_s']:.2f}s) | "
+                 f"Total ${summary['cost']:.6f} | {summary['tokens']:,} tokens")
+    return "\n".join(lines)
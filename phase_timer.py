@@ -0,0 +1,141 @@
+# phase_timer.py - Lightweight Per-Phase Request Timing
+#
+# Times the stages of a request (parse, queue, upstream, cost, encode, write)
+# for Server-Timing headers, cost log records and an aggregated histogram.
+# Inside a trace (tracing.py) every phase is also a span
+# Disable with GOOP_PHASE_TIMING=0 - timers then do nothing but trace
+# Dependencies: none (standard library only)
+
+import bisect
+import os
+import threading
+import time
+from typing import Dict, List, Tuple
+
+from tracing import current_span, tracer
+
+PHASE_TIMING_ENABLED = os.environ.get("GOOP_PHASE_TIMING", "1") != "0"
+
+# Histogram bucket upper bounds in milliseconds (roughly logarithmic)
+BUCKET_BOUNDS_MS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500,
+                    1000, 2500, 5000, 10000, 30000, 60000, float("inf")]
+
+class _NullPhase:
+    """Shared no-op context used when timing is disabled"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_PHASE = _NullPhase()
+
+class _Phase:
+    __slots__ = ("timer", "name", "start", "span")
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.span = tracer.span(self.name)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timer.record(self.name, time.perf_counter() - self.start)
+        self.span.__exit__(*exc)
+        return False
+
+class PhaseTimer:
+    """Collects named phase durations for one request"""
+
+    __slots__ = ("enabled", "phases")
+
+    def __init__(self, enabled: bool = None):
+        self.enabled = PHASE_TIMING_ENABLED if enabled is None else enabled
+        self.phases: List[Tuple[str, float]] = []
+
+    def phase(self, name: str):
+        """Context manager timing one phase"""
+        return _Phase(self, name) if self.enabled or current_span().span_id else _NULL_PHASE
+
+    def record(self, name: str, seconds: float):
+        if self.enabled:
+            self.phases.append((name, seconds))
+
+    def as_dict(self) -> Dict[str, float]:
+        """Phase durations in milliseconds (repeated phases are summed)"""
+        result: Dict[str, float] = {}
+        for name, seconds in self.phases:
+            result[name] = round(result.get(name, 0.0) + seconds * 1000, 3)
+        return result
+
+    def server_timing(self) -> str:
+        """Value for the Server-Timing response header"""
+        return ", ".join(f"{name};dur={ms:.3f}" for name, ms in self.as_dict().items())
+
+    def total_ms(self) -> float:
+        return sum(seconds for _, seconds in self.phases) * 1000
+
+class PhaseStats:
+    """Process-wide per-phase histograms, updated once per finished request"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms: Dict[str, List[int]] = {}
+        self.totals: Dict[str, float] = {}
+
+    def add(self, timer: PhaseTimer):
+        if not timer.enabled:
+            return
+        with self.lock:
+            for name, ms in timer.as_dict().items():
+                buckets = self.histograms.get(name)
+                if buckets is None:
+                    buckets = self.histograms[name] = [0] * len(BUCKET_BOUNDS_MS)
+                    self.totals[name] = 0.0
+                buckets[bisect.bisect_left(BUCKET_BOUNDS_MS, ms)] += 1
+                self.totals[name] += ms
+
+    @staticmethod
+    def _percentile(buckets: List[int], pct: float) -> float:
+        """Upper bound of the bucket holding the percentile"""
+        target = sum(buckets) * pct / 100
+        seen = 0
+        for bound, count in zip(BUCKET_BOUNDS_MS, buckets):
+            seen += count
+            if seen >= target and count:
+                return bound
+        return 0.0
+
+    def snapshot(self) -> Dict[str, dict]:
+        """Count, average and approximate percentiles (ms) per phase"""
+        with self.lock:
+            result = {}
+            for name, buckets in self.histograms.items():
+                count = sum(buckets)
+                result[name] = {
+                    "count": count,
+                    "avg_ms": round(self.totals[name] / count, 3) if count else 0.0,
+                    "p50_ms": self._percentile(buckets, 50),
+                    "p95_ms": self._percentile(buckets, 95),
+                    "p99_ms": self._percentile(buckets, 99),
+                }
+            return result
+
+    def report(self) -> str:
+        """Formatted per-phase table for the terminal"""
+        snapshot = self.snapshot()
+        if not snapshot:
+            return "No phase timings recorded"
+        lines = ["Phase timings (ms, percentiles are bucket upper bounds):",
+                 f"{'phase':<12} {'count':>7} {'avg':>10} {'p50':>8} {'p95':>8} {'p99':>8}"]
+        for name, stats in snapshot.items():
+            lines.append(f"{name:<12} {stats['count']:>7} {stats['avg_ms']:>10.3f} "
+                         f"{stats['p50_ms']:>8g} {stats['p95_ms']:>8g} {stats['p99_ms']:>8g}")
+        return "\n".join(lines)
+
+# Shared by every request in this process
+phase_stats = PhaseStats()
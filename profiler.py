@@ -0,0 +1,164 @@
+# profiler.py - Low-Overhead Profiling for the goop utilities
+#
+# Backs the --profile flag of chat_with_costs.py, web_chat.py and
+# verify_models.py: a sampling thread records every thread's stack into
+# collapsed-stack output (flamegraph.pl / speedscope), and cProfile runs in
+# every thread started during the run, merged into one .prof file. From
+# Python 3.12 cProfile sits on sys.monitoring, which allows one enabled
+# profiler per interpreter - that one profiler then sees every thread
+# Dependencies: none (standard library only)
+
+import cProfile
+import datetime
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import List
+
+PROFILE_DIR = "profiles"
+# cProfile on sys.monitoring (3.12+) is interpreter-wide: a second enable() raises ValueError
+SHARED_PROFILER = sys.version_info >= (3, 12)
+DEFAULT_INTERVAL = 0.005  # 200 samples/s keeps overhead to a few percent
+
+class SamplingProfiler:
+    """Samples the stacks of all threads from a background thread"""
+
+    def __init__(self, interval: float = DEFAULT_INTERVAL):
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self.sample_count = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.labels = {}  # Code object -> frame label, so formatting happens once per function
+
+    def _label(self, code) -> str:
+        label = self.labels.get(code)
+        if label is None:
+            label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            label = self.labels[code] = label.replace(";", ":")
+        return label
+
+    def _sample(self):
+        own_id = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+            stack.append(names.get(thread_id, f"thread-{thread_id}"))
+            self.samples[";".join(reversed(stack))] += 1
+        self.sample_count += 1
+
+    def _run(self):
+        next_time = time.perf_counter()
+        while not self.stop_event.is_set():
+            self._sample()
+            next_time += self.interval
+            delay = next_time - time.perf_counter()
+            if delay > 0:
+                self.stop_event.wait(delay)
+            else:
+                next_time = time.perf_counter()  # Fell behind - don't burst to catch up
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def write_collapsed(self, path: str):
+        """One 'root;caller;callee count' line per distinct stack"""
+        with open(path, "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+class ThreadProfiles:
+    """cProfile in the calling thread and in every thread started while active"""
+
+    def __init__(self):
+        self.profiles: List[cProfile.Profile] = []
+        self.lock = threading.Lock()
+        self.main_profile = None
+
+    def _new_profile(self) -> cProfile.Profile:
+        profile = cProfile.Profile()
+        profile.enable()
+        with self.lock:
+            self.profiles.append(profile)
+        return profile
+
+    def _thread_hook(self, frame, event, arg):
+        # Runs once at the start of each new thread, then hands over to cProfile
+        sys.setprofile(None)
+        try:
+            self._new_profile()
+        except ValueError:
+            pass  # Another profiler is active - the thread must still run, just unprofiled
+
+    def start(self):
+        if not SHARED_PROFILER:
+            threading.setprofile(self._thread_hook)
+        self.main_profile = self._new_profile()
+
+    def stop(self):
+        if not SHARED_PROFILER:
+            threading.setprofile(None)
+        self.main_profile.disable()
+
+    def stats(self) -> pstats.Stats:
+        with self.lock:
+            profiles = list(self.profiles)
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            try:
+                stats.add(profile)
+            except (TypeError, ValueError):
+                pass  # Thread never made a profiled call
+        return stats
+
+def profile_paths(name: str, output_dir: str = PROFILE_DIR):
+    """Timestamped output paths for one run: (collapsed stacks, cProfile dump)"""
+    stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    base = os.path.join(output_dir, f"{name}-{stamp}")
+    return base + ".collapsed", base + ".prof"
+
+@contextmanager
+def profile_run(name: str, enabled: bool = True, interval: float = DEFAULT_INTERVAL,
+                output_dir: str = PROFILE_DIR, top: int = 15):
+    """Profile the enclosed block and write both outputs when it ends (even on Ctrl+C)"""
+    if not enabled:
+        yield
+        return
+
+    sampler = SamplingProfiler(interval)
+    tracer = ThreadProfiles()
+    sampler.start()
+    tracer.start()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        tracer.stop()
+        sampler.stop()
+        elapsed = time.perf_counter() - started
+
+        os.makedirs(output_dir, exist_ok=True)
+        collapsed_path, prof_path = profile_paths(name, output_dir)
+        sampler.write_collapsed(collapsed_path)
+        stats = tracer.stats()
+        stats.dump_stats(prof_path)
+
+        print(f"\nProfile: {elapsed:.1f}s, {sampler.sample_count} samples every {interval * 1000:g}ms")
+        print(f"Collapsed stacks: {collapsed_path} (flamegraph.pl or https://www.speedscope.app)")
+        print(f"cProfile dump:    {prof_path} (python -m pstats {prof_path})")
+        stats.sort_stats("cumulative").print_stats(top)
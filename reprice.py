@@ -0,0 +1,400 @@
+# reprice.py - What-If Repricing Simulator over Historical Usage
+#
+# Reprices every logged request under every model in MODEL_PRICING (or a
+# candidate price sheet) to answer "what would last month have cost on
+# flash-lite / 2.5-pro / the new prices?". Cost is linear in the token
+# counts, so the log is reduced to per-request token columns (cached next
+# to the log and extended incrementally) and every scenario is a small
+# matrix product over per-model sums of those columns - numpy does it when
+# installed, a plain-Python loop otherwise. Without numpy the per-(model,
+# day) sums are kept in the cache too and only new rows are added to
+# them, so a repeat run does not loop over every request. Reports totals,
+# deltas against the current mix and projected monthly burn per scenario
+# Used by: chat_with_costs.py (cost analysis)
+# Dependencies: none (numpy optional, used when installed)
+# Usage: python reprice.py [chat_costs.log] [--db chat_costs.db] [--prices sheet.json] [--move SRC=DST] [--json]
+
+import argparse
+import datetime
+import json
+import os
+import re
+import time
+from array import array
+from typing import Dict, List, Optional
+
+try:
+    import numpy as np
+except ImportError:  # Optional - the pure-Python path gives the same answers, just slower
+    np = None
+
+CHUNK_SIZE = 32 * 1024 * 1024
+BURN_WINDOW_DAYS = 30  # Monthly burn is projected from the most recent days of history
+# Field order as written by CostTracker.log_usage (json.dumps keeps insertion order); anything else
+# (escaped model names, other writers) falls back to json.loads line by line
+RECORD = re.compile(rb'"timestamp": "(\d{4}-\d\d-\d\d)T[^"]*", "model": "([^"\\]*)", '
+                    rb'"prompt_tokens": (\d+), "completion_tokens": (\d+), "total_tokens": \d+, '
+                    rb'"cost_usd": ([-+.\deE]+)')
+COLUMNS = (("codes", "H"), ("days", "i"), ("prompt", "I"), ("completion", "I"), ("cost", "d"))
+
+class UsageColumns:
+    """Token columns for repricing: one row per request (or per day and model from a usage database)"""
+
+    def __init__(self):
+        self.models: List[str] = []
+        self.model_index: Dict[str, int] = {}
+        self.codes = array("H")        # Index into self.models
+        self.days = array("i")         # date.toordinal() of the request's local day
+        self.prompt = array("I")
+        self.completion = array("I")
+        self.cost = array("d")         # Cost as logged
+        self.requests = array("I")     # 1 per log record; message count for database rows
+        self.skipped = 0
+        self.sums: Dict[tuple, list] = {}  # (code, day) -> [prompt, completion, cost, requests] of rows[:summed]
+        self.summed = 0
+        self._day_cache: Dict[bytes, int] = {}
+        self._scanned_to = 0
+
+    def __len__(self):
+        return len(self.codes)
+
+    def _code(self, model: str) -> int:
+        code = self.model_index.get(model)
+        if code is None:
+            code = self.model_index[model] = len(self.models)
+            self.models.append(model)
+        return code
+
+    def _day(self, text: bytes) -> int:
+        day = self._day_cache.get(text)
+        if day is None:
+            day = self._day_cache[text] = datetime.date.fromisoformat(text.decode()).toordinal()
+        return day
+
+    def day_sums(self) -> Dict[tuple, list]:
+        """Prompt, completion, logged cost and request sums per (model code, day), extended with new rows"""
+        sums = self.sums
+        rows = zip(self.codes[self.summed:], self.days[self.summed:], self.prompt[self.summed:],
+                   self.completion[self.summed:], self.cost[self.summed:], self.requests[self.summed:])
+        for code, day, prompt, completion, cost, requests in rows:
+            cell = sums.get((code, day))
+            if cell is None:
+                sums[(code, day)] = [prompt, completion, cost, requests]
+            else:
+                cell[0] += prompt
+                cell[1] += completion
+                cell[2] += cost
+                cell[3] += requests
+        self.summed = len(self)
+        return sums
+
+    def add(self, model: str, day: int, prompt_tokens: int, completion_tokens: int, cost: float, requests: int = 1):
+        self.codes.append(self._code(model))
+        self.days.append(day)
+        self.prompt.append(prompt_tokens)
+        self.completion.append(completion_tokens)
+        self.cost.append(cost)
+        self.requests.append(requests)
+
+    def _add_matches(self, matches: list):
+        if not matches:
+            return
+        days, models, prompts, completions, costs = zip(*matches)
+        # Few distinct models and days - resolve each once, then map with plain dict lookups
+        codes = {m: self._code(m.decode()) for m in set(models)}
+        day_numbers = {d: self._day(d) for d in set(days)}
+        self.codes.extend(map(codes.__getitem__, models))
+        self.days.extend(map(day_numbers.__getitem__, days))
+        self.prompt.extend(map(int, prompts))
+        self.completion.extend(map(int, completions))
+        self.cost.extend(map(float, costs))
+        self.requests.extend([1] * len(matches))
+
+    def _add_line(self, line: bytes):
+        """Slow path for lines the fast pattern did not match (other field orders, hand-edited logs)"""
+        match = RECORD.search(line)
+        if match:
+            self._add_matches([match.groups()])
+            return
+        try:
+            entry = json.loads(line)
+            self.add(entry["model"], datetime.date.fromisoformat(entry["timestamp"][:10]).toordinal(),
+                     int(entry["prompt_tokens"]), int(entry["completion_tokens"]), float(entry["cost_usd"]))
+        except (ValueError, KeyError, TypeError):
+            if line.strip():
+                self.skipped += 1
+
+    def load_log(self, path: str, cache: bool = True):
+        """Append every record of a chat_costs.log
+        
+        Columns already parsed are read from a hidden .NAME.columns file next
+        to the log (hidden so log_aggregate's chat_costs*.log* pattern skips
+        it); only the bytes
+        appended since are scanned (32MB blocks, one regex pass each), and the
+        cache is rewritten. A log that shrank or was replaced is rescanned.
+        """
+        if len(self) or not cache:
+            self._scan(path, 0)
+            return self
+        offset = self._load_cache(path)
+        if offset < os.path.getsize(path):
+            self._scan(path, offset)
+            if np is None:
+                self.day_sums()  # Cached with the columns, so the next run only sums what is new
+            try:
+                self._save_cache(path)
+            except OSError:
+                pass  # Read-only directory - still correct, just not faster next time
+        return self
+
+    @staticmethod
+    def _cache_path(path: str) -> str:
+        directory, name = os.path.split(path)
+        return os.path.join(directory, "." + name + ".columns")
+
+    @staticmethod
+    def _signature(path: str) -> str:
+        """Identifies the log by its first line, so rotation or replacement invalidates the cache"""
+        with open(path, "rb") as f:
+            return f.readline(4096).hex()[:128]
+
+    def _load_cache(self, path: str) -> int:
+        """Fill the columns from the cache; returns the log offset they cover"""
+        try:
+            with open(self._cache_path(path), "rb") as f:
+                header = json.loads(f.readline())
+                if header.get("columns") != 1 or header["signature"] != self._signature(path) or \
+                        header["offset"] > os.path.getsize(path):
+                    return 0
+                for name, _ in COLUMNS:
+                    getattr(self, name).fromfile(f, header["rows"])
+        except (OSError, ValueError, KeyError, EOFError):
+            self.__init__()
+            return 0
+        self.models = header["models"]
+        self.model_index = {model: i for i, model in enumerate(self.models)}
+        self.requests = array("I", [1]) * header["rows"]
+        self.skipped = header.get("skipped", 0)
+        self.sums = {(code, day): cell for code, day, *cell in header.get("sums", [])}
+        self.summed = header.get("summed", 0)
+        return header["offset"]
+
+    def _save_cache(self, path: str):
+        header = {"columns": 1, "signature": self._signature(path), "offset": self._scanned_to,
+                  "rows": len(self), "models": self.models, "skipped": self.skipped,
+                  "sums": [[code, day, *cell] for (code, day), cell in self.sums.items()], "summed": self.summed}
+        cache_path = self._cache_path(path)
+        tmp_path = cache_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(json.dumps(header).encode() + b"\n")
+            for name, _ in COLUMNS:
+                getattr(self, name).tofile(f)
+        os.replace(tmp_path, cache_path)
+
+    def _scan(self, path: str, offset: int):
+        """Parse complete lines from offset on; a trailing partial line is left for next time"""
+        with open(path, "rb") as f:
+            f.seek(offset)
+            tail = b""
+            while True:
+                block = f.read(CHUNK_SIZE)
+                if not block:
+                    break
+                block = tail + block
+                cut = block.rfind(b"\n") + 1
+                block, tail = block[:cut], block[cut:]
+                self._add_block(block)
+                offset += len(block)
+        self._scanned_to = offset
+
+    def _add_block(self, block: bytes):
+        matches = RECORD.findall(block)
+        if len(matches) == block.count(b"\n"):
+            self._add_matches(matches)
+        else:
+            for line in block.splitlines():
+                self._add_line(line)
+
+    def load_db(self, path: str):
+        """Append the daily per-model rollup of a usage_store database - exact, since cost is linear in tokens"""
+        import usage_store
+        conn = usage_store.connect(path)
+        try:
+            for day, model, messages, cost, prompt_tokens, completion_tokens in conn.execute(
+                    "SELECT day, model, messages, cost_usd, prompt_tokens, completion_tokens FROM daily"):
+                self.add(model, datetime.date.fromisoformat(day).toordinal(), prompt_tokens, completion_tokens,
+                         cost, messages)
+        finally:
+            conn.close()
+        return self
+
+def _model_day_sums(columns: UsageColumns, first_day: int, n_days: int) -> List[list]:
+    """Prompt, completion, logged cost and request sums per (model, day), flattened as code * n_days + day"""
+    size = len(columns.models) * n_days
+    if np is not None:
+        # Zero-copy views of the arrays; each column is summed by one bincount
+        cells = np.frombuffer(columns.codes, dtype=np.uint16).astype(np.int64) * n_days + \
+            (np.frombuffer(columns.days, dtype=np.int32) - first_day)
+        return [np.bincount(cells, weights=np.frombuffer(column, dtype=dtype), minlength=size).tolist()
+                for column, dtype in ((columns.prompt, np.uint32), (columns.completion, np.uint32),
+                                      (columns.cost, np.float64), (columns.requests, np.uint32))]
+    sums = [[0] * size for _ in range(4)]
+    for (code, day), cell in columns.day_sums().items():
+        for column, value in zip(sums, cell):
+            column[code * n_days + day - first_day] = value
+    return sums
+
+def _group_sums(columns: UsageColumns, cell_sums: List[list], n_days: int, from_day: int) -> Dict[str, list]:
+    """[prompt, completion, logged cost, requests] per source model over days from_day (0-based) on"""
+    return {model: [sum(column[code * n_days + from_day:(code + 1) * n_days]) for column in cell_sums]
+            for code, model in enumerate(columns.models)}
+
+def build_scenarios(pricing: Dict[str, dict], models: List[str], moves: Dict[str, str] = None) -> List[tuple]:
+    """(name, {source model: target model or None}) - None keeps the logged cost (model not in the sheet)"""
+    current = {m: (m if m in pricing else None) for m in models}
+    scenarios = [("current mix", current)]
+    if moves:
+        moved = dict(current)
+        for source, target in moves.items():
+            if source in moved:
+                moved[source] = target
+        scenarios.append((", ".join(f"{short(s)} -> {short(t)}" for s, t in moves.items()), moved))
+    for target in pricing:
+        scenarios.append((f"all on {short(target)}", {m: target for m in models}))
+    return scenarios
+
+def short(model: str) -> str:
+    return model.split("/", 1)[-1]
+
+def _price_scenarios(scenarios: List[tuple], sums: Dict[str, list], pricing: Dict[str, dict]) -> List[float]:
+    """Cost of each scenario: one (scenarios x models) price matrix times the token sums"""
+    models = list(sums)
+    in_price = [[pricing[mapping[m]]["input_per_1k"] / 1000 if mapping.get(m) else 0.0 for m in models]
+                for _, mapping in scenarios]
+    out_price = [[pricing[mapping[m]]["output_per_1k"] / 1000 if mapping.get(m) else 0.0 for m in models]
+                 for _, mapping in scenarios]
+    kept = [[sums[m][2] if not mapping.get(m) else 0.0 for m in models] for _, mapping in scenarios]
+    if np is not None and models:
+        prompt = np.array([sums[m][0] for m in models])
+        completion = np.array([sums[m][1] for m in models])
+        return list(np.array(in_price) @ prompt + np.array(out_price) @ completion + np.array(kept).sum(axis=1))
+    return [sum(i * sums[m][0] + o * sums[m][1] + k for m, i, o, k in zip(models, ins, outs, keeps))
+            for ins, outs, keeps in zip(in_price, out_price, kept)]
+
+def simulate(columns: UsageColumns, pricing: Dict[str, dict], moves: Dict[str, str] = None,
+             window_days: int = BURN_WINDOW_DAYS) -> dict:
+    """Totals, deltas vs the current mix and monthly burn for every scenario"""
+    started = time.perf_counter()
+    if not len(columns):
+        return {"records": 0, "scenarios": []}
+    if np is not None:
+        days = np.frombuffer(columns.days, dtype=np.int32)
+        first_day, last_day = int(days.min()), int(days.max())
+    else:
+        days = {day for _, day in columns.day_sums()}
+        first_day, last_day = min(days), max(days)
+    window_start = max(first_day, last_day - window_days + 1)
+    window_span = last_day - window_start + 1
+
+    scenarios = build_scenarios(pricing, columns.models, moves)
+    n_days = last_day - first_day + 1
+    cell_sums = _model_day_sums(columns, first_day, n_days)
+    all_sums = _group_sums(columns, cell_sums, n_days, 0)
+    window_sums = _group_sums(columns, cell_sums, n_days, window_start - first_day)
+    totals = _price_scenarios(scenarios, all_sums, pricing)
+    window = _price_scenarios(scenarios, window_sums, pricing)
+
+    baseline = totals[0]
+    rows = []
+    for (name, _), total, recent in zip(scenarios, totals, window):
+        rows.append({
+            "scenario": name,
+            "cost_usd": round(float(total), 9),
+            "delta_usd": round(float(total - baseline), 9),
+            "delta_pct": round(float((total - baseline) / baseline), 4) if baseline else None,
+            "monthly_burn_usd": round(float(recent) / window_span * 30, 6),
+        })
+    logged = sum(s[2] for s in all_sums.values())
+    return {
+        "records": int(sum(s[3] for s in all_sums.values())),
+        "first_day": datetime.date.fromordinal(first_day).isoformat(),
+        "last_day": datetime.date.fromordinal(last_day).isoformat(),
+        "burn_window_days": window_span,
+        "logged_cost_usd": round(logged, 9),
+        "unpriced_models": [m for m in columns.models if m not in pricing],
+        "by_model": {m: {"prompt_tokens": int(s[0]), "completion_tokens": int(s[1]),
+                         "cost_usd": round(s[2], 9), "requests": int(s[3])} for m, s in all_sums.items()},
+        "scenarios": rows,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 3),
+        "engine": "numpy" if np is not None else "python",
+    }
+
+def print_simulation(result: dict, names: Dict[str, str] = None):
+    names = names or {}
+    print("\nWHAT-IF REPRICING")
+    print("=" * 78)
+    if not result["records"]:
+        print("No usage to reprice.")
+        return
+    print(f"{result['records']:,} requests, {result['first_day']} to {result['last_day']} | "
+          f"logged cost ${result['logged_cost_usd']:.6f} | burn from last {result['burn_window_days']} days")
+    if result["unpriced_models"]:
+        print(f"Not in the price sheet (kept at logged cost unless moved): {', '.join(result['unpriced_models'])}")
+    print(f"\n{'scenario':<44} {'total':>12} {'delta':>12} {'delta%':>8} {'per month':>11}")
+    for row in result["scenarios"]:
+        pct = f"{row['delta_pct']:+.1%}" if row["delta_pct"] is not None else "-"
+        print(f"{row['scenario'][:44]:<44} ${row['cost_usd']:>11.6f} {row['delta_usd']:>+12.6f} {pct:>8} "
+              f"${row['monthly_burn_usd']:>10.2f}")
+    print(f"\nRepriced in {result['elapsed_ms']:.1f}ms ({result['engine']})")
+
+def load_prices(path: Optional[str]) -> Dict[str, dict]:
+    """MODEL_PRICING, overridden or extended by a JSON sheet of {model: {input_per_1k, output_per_1k}}"""
+    from cost_tracking import MODEL_PRICING
+    pricing = {model: dict(price) for model, price in MODEL_PRICING.items()}
+    if path:
+        with open(path, "r") as f:
+            for model, price in json.load(f).items():
+                pricing[model] = dict(pricing.get(model, {}), **price)
+    return pricing
+
+def main():
+    parser = argparse.ArgumentParser(description="Reprice historical usage under other models or prices")
+    parser.add_argument("logs", nargs="*", help="cost logs to read (default: chat_costs.log unless --db is given)")
+    parser.add_argument("--db", metavar="FILE", help="read the daily rollup of a usage_store database instead")
+    parser.add_argument("--prices", metavar="FILE", help="candidate price sheet (JSON) overriding MODEL_PRICING")
+    parser.add_argument("--move", action="append", default=[], metavar="SRC=DST",
+                        help="add a scenario moving SRC's traffic to DST (repeatable; all moves form one scenario)")
+    parser.add_argument("--window", type=int, default=BURN_WINDOW_DAYS, help="days of recent history for monthly burn")
+    parser.add_argument("--json", action="store_true", help="print the result as JSON")
+    args = parser.parse_args()
+
+    pricing = load_prices(args.prices)
+    moves = {}
+    for move in args.move:
+        source, _, target = move.partition("=")
+        if target not in pricing:
+            parser.error(f"--move target {target!r} has no price (add it with --prices)")
+        moves[source] = target
+
+    load_start = time.perf_counter()
+    columns = UsageColumns()
+    if args.db:
+        columns.load_db(args.db)
+    for path in args.logs or ([] if args.db else ["chat_costs.log"]):
+        if os.path.exists(path):
+            columns.load_log(path)
+        else:
+            print(f"No such log: {path}")
+    load_ms = (time.perf_counter() - load_start) * 1000
+
+    result = simulate(columns, pricing, moves, args.window)
+    result["load_ms"] = round(load_ms, 3)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_simulation(result)
+        print(f"Loaded {len(columns):,} rows in {load_ms:.0f}ms" +
+              (f" ({columns.skipped} unreadable lines skipped)" if columns.skipped else ""))
+
+if __name__ == "__main__":
+    main()
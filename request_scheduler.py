@@ -0,0 +1,157 @@
+# request_scheduler.py - Fair, Priority-Aware Upstream Request Scheduler
+#
+# Limits how many requests web_chat.py sends to the goop proxy at once and
+# decides who goes next: priority class first (with aging), then fair share
+# between sessions, then shortest expected job
+# Dependencies: none (standard library only)
+
+import itertools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+class QueueFull(Exception):
+    """Raised when a request is rejected instead of queued (maps to HTTP 429)"""
+
+    def __init__(self, message: str, retry_after: int = 2):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class RequestCancelled(Exception):
+    """Raised when the caller cancelled while still waiting in the queue"""
+
+class Ticket:
+    """One request waiting for, or holding, an upstream slot"""
+
+    def __init__(self, seq: int, session: str, priority: int, est_tokens: int):
+        self.seq = seq
+        self.session = session
+        self.priority = priority
+        self.est_tokens = max(1, est_tokens)
+        self.enqueued_at = time.time()
+        self.granted = False
+
+class RequestScheduler:
+    """Hands out a fixed number of upstream slots to queued requests"""
+
+    def __init__(self, max_concurrent: int = 4, max_queue: int = 32, max_per_session: int = 4,
+                 queue_timeout: float = 60.0, aging_seconds: float = 10.0):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_per_session = max_per_session
+        self.queue_timeout = queue_timeout
+        self.aging_seconds = aging_seconds  # Waiting this long raises a request one priority class
+        self.cond = threading.Condition()
+        self.waiting = []
+        self.active = 0
+        self.counter = itertools.count()
+        # Fair queuing: each session's virtual time grows with the tokens it was granted
+        self.virtual_time: Dict[str, float] = {}
+        self.global_virtual_time = 0.0
+        # Statistics
+        self.granted_total = 0
+        self.rejected_total = 0
+        self.timed_out_total = 0
+        self.max_depth_seen = 0
+        self.recent_waits = deque(maxlen=1000)
+
+    def _sort_key(self, ticket: Ticket, now: float):
+        aged_priority = ticket.priority - int((now - ticket.enqueued_at) / self.aging_seconds)
+        session_time = max(self.virtual_time.get(ticket.session, 0.0), self.global_virtual_time)
+        return (aged_priority, session_time, ticket.est_tokens, ticket.seq)
+
+    def _grant(self, ticket: Ticket):
+        ticket.granted = True
+        self.active += 1
+        self.granted_total += 1
+        self.recent_waits.append(time.time() - ticket.enqueued_at)
+        start = max(self.virtual_time.get(ticket.session, 0.0), self.global_virtual_time)
+        self.global_virtual_time = start
+        self.virtual_time[ticket.session] = start + ticket.est_tokens
+        if len(self.virtual_time) > 10000:
+            # Sessions that fell behind are equivalent to new ones - forget them
+            self.virtual_time = {s: v for s, v in self.virtual_time.items() if v > self.global_virtual_time}
+
+    def _dispatch(self):
+        now = time.time()
+        granted = False
+        while self.active < self.max_concurrent and self.waiting:
+            best = min(self.waiting, key=lambda t: self._sort_key(t, now))
+            self.waiting.remove(best)
+            self._grant(best)
+            granted = True
+        if granted:
+            self.cond.notify_all()
+
+    def acquire(self, session: str, priority: int, est_tokens: int,
+                cancelled: Optional[Callable[[], bool]] = None) -> Ticket:
+        """Block until a slot is free; raises QueueFull when over limits or timed out"""
+        with self.cond:
+            ticket = Ticket(next(self.counter), session, priority, est_tokens)
+            if self.active < self.max_concurrent and not self.waiting:
+                self._grant(ticket)
+                return ticket
+
+            per_session = sum(1 for t in self.waiting if t.session == session)
+            if len(self.waiting) >= self.max_queue or per_session >= self.max_per_session:
+                self.rejected_total += 1
+                raise QueueFull("Server busy - too many queued requests, try again shortly")
+
+            self.waiting.append(ticket)
+            self.max_depth_seen = max(self.max_depth_seen, len(self.waiting))
+            deadline = ticket.enqueued_at + self.queue_timeout
+            while not ticket.granted:
+                remaining = deadline - time.time()
+                if remaining <= 0 or (cancelled is not None and cancelled()):
+                    self.waiting.remove(ticket)
+                    if remaining <= 0:
+                        self.timed_out_total += 1
+                        raise QueueFull("Server busy - request waited too long in the queue")
+                    raise RequestCancelled("Request cancelled while queued")
+                # Wake periodically so aging and cancellation are noticed
+                self.cond.wait(timeout=min(remaining, 0.5))
+            return ticket
+
+    def release(self, ticket: Ticket):
+        with self.cond:
+            if ticket.granted:
+                ticket.granted = False
+                self.active -= 1
+                self._dispatch()
+
+    @contextmanager
+    def slot(self, session: str, priority: int, est_tokens: int,
+             cancelled: Optional[Callable[[], bool]] = None):
+        ticket = self.acquire(session, priority, est_tokens, cancelled)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def stats(self) -> dict:
+        """Queue depth and wait-time statistics for /metrics"""
+        with self.cond:
+            waits = sorted(self.recent_waits)
+            depth_by_priority: Dict[int, int] = {}
+            for ticket in self.waiting:
+                depth_by_priority[ticket.priority] = depth_by_priority.get(ticket.priority, 0) + 1
+
+            def pct(p):
+                return round(waits[min(len(waits) - 1, int(p / 100 * len(waits)))], 4) if waits else 0.0
+
+            return {
+                "active": self.active,
+                "max_concurrent": self.max_concurrent,
+                "queue_depth": len(self.waiting),
+                "queue_depth_by_priority": depth_by_priority,
+                "max_queue_depth_seen": self.max_depth_seen,
+                "granted": self.granted_total,
+                "rejected": self.rejected_total,
+                "timed_out": self.timed_out_total,
+                "wait_avg": round(sum(waits) / len(waits), 4) if waits else 0.0,
+                "wait_p50": pct(50),
+                "wait_p95": pct(95),
+                "wait_max": round(waits[-1], 4) if waits else 0.0,
+            }
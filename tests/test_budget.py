@@ -0,0 +1,127 @@
+# test_budget.py - BudgetManager holds, shrinking, rejection and settlement
+#
+# Prices are round numbers so every worst case can be checked exactly:
+# 100 prompt tokens hold 0.11 (with the 10% safety margin) and each reply
+# token 0.002 on "small", 0.01 on "large". The pooled test forks workers
+# that share one budget through worker_pool.SharedCounters
+
+import argparse
+import os
+
+import pytest
+
+from budget import BudgetExceeded, BudgetManager
+from worker_pool import SharedCounters
+
+PRICING = {
+    "small": {"input_per_1k": 1.0, "output_per_1k": 2.0},
+    "large": {"input_per_1k": 1.0, "output_per_1k": 10.0},
+}
+
+def usage(budgets: BudgetManager, scope: str = "global", session: str = None) -> tuple:
+    info = budgets.snapshot(session)[scope]
+    return info["spent"], info["reserved"]
+
+def test_reserve_holds_the_worst_case():
+    budgets = BudgetManager(PRICING, global_limit=1.0)
+    hold = budgets.reserve("small", None, 100, 100)
+    assert (hold.max_tokens, hold.shrunk) == (100, False)
+    assert hold.cost == pytest.approx(0.31)
+    assert usage(budgets) == (0.0, pytest.approx(0.31))
+
+def test_reserve_shrinks_max_tokens_to_what_is_left():
+    budgets = BudgetManager(PRICING, global_limit=0.201)
+    hold = budgets.reserve("small", None, 100, 100)
+    assert (hold.max_tokens, hold.shrunk) == (45, True)  # (0.201 - 0.11) / 0.002
+    assert budgets.shrunk == 1
+
+def test_reserve_rejects_when_a_short_reply_does_not_fit():
+    budgets = BudgetManager(PRICING, global_limit=0.12)
+    with pytest.raises(BudgetExceeded) as raised:
+        budgets.reserve("small", None, 100, 100)
+    assert raised.value.scope == "global"
+    assert budgets.rejected == 1
+    assert usage(budgets) == (0.0, 0.0)
+
+def test_holds_count_against_later_requests():
+    budgets = BudgetManager(PRICING, global_limit=0.501)
+    budgets.reserve("small", None, 100, 100)
+    assert budgets.reserve("small", None, 100, 100).max_tokens == 40  # (0.501 - 0.31 - 0.11) / 0.002
+    with pytest.raises(BudgetExceeded):
+        budgets.reserve("small", None, 100, 100)
+
+def test_settle_replaces_the_hold_with_the_real_cost():
+    budgets = BudgetManager(PRICING, global_limit=1.0)
+    hold = budgets.reserve("small", None, 100, 100)
+    budgets.settle(hold, 0.05)
+    assert usage(budgets) == (pytest.approx(0.05), 0.0)
+    budgets.settle(hold, 0.05)
+    budgets.release(hold)  # Both no-ops once settled
+    assert usage(budgets) == (pytest.approx(0.05), 0.0)
+
+def test_release_drops_the_hold():
+    budgets = BudgetManager(PRICING, global_limit=1.0)
+    budgets.release(budgets.reserve("small", None, 100, 100))
+    assert usage(budgets) == (0.0, 0.0)
+
+def test_extend_grows_the_hold_for_a_pricier_model():
+    budgets = BudgetManager(PRICING, global_limit=2.0)
+    hold = budgets.reserve("small", None, 100, 100)
+    budgets.extend(hold, "large")
+    assert (hold.model, hold.cost) == ("large", pytest.approx(1.11))
+    assert usage(budgets) == (0.0, pytest.approx(1.11))
+    budgets.extend(hold, "small")  # A cheaper model keeps the larger hold
+    assert hold.cost == pytest.approx(1.11)
+    budgets.settle(hold, 0.2)
+    assert usage(budgets) == (pytest.approx(0.2), 0.0)
+
+def test_extend_refuses_a_model_the_budget_cannot_cover():
+    budgets = BudgetManager(PRICING, global_limit=1.0)
+    hold = budgets.reserve("small", None, 100, 100)
+    with pytest.raises(BudgetExceeded):
+        budgets.extend(hold, "large")
+    assert (hold.model, hold.cost) == ("small", pytest.approx(0.31))
+    assert usage(budgets) == (0.0, pytest.approx(0.31))
+
+def test_session_budgets_are_separate():
+    budgets = BudgetManager(PRICING, session_limit=0.4)
+    budgets.settle(budgets.reserve("small", "a", 100, 100), 0.3)
+    with pytest.raises(BudgetExceeded) as raised:
+        budgets.reserve("small", "a", 100, 100)
+    assert raised.value.scope == "session"
+    assert budgets.reserve("small", "b", 100, 100).max_tokens == 100
+
+def test_workers_cannot_jointly_overshoot_a_pooled_budget():
+    counters = SharedCounters(slots=4)
+    try:
+        pids = []
+        for worker in range(1, 4):
+            slot = counters.claim(worker)
+            pid = os.fork()
+            if pid == 0:
+                code = 1
+                try:
+                    counters.attach(slot)
+                    budgets = BudgetManager(PRICING)
+                    budgets.configure(argparse.Namespace(session_budget=None, daily_budget=1.0, budget=1.0),
+                                      counters=counters, seed=False)
+                    while True:
+                        try:
+                            hold = budgets.reserve("small", None, 100, 100)
+                        except BudgetExceeded:
+                            break
+                        budgets.settle(hold, hold.cost)
+                    code = 0
+                finally:
+                    os._exit(code)
+            pids.append(pid)
+        for pid in pids:
+            _, status = os.waitpid(pid, 0)
+            assert os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0
+        budgets = BudgetManager(PRICING, global_limit=1.0)
+        budgets.counters = counters
+        spent, reserved = usage(budgets)
+        assert 0.9 < spent <= 1.0 + 1e-9
+        assert reserved == 0.0
+    finally:
+        counters.close()
@@ -0,0 +1,52 @@
+# test_conversation_store.py - Conversation._repair after interrupted writes
+#
+# Each test saves a conversation, damages its segment or index the way a
+# crash between (or during) the two appends would, and reopens it
+
+import os
+
+import pytest
+
+from conversation_store import ENTRY, ConversationStore
+
+@pytest.fixture
+def saved(tmp_path):
+    """(root, id, segment path, index path) of a closed conversation with two messages"""
+    store = ConversationStore(str(tmp_path))
+    conversation = store.create(title="repair")
+    conversation.append("user", "hello")
+    conversation.append("assistant", "hi there", model="m")
+    store.close()
+    return str(tmp_path), conversation.id, conversation.segment_path, conversation.index_path
+
+def reopen(root: str, conversation_id: str):
+    return ConversationStore(root).open(conversation_id, create=False)
+
+def test_torn_append_is_cut_off(saved):
+    root, conversation_id, segment_path, index_path = saved
+    size = os.path.getsize(segment_path)
+    with open(segment_path, "ab") as f:
+        f.write(b'{"role": "user", "cont')  # Killed mid-write, no index entry
+    conversation = reopen(root, conversation_id)
+    assert len(conversation) == 2
+    assert os.path.getsize(segment_path) == size
+    assert conversation.append("user", "again") == 3
+    assert [m["content"] for m in conversation.tail()] == ["hello", "hi there", "again"]
+
+def test_message_missing_from_the_index_is_indexed(saved):
+    root, conversation_id, segment_path, index_path = saved
+    with open(segment_path, "ab") as f:
+        f.write(b'{"role": "user", "content": "unindexed", "time": 1.0}\n')  # Killed before the index write
+    conversation = reopen(root, conversation_id)
+    assert len(conversation) == 3
+    assert conversation.page(after=2)[0]["content"] == "unindexed"
+
+def test_index_entry_past_the_segment_is_dropped(saved):
+    root, conversation_id, segment_path, index_path = saved
+    with open(index_path, "ab") as f:
+        f.write(ENTRY.pack(os.path.getsize(segment_path), 40, 10))  # Points at a message that was never written
+        f.write(ENTRY.pack(0, 1, 1)[:5])  # And half an entry after it
+    conversation = reopen(root, conversation_id)
+    assert len(conversation) == 2
+    assert os.path.getsize(index_path) == 2 * ENTRY.size
+    assert [m["content"] for m in conversation.tail()] == ["hello", "hi there"]
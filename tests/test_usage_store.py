@@ -0,0 +1,62 @@
+# test_usage_store.py - UsageStore.import_log de-duplication
+#
+# Records CostTracker already wrote live must not be counted twice, records
+# from processes without a store must be imported, and importing the same
+# log again (or from the start, after the resume offset is lost) is a no-op
+
+import datetime
+import json
+import time
+
+import pytest
+
+import usage_store
+from usage_store import UsageStore
+
+def entry(number: int, ts: float) -> dict:
+    return {"timestamp": datetime.datetime.fromtimestamp(ts).isoformat(), "model": "m", "session": "s",
+            "prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15, "cost_usd": number / 100}
+
+@pytest.fixture
+def store(tmp_path):
+    store = UsageStore(str(tmp_path / "usage.db"))
+    yield store
+    store.close()
+
+@pytest.fixture
+def log(tmp_path, store):
+    """A log of 30 settled records, every other one also written live to the store"""
+    path = tmp_path / "chat_costs.log"
+    start = time.time() - 3600
+    with open(path, "w") as f:
+        for number in range(1, 31):
+            record = entry(number, start + number * 60)
+            if number % 2 == 0:
+                store.add(record)
+            f.write(json.dumps(record) + "\n")
+    store.flush()
+    return str(path)
+
+def counts(store: UsageStore) -> tuple:
+    rows = store.conn.execute("SELECT COUNT(*), SUM(cost_usd) FROM usage").fetchone()
+    daily = store.conn.execute("SELECT SUM(messages), SUM(cost_usd) FROM daily").fetchone()
+    return rows[0], round(rows[1], 6), daily[0], round(daily[1], 6)
+
+def test_import_skips_only_records_written_live(store, log):
+    assert store.import_log(log) == 15
+    assert counts(store) == (30, 4.65, 30, 4.65)
+
+def test_reimport_is_a_no_op(store, log):
+    store.import_log(log)
+    assert store.import_log(log) == 0
+    store.conn.execute("DELETE FROM meta WHERE key LIKE 'import:%'")  # Resume offset lost - reads from the start
+    assert store.import_log(log) == 0
+    assert counts(store) == (30, 4.65, 30, 4.65)
+
+def test_recent_records_wait_for_the_next_import(store, log, monkeypatch):
+    with open(log, "a") as f:
+        f.write(json.dumps(entry(100, time.time())) + "\n")  # Its writer may not have committed it yet
+    assert store.import_log(log) == 15
+    monkeypatch.setattr(usage_store, "SETTLE", 0.0)
+    assert store.import_log(log) == 1
+    assert counts(store)[0] == 31
@@ -0,0 +1,81 @@
+# test_worker_pool.py - SharedCounters across forked workers
+#
+# Covers per-slot counting, budget spend and holds summed across processes,
+# folding an exited worker into the retired slot, and recovering a slot
+# whose writer was killed mid-update
+
+import datetime
+import os
+import struct
+
+import pytest
+
+from worker_pool import FREE, RETIRED, SharedCounters
+
+TODAY = datetime.date.today().toordinal()
+
+@pytest.fixture
+def counters():
+    counters = SharedCounters(slots=4)
+    yield counters
+    counters.close()
+
+def run_worker(counters: SharedCounters, slot: int, work):
+    """Fork a worker that attaches to `slot`, runs work(counters) and exits; fails the test if it did"""
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            counters.attach(slot)
+            work(counters)
+            code = 0
+        finally:
+            os._exit(code)
+    _, status = os.waitpid(pid, 0)
+    assert os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0
+
+def test_totals_sum_every_worker(counters):
+    first, second = counters.claim(1), counters.claim(2)
+    assert first != second
+    run_worker(counters, first, lambda c: (c.add(0.5, 100), c.add(0.25, 50, messages=2)))
+    run_worker(counters, second, lambda c: c.add(1.0, 10))
+    assert counters.totals() == {"cost": 1.75, "tokens": 160, "messages": 4}
+    assert [w["messages"] for w in counters.workers()] == [3, 1]
+
+def test_retire_keeps_counts_and_spend_but_drops_holds(counters):
+    slot = counters.claim(1)
+    run_worker(counters, slot, lambda c: (c.add(0.75, 150, messages=3),
+                                          c.add_budget(TODAY, spent=0.75, reserved=0.1)))
+    assert counters.budget_totals(TODAY) == {"spent": 0.75, "day_spent": 0.75, "reserved": 0.1}
+    counters.retire(slot)
+    assert counters.totals() == {"cost": 0.75, "tokens": 150, "messages": 3}
+    assert counters.budget_totals(TODAY) == {"spent": 0.75, "day_spent": 0.75, "reserved": 0.0}
+    assert counters._read_slot(slot)["state"] == FREE
+    assert counters.claim(2) == slot  # Freed for a replacement
+
+def test_retire_counts_day_spend_toward_the_right_day(counters):
+    counters.seed_day(TODAY - 1, 2.0)  # Spend from yesterday's log
+    slot = counters.claim(1)
+    run_worker(counters, slot, lambda c: c.add_budget(TODAY, spent=0.5))
+    counters.retire(slot)
+    assert counters.budget_totals(TODAY)["day_spent"] == 0.5
+    assert counters.budget_totals(TODAY - 1)["day_spent"] == 0.0
+    slot = counters.claim(2)
+    run_worker(counters, slot, lambda c: c.add_budget(TODAY, spent=0.25))
+    counters.retire(slot)
+    assert counters.budget_totals(TODAY)["day_spent"] == 0.75
+
+def test_slot_left_odd_by_a_killed_writer(counters):
+    slot = counters.claim(1)
+    run_worker(counters, slot, lambda c: c.add(0.5, 10))
+    # A SIGKILL between the two sequence writes leaves the slot odd for good
+    offset = counters._offset(slot)
+    sequence = struct.unpack_from("<Q", counters.shm.buf, offset)[0]
+    struct.pack_into("<Q", counters.shm.buf, offset, sequence + 1)
+    assert counters.totals()["cost"] == 0.5  # Readers give up retrying instead of hanging
+    counters.retire(slot)
+    assert counters.totals() == {"cost": 0.5, "tokens": 10, "messages": 1}
+    assert struct.unpack_from("<Q", counters.shm.buf, counters._offset(RETIRED))[0] % 2 == 0
+    slot = counters.claim(2)
+    run_worker(counters, slot, lambda c: c.add(0.25, 5))
+    assert counters.totals()["cost"] == 0.75
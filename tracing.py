@@ -0,0 +1,435 @@
+# tracing.py - Local Request Tracing with OTLP-JSON Span Export
+#
+# A trace is one request: a root span (POST /chat, a WebSocket reply, a
+# terminal chat message) with child spans for every PhaseTimer phase -
+# parse, queue, upstream, connect, cost, encode, write, log - plus one span
+# per model attempt and one per HTTP request the OpenAI SDK sends, so
+# retries and failover show up as separate spans. Each HTTP request carries
+# a W3C traceparent header so the goop proxy can join the trace. Finished
+# traces are written one per line as OTLP/JSON (what an OpenTelemetry
+# collector's file exporter writes and otlpjsonfile reads) to a size-rotated
+# local file; no collector is needed. Traces are kept at --trace-sample,
+# and slow (--trace-slow) or failed ones are always kept, so the requests
+# worth explaining are never sampled away. With tracing off every call is a
+# no-op on a shared null span
+# Used by: web_chat.py, chat_with_costs.py, phase_timer.py, connection_warmer.py, model_compare.py
+# Dependencies: none (standard library only)
+# Usage: python tracing.py traces.jsonl [--slowest 10 | --trace-id ID | --errors]
+
+import argparse
+import contextvars
+import glob
+import json
+import os
+import random
+import re
+import threading
+import time
+from typing import Dict, List, Optional
+
+SERVICE_NAME = "goop-utilities"
+TRACE_SAMPLE = 1.0              # Fraction of traces kept when nothing else says to keep them
+TRACE_MAX_BYTES = 10 * 1024 * 1024
+TRACE_BACKUPS = 5               # Rotated files kept (FILE.1 ... FILE.5)
+MAX_SPANS = 256                 # Spans kept per trace; more are counted, not stored
+TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+# OTLP enum values
+KIND_INTERNAL, KIND_SERVER, KIND_CLIENT = 1, 2, 3
+STATUS_UNSET, STATUS_OK, STATUS_ERROR = 0, 1, 2
+
+_current: contextvars.ContextVar = contextvars.ContextVar("goop_span", default=None)
+
+def _attribute_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    if isinstance(value, (list, tuple)):
+        return {"arrayValue": {"values": [_attribute_value(v) for v in value]}}
+    return {"stringValue": str(value)}
+
+def _attributes(attributes: dict) -> List[dict]:
+    return [{"key": key, "value": _attribute_value(value)} for key, value in attributes.items() if value is not None]
+
+class _NullSpan:
+    """Stands in for a span when tracing is off or no trace is active"""
+    trace_id = None
+    span_id = None
+
+    def set(self, attributes: Optional[dict] = None, **more):
+        return self
+
+    def event(self, name: str, **attributes):
+        pass
+
+    def fail(self, error):
+        pass
+
+    def end(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_SPAN = _NullSpan()
+
+class _Trace:
+    """Spans of one trace, collected until its root span ends"""
+    __slots__ = ("trace_id", "sampled", "spans", "dropped", "error", "lock")
+
+    def __init__(self, trace_id: str, sampled: bool):
+        self.trace_id = trace_id
+        self.sampled = sampled
+        self.spans: List["Span"] = []
+        self.dropped = 0
+        self.error = False
+        self.lock = threading.Lock()
+
+class Span:
+    """One timed operation; the current span while entered (or until end())"""
+    __slots__ = ("tracer", "trace", "name", "kind", "span_id", "parent_id", "start_ns", "end_ns",
+                 "attributes", "events", "status", "message", "token", "root")
+
+    def __init__(self, tracer, trace: _Trace, name: str, kind: int, parent_id: Optional[str],
+                 attributes: dict, root: bool = False, current: bool = True):
+        self.tracer = tracer
+        self.trace = trace
+        self.name = name
+        self.kind = kind
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes
+        self.events = []
+        self.status = STATUS_UNSET
+        self.message = None
+        self.root = root
+        with trace.lock:
+            if len(trace.spans) < MAX_SPANS:
+                trace.spans.append(self)
+            else:
+                trace.dropped += 1
+        self.token = _current.set(self) if current else None
+
+    @property
+    def trace_id(self) -> str:
+        return self.trace.trace_id
+
+    def traceparent(self) -> str:
+        """W3C traceparent header value naming this span as the parent"""
+        return f"00-{self.trace.trace_id}-{self.span_id}-{'01' if self.trace.sampled else '00'}"
+
+    def set(self, attributes: Optional[dict] = None, **more):
+        """Add attributes (dotted names go in the dict, plain ones as keywords)"""
+        if attributes:
+            self.attributes.update(attributes)
+        self.attributes.update(more)
+        return self
+
+    def event(self, name: str, **attributes):
+        self.events.append((time.time_ns(), name, attributes))
+
+    def fail(self, error):
+        """Mark the span (and so the whole trace, which is then always kept) as failed"""
+        self.status = STATUS_ERROR
+        self.message = str(error)[:200]
+        if isinstance(error, BaseException):
+            self.event("exception", **{"exception.type": type(error).__name__, "exception.message": self.message})
+        self.trace.error = True
+
+    def end(self):
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if self.token is not None:
+            try:
+                _current.reset(self.token)
+            except ValueError:
+                _current.set(None)  # Ended from another context - nothing to restore there
+            self.token = None
+        if self.root:
+            self.tracer._finish(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None and not isinstance(exc, (GeneratorExit, KeyboardInterrupt)):
+            self.fail(exc)
+        self.end()
+        return False
+
+    def to_otlp(self, end_ns: int) -> dict:
+        span = {"traceId": self.trace.trace_id, "spanId": self.span_id, "name": self.name, "kind": self.kind,
+                "startTimeUnixNano": str(self.start_ns), "endTimeUnixNano": str(self.end_ns or end_ns),
+                "attributes": _attributes(self.attributes if self.end_ns else dict(self.attributes, incomplete=True))}
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        if self.events:
+            span["events"] = [{"timeUnixNano": str(t), "name": name, "attributes": _attributes(attrs)}
+                              for t, name, attrs in self.events]
+        if self.status != STATUS_UNSET:
+            span["status"] = {"code": self.status}
+            if self.message:
+                span["status"]["message"] = self.message
+        return span
+
+class RotatingSpanFile:
+    """Appends one line per trace, rolling FILE over to FILE.1 ... FILE.N at max_bytes"""
+
+    def __init__(self, path: str, max_bytes: int = TRACE_MAX_BYTES, backups: int = TRACE_BACKUPS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(path, "ab")
+
+    def write(self, line: bytes):
+        with self.lock:
+            if self.file.tell() + len(line) > self.max_bytes and self.file.tell() > 0:
+                self._rotate()
+            self.file.write(line)
+            self.file.flush()
+
+    def _rotate(self):
+        self.file.close()
+        for n in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{n}"):
+                os.replace(f"{self.path}.{n}", f"{self.path}.{n + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self.file = open(self.path, "ab")
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+class Tracer:
+    """Starts traces and spans, decides which traces to keep and exports them"""
+
+    def __init__(self):
+        self.output: Optional[RotatingSpanFile] = None
+        self.sample = TRACE_SAMPLE
+        self.slow_ms: Optional[float] = None
+        self.resource = _attributes({"service.name": SERVICE_NAME})
+        self.started = 0
+        self.exported = 0
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.output is not None
+
+    def open(self, path: str, service: str = SERVICE_NAME, sample: float = TRACE_SAMPLE,
+             slow_ms: Optional[float] = None, max_bytes: int = TRACE_MAX_BYTES, backups: int = TRACE_BACKUPS):
+        """Start exporting traces of this process to `path`"""
+        self.sample = sample
+        self.slow_ms = slow_ms
+        self.resource = _attributes({"service.name": service, "process.pid": os.getpid()})
+        self.output = RotatingSpanFile(path, max_bytes, backups)
+
+    def configure(self, args, service: str, path: Optional[str] = None):
+        """Take settings from add_trace_args() options (path overrides --trace, e.g. per worker)"""
+        path = path or args.trace
+        if path:
+            self.open(path, service, args.trace_sample, args.trace_slow)
+
+    def close(self):
+        output, self.output = self.output, None
+        if output is not None:
+            output.close()
+
+    def trace(self, name: str, traceparent: Optional[str] = None, kind: int = KIND_SERVER,
+              attributes: Optional[dict] = None):
+        """Root span of a new trace, or a local root joining the caller's trace from a traceparent header"""
+        if self.output is None:
+            return NULL_SPAN
+        parent_id = None
+        match = TRACEPARENT.match(traceparent.strip().lower()) if traceparent else None
+        if match and match.group(1) != "0" * 32:
+            trace_id, parent_id = match.group(1), match.group(2)
+            sampled = int(match.group(3), 16) & 1 == 1 or random.random() < self.sample
+        else:
+            trace_id = os.urandom(16).hex()
+            sampled = random.random() < self.sample
+        with self.lock:
+            self.started += 1
+        return Span(self, _Trace(trace_id, sampled), name, kind, parent_id, dict(attributes or {}), root=True)
+
+    def span(self, name: str, kind: int = KIND_INTERNAL, attributes: Optional[dict] = None):
+        """Child of the current span; a null span outside a trace"""
+        parent = _current.get()
+        if parent is None:
+            return NULL_SPAN
+        return Span(self, parent.trace, name, kind, parent.span_id, dict(attributes or {}))
+
+    # HTTP client hooks (see connection_warmer.ConnectionWarmer.http_client)
+
+    def on_request(self, request):
+        """Open a client span for one HTTP attempt and send its traceparent upstream"""
+        parent = _current.get()
+        if parent is None:
+            return
+        attributes = {"http.request.method": request.method, "url.full": str(request.url)}
+        retry = request.headers.get("x-stainless-retry-count")
+        if retry and retry != "0":
+            attributes["http.request.resend_count"] = int(retry)
+        span = Span(self, parent.trace, f"{request.method} {request.url.path}", KIND_CLIENT, parent.span_id,
+                    attributes, current=False)
+        request.headers["traceparent"] = span.traceparent()
+        request.extensions["goop_span"] = span
+
+    def on_response(self, response):
+        span = response.request.extensions.get("goop_span")
+        if not isinstance(span, Span):
+            return
+        span.set({"http.response.status_code": response.status_code})
+        if response.status_code >= 500:
+            span.fail(f"HTTP {response.status_code}")
+        span.end()  # At response headers - a streamed body is timed by the caller's own span
+
+    # Export
+
+    def _finish(self, root: Span):
+        trace = root.trace
+        duration_ms = (root.end_ns - root.start_ns) / 1e6
+        slow = self.slow_ms is not None and duration_ms >= self.slow_ms
+        output = self.output
+        if output is None or not (trace.sampled or trace.error or slow):
+            return
+        with trace.lock:
+            spans = [span.to_otlp(root.end_ns) for span in trace.spans]
+            dropped = trace.dropped
+        if dropped:
+            spans[0]["attributes"] += _attributes({"spans_dropped": dropped})
+        record = {"resourceSpans": [{"resource": {"attributes": self.resource},
+                                     "scopeSpans": [{"scope": {"name": "goop.tracing"}, "spans": spans}]}]}
+        try:
+            output.write((json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8"))
+        except (OSError, ValueError) as e:
+            print(f"Could not write trace: {e}")
+            return
+        with self.lock:
+            self.exported += 1
+
+    def snapshot(self) -> dict:
+        """Traces started and written, for /metrics"""
+        with self.lock:
+            return {"enabled": self.enabled, "started": self.started, "exported": self.exported,
+                    "sample": self.sample, "slow_ms": self.slow_ms,
+                    "file": self.output.path if self.output else None}
+
+def current_span():
+    """The span active in this thread or task (a null span if none)"""
+    return _current.get() or NULL_SPAN
+
+# Shared by every request in this process
+tracer = Tracer()
+
+def add_trace_args(parser):
+    """--trace, --trace-sample and --trace-slow for a tool's argument parser"""
+    parser.add_argument("--trace", metavar="FILE",
+                        help=f"write request traces (OTLP/JSON lines) to FILE, rotated at "
+                             f"{TRACE_MAX_BYTES // (1024 * 1024)}MB; read them with tracing.py")
+    parser.add_argument("--trace-sample", type=float, default=TRACE_SAMPLE, metavar="RATE",
+                        help=f"fraction of traces to keep (default {TRACE_SAMPLE:g}); failed and slow ones always are")
+    parser.add_argument("--trace-slow", type=float, metavar="MS",
+                        help="always keep traces that took at least this many milliseconds")
+
+# Reading exported traces
+
+def load_traces(path: str) -> List[List[dict]]:
+    """Every trace in FILE and its rotated copies, as lists of OTLP span dicts"""
+    traces: Dict[str, List[dict]] = {}
+    rotated = []
+    for name in glob.glob(glob.escape(path) + ".*"):
+        suffix = name[len(path) + 1:]
+        if suffix.isdigit():
+            rotated.append((int(suffix), name))
+    for name in [name for _, name in sorted(rotated, reverse=True)] + [path]:  # Oldest first
+        if not os.path.exists(name):
+            continue
+        with open(name, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # Torn last line of a file being written
+                for resource in record.get("resourceSpans", []):
+                    for scope in resource.get("scopeSpans", []):
+                        for span in scope.get("spans", []):
+                            traces.setdefault(span["traceId"], []).append(span)
+    return list(traces.values())
+
+def _duration_ms(span: dict) -> float:
+    return (int(span["endTimeUnixNano"]) - int(span["startTimeUnixNano"])) / 1e6
+
+def _root_ms(spans: List[dict]) -> float:
+    ids = {span["spanId"] for span in spans}
+    return max(_duration_ms(span) for span in spans if span.get("parentSpanId") not in ids)
+
+def _plain_value(value: dict):
+    if "arrayValue" in value:
+        return [_plain_value(v) for v in value["arrayValue"].get("values", [])]
+    return next(iter(value.values()), None)
+
+def _plain(attributes: List[dict]) -> dict:
+    return {a["key"]: _plain_value(a["value"]) for a in attributes}
+
+def format_trace(spans: List[dict]) -> str:
+    """Indented span tree with offsets and durations, children in start order"""
+    ids = {span["spanId"] for span in spans}
+    children: Dict[Optional[str], List[dict]] = {}
+    for span in spans:
+        parent = span.get("parentSpanId")
+        children.setdefault(parent if parent in ids else None, []).append(span)
+    start = min(int(span["startTimeUnixNano"]) for span in spans)
+    lines = [f"trace {spans[0]['traceId']}"]
+
+    def walk(parent, depth):
+        for span in sorted(children.get(parent, []), key=lambda s: int(s["startTimeUnixNano"])):
+            offset = (int(span["startTimeUnixNano"]) - start) / 1e6
+            attributes = _plain(span.get("attributes", []))
+            detail = " ".join(f"{k}={v}" for k, v in attributes.items()
+                              if k.startswith(("gen_ai.", "http.", "goop.", "incomplete")))
+            status = " ERROR " + span["status"].get("message", "") if span.get("status", {}).get("code") == 2 else ""
+            lines.append(f"  {offset:>9.1f}ms {_duration_ms(span):>9.1f}ms  {'  ' * depth}{span['name']}"
+                         f"{status}{'  ' + detail if detail else ''}")
+            walk(span["spanId"], depth + 1)
+
+    walk(None, 0)
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Show traces written with --trace")
+    parser.add_argument("file", help="trace file (rotated copies FILE.1, FILE.2, ... are read too)")
+    parser.add_argument("--slowest", type=int, default=10, metavar="N", help="show the N slowest traces (default 10)")
+    parser.add_argument("--trace-id", help="show one trace")
+    parser.add_argument("--errors", action="store_true", help="show only traces with a failed span")
+    args = parser.parse_args()
+
+    traces = load_traces(args.file)
+    if args.trace_id:
+        traces = [t for t in traces if t[0]["traceId"] == args.trace_id.lower()]
+    if args.errors:
+        traces = [t for t in traces if any(s.get("status", {}).get("code") == 2 for s in t)]
+    traces.sort(key=_root_ms, reverse=True)
+    print(f"{len(traces)} traces")
+    for spans in traces[:args.slowest]:
+        print()
+        print(format_trace(spans))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+# traffic_capture.py - Sanitized Request Traces for Replay
+#
+# Records one compact JSON line per chat request (timing, model, sizes,
+# tokens, cost - never message text) so a production load pattern can be
+# replayed later with benchmarks/replay_traffic.py
+# Paths ending in .gz are gzip-compressed. Session ids and client addresses
+# are replaced by an HMAC under a random per-install key (anonymize.key,
+# next to chat_costs.log), so they can't be recovered by hashing guesses
+# Dependencies: none (standard library only)
+
+import datetime
+import gzip
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+from typing import List, Optional, Tuple
+
+CAPTURE_VERSION = 1
+KEY_FILE = "anonymize.key"
+
+_key: Optional[bytes] = None
+_key_lock = threading.Lock()
+
+def _open(path: str, mode: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+class TrafficRecorder:
+    """Appends request traces to a capture file; safe to call from handler threads"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.count = 0
+        self.file = _open(path, "w")
+        self._write({"capture": CAPTURE_VERSION,
+                     "started": datetime.datetime.fromtimestamp(self.started).isoformat()})
+
+    def _write(self, data: dict):
+        self.file.write(json.dumps(data, separators=(",", ":")) + "\n")
+
+    def record(self, started: float, **fields):
+        """Add one trace; `started` is the request's time.time() arrival"""
+        fields["t"] = round(started - self.started, 4)
+        with self.lock:
+            if self.file is None:
+                return
+            self._write(fields)
+            self.count += 1
+            if self.count % 50 == 0:
+                self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+def load_key(path: str = KEY_FILE) -> bytes:
+    """Use this install's anonymization key from `path`, creating a random one on first use
+
+    Safe to race: every process ends up with whichever key was linked into place first.
+    """
+    global _key
+    with _key_lock:
+        try:
+            with open(path, "rb") as f:
+                key = f.read()
+        except FileNotFoundError:
+            key = b""
+        if not key:
+            key = os.urandom(32)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with os.fdopen(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "wb") as f:
+                f.write(key)
+            try:
+                os.link(tmp, path)
+            except FileExistsError:
+                with open(path, "rb") as f:
+                    existing = f.read()
+                if existing:
+                    key = existing
+                else:
+                    os.replace(tmp, path)  # Left empty by an interrupted run
+            finally:
+                if os.path.exists(tmp):
+                    os.unlink(tmp)
+        _key = key
+        return key
+
+def anonymize(key: str) -> str:
+    """Stable short stand-in for a session id or client address (keyed, so not reversible by brute force)"""
+    secret = _key if _key is not None else load_key()
+    return hmac.new(secret, key.encode("utf-8"), hashlib.sha256).hexdigest()[:8]
+
+# Active recorder for this process, set by the --capture flag
+recorder: Optional[TrafficRecorder] = None
+
+def start_capture(path: str) -> TrafficRecorder:
+    global recorder
+    recorder = TrafficRecorder(path)
+    return recorder
+
+def stop_capture():
+    global recorder
+    if recorder is not None:
+        recorder.close()
+        print(f"Captured {recorder.count} requests to {recorder.path}")
+        recorder = None
+
+def capture(started: float, **fields):
+    """Record a request trace if capture is on (no-op otherwise)"""
+    if recorder is not None:
+        recorder.record(started, **fields)
+
+def load_capture(path: str) -> Tuple[dict, List[dict]]:
+    """Header and traces (sorted by arrival time) from a capture file"""
+    header = {}
+    records = []
+    with _open(path, "r") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                data = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # Truncated last line from a crashed run
+            if "capture" in data:
+                header = data
+            else:
+                records.append(data)
+    records.sort(key=lambda r: r["t"])
+    return header, records
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def summarize(records: List[dict], speed: float = 1.0) -> dict:
+    """Throughput, latency percentiles and cost totals for a set of traces"""
+    ok = [r for r in records if r.get("status") == "ok"]
+    rejected = sum(1 for r in records if r.get("status") == "rejected")
+    latencies = [r["latency_ms"] for r in ok if r.get("latency_ms") is not None]
+    if records:
+        start = min(r["t"] for r in records) / speed
+        end = max(r["t"] / speed + (r.get("latency_ms") or 0) / 1000 for r in records)
+        span = max(end - start, 1e-9)
+    else:
+        span = 0.0
+    return {
+        "requests": len(records),
+        "ok": len(ok),
+        "rejected": rejected,
+        "errors": len(records) - len(ok) - rejected,
+        "duration_s": round(span, 3),
+        "requests_per_sec": round(len(ok) / span, 3) if span else 0.0,
+        "latency_p50_ms": round(percentile(latencies, 50), 3),
+        "latency_p95_ms": round(percentile(latencies, 95), 3),
+        "latency_p99_ms": round(percentile(latencies, 99), 3),
+        "prompt_tokens": sum(r.get("prompt_tokens", 0) for r in ok),
+        "completion_tokens": sum(r.get("completion_tokens", 0) for r in ok),
+        "cost_usd": round(sum(r.get("cost", 0.0) for r in ok), 9),
+    }
@@ -0,0 +1,80 @@
+# transcript_store.py - Bounded Per-Session Chat Transcripts
+#
+# Keeps recent messages for each web_chat session in memory so the page can
+# drop old messages from the DOM and lazily reload them from /history.
+# Given a ConversationStore (web_chat.py --conversations) messages are kept
+# on disk instead, so history survives restarts and every worker process
+# sees the same transcript
+# Dependencies: none (standard library only)
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Optional
+
+from conversation_store import ConversationStore
+
+def conversation_id(session: str) -> str:
+    """Saved conversation id for a page session (hashed - session ids come from the browser)"""
+    return "web-" + hashlib.sha1(session.encode("utf-8")).hexdigest()[:20]
+
+class TranscriptStore:
+    """Recent messages per session, oldest sessions evicted first (or all of them, on disk)"""
+
+    def __init__(self, max_messages: int = 1000, max_sessions: int = 200,
+                 store: Optional[ConversationStore] = None):
+        self.max_messages = max_messages
+        self.max_sessions = max_sessions
+        self.store = store
+        self.sessions: "OrderedDict[str, deque]" = OrderedDict()
+        self.next_seq: dict = {}
+        self.lock = threading.Lock()
+
+    def append(self, session: str, role: str, text: str, model: Optional[str] = None) -> int:
+        """Record a message and return its sequence number within the session"""
+        if self.store is not None:
+            return self.store.open(conversation_id(session), title=text, source="web").append(role, text, model)
+        with self.lock:
+            if session not in self.sessions:
+                self.sessions[session] = deque(maxlen=self.max_messages)
+                self.next_seq[session] = 1
+                while len(self.sessions) > self.max_sessions:
+                    evicted, _ = self.sessions.popitem(last=False)
+                    del self.next_seq[evicted]
+            self.sessions.move_to_end(session)
+            seq = self.next_seq[session]
+            self.next_seq[session] += 1
+            self.sessions[session].append({
+                "seq": seq,
+                "role": role,
+                "text": text,
+                "model": model,
+                "time": time.time(),
+            })
+            return seq
+
+    def page(self, session: str, before: Optional[int] = None, after: Optional[int] = None,
+             limit: int = 50) -> dict:
+        """Up to `limit` messages before/after a sequence number (default: the newest)"""
+        if self.store is not None:
+            return self._stored_page(session, before, after, limit)
+        with self.lock:
+            messages = list(self.sessions.get(session, ()))
+        if after is not None:
+            newer = [m for m in messages if m["seq"] > after]
+            return {"messages": newer[:limit], "has_more": len(newer) > limit}
+        if before is not None:
+            messages = [m for m in messages if m["seq"] < before]
+        return {"messages": messages[-limit:], "has_more": len(messages) > limit}
+
+    def _stored_page(self, session: str, before: Optional[int], after: Optional[int], limit: int) -> dict:
+        key = conversation_id(session)
+        if not self.store.exists(key):
+            return {"messages": [], "has_more": False}
+        conversation = self.store.open(key, create=False)
+        messages = [{"seq": m["seq"], "role": m["role"], "text": m["content"], "model": m.get("model"),
+                     "time": m["time"]} for m in conversation.page(before, after, limit + 1)]
+        if after is not None:
+            return {"messages": messages[:limit], "has_more": len(messages) > limit}
+        return {"messages": messages[-limit:], "has_more": len(messages) > limit}
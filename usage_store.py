@@ -0,0 +1,463 @@
+# usage_store.py - Indexed SQLite Usage Store
+#
+# Optional embedded database for CostTracker usage records, alongside
+# chat_costs.log. Runs in WAL mode so chat_with_costs, web_chat and the
+# analysis tools can read while several processes write. Records are
+# queued and inserted in batched transactions by one writer thread per
+# process. Indexes on (timestamp, model) and session turn time-range
+# questions ("spend for model X last Tuesday") into index range scans
+# instead of a full scan of the log, and a per-day, per-model rollup
+# updated in the same transactions answers whole-day ranges without
+# touching individual records, however many years they cover
+# Dependencies: none (standard library only)
+# Usage: python usage_store.py [--db chat_costs.db] [--import chat_costs.log] [--period "last tuesday"] [--model M]
+
+import argparse
+import atexit
+import collections
+import datetime
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import List, Optional, Tuple
+
+DEFAULT_DB = "chat_costs.db"
+BATCH_SIZE = 100        # Records per insert transaction
+FLUSH_INTERVAL = 1.0    # Seconds a partial batch may wait before it is written
+BUSY_TIMEOUT = 10.0     # Seconds to wait on another process's write lock
+IMPORT_BATCH = 10000
+SETTLE = 10.0           # Seconds a logged record may still be waiting in another process's writer queue
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    model TEXT NOT NULL,
+    session TEXT,
+    prompt_tokens INTEGER NOT NULL,
+    completion_tokens INTEGER NOT NULL,
+    total_tokens INTEGER NOT NULL,
+    cost_usd REAL NOT NULL,
+    entry TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS usage_ts_model ON usage (ts, model);
+CREATE INDEX IF NOT EXISTS usage_session ON usage (session, ts);
+CREATE TABLE IF NOT EXISTS daily (
+    day TEXT NOT NULL,
+    model TEXT NOT NULL,
+    messages INTEGER NOT NULL,
+    cost_usd REAL NOT NULL,
+    total_tokens INTEGER NOT NULL,
+    prompt_tokens INTEGER NOT NULL,
+    completion_tokens INTEGER NOT NULL,
+    first REAL NOT NULL,
+    last REAL NOT NULL,
+    PRIMARY KEY (day, model)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value
+);
+"""
+
+INSERT = ("INSERT INTO usage (ts, model, session, prompt_tokens, completion_tokens, total_tokens, cost_usd, entry) "
+          "VALUES (?, ?, ?, ?, ?, ?, ?, ?)")
+ROLLUP = ("INSERT INTO daily VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (day, model) DO UPDATE SET "
+          "messages = messages + excluded.messages, cost_usd = cost_usd + excluded.cost_usd, "
+          "total_tokens = total_tokens + excluded.total_tokens, prompt_tokens = prompt_tokens + excluded.prompt_tokens, "
+          "completion_tokens = completion_tokens + excluded.completion_tokens, "
+          "first = MIN(first, excluded.first), last = MAX(last, excluded.last)")
+
+# Expressions for breakdown(); days and hours are in local time like the log timestamps
+GROUPS = {
+    "model": "model",
+    "session": "session",
+    "day": "date(ts, 'unixepoch', 'localtime')",
+    "hour": "strftime('%Y-%m-%d %H:00', ts, 'unixepoch', 'localtime')",
+}
+
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+
+def _row(entry: dict) -> Optional[tuple]:
+    """Insert parameters for a log entry, or None if it is malformed"""
+    try:
+        ts = datetime.datetime.fromisoformat(entry["timestamp"]).timestamp()
+        prompt_tokens = int(entry.get("prompt_tokens", 0))
+        completion_tokens = int(entry.get("completion_tokens", 0))
+        return (ts, entry["model"], entry.get("session"), prompt_tokens, completion_tokens,
+                int(entry.get("total_tokens", prompt_tokens + completion_tokens)), float(entry["cost_usd"]),
+                json.dumps(entry, separators=(",", ":")))
+    except (ValueError, KeyError, TypeError):
+        return None
+
+def connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")  # Safe with WAL; syncs at checkpoints rather than every commit
+    return conn
+
+def _rollup(rows: List[tuple]) -> List[tuple]:
+    """Per (local day, model) sums of a batch of usage rows, for the daily table"""
+    days = {}
+    for ts, model, _, prompt_tokens, completion_tokens, total_tokens, cost, _ in rows:
+        key = (datetime.datetime.fromtimestamp(ts).strftime("%Y-%m-%d"), model)
+        totals = days.get(key)
+        if totals is None:
+            days[key] = [1, cost, total_tokens, prompt_tokens, completion_tokens, ts, ts]
+        else:
+            totals[0] += 1
+            totals[1] += cost
+            totals[2] += total_tokens
+            totals[3] += prompt_tokens
+            totals[4] += completion_tokens
+            totals[5] = min(totals[5], ts)
+            totals[6] = max(totals[6], ts)
+    return [key + tuple(totals) for key, totals in days.items()]
+
+def _unseen(conn: sqlite3.Connection, rows: List[tuple]) -> List[tuple]:
+    """Rows whose record (timestamp and content) isn't in the usage table yet, e.g. already written live"""
+    if not rows:
+        return rows
+    stored = collections.Counter(conn.execute("SELECT ts, entry FROM usage WHERE ts BETWEEN ? AND ?",
+                                              (min(row[0] for row in rows), max(row[0] for row in rows))))
+    fresh = []
+    for row in rows:
+        if stored[(row[0], row[7])]:
+            stored[(row[0], row[7])] -= 1
+        else:
+            fresh.append(row)
+    return fresh
+
+def _write(conn: sqlite3.Connection, statements, attempts: int = 5):
+    """(sql, rows) executemany calls in one write transaction, retrying if other writers hold the lock too long
+
+    statements may be a function of the connection, called inside the transaction
+    so what it reads can't change before the writes commit.
+    """
+    for attempt in range(attempts):
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for sql, rows in (statements(conn) if callable(statements) else statements):
+                conn.executemany(sql, rows)
+            conn.execute("COMMIT")
+            return
+        except sqlite3.OperationalError as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            if attempt == attempts - 1 or "locked" not in str(e):
+                raise
+            time.sleep(0.1 * (attempt + 1))
+
+class UsageStore:
+    """Batched, multi-process-safe writer plus indexed queries over one database file"""
+
+    def __init__(self, path: str = DEFAULT_DB, batch_size: int = BATCH_SIZE, flush_interval: float = FLUSH_INTERVAL):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue: queue.Queue = queue.Queue()
+        self.written = 0
+        self.failed = 0
+        self.conn = connect(path)  # Used by queries; the writer thread has its own
+        self.lock = threading.Lock()
+        self.conn.executescript(SCHEMA)
+        self.thread = threading.Thread(target=self._writer, daemon=True, name="usage-store")
+        self.thread.start()
+        atexit.register(self.close)
+
+    def add(self, entry: dict):
+        """Queue a usage record (returns immediately)"""
+        row = _row(entry)
+        if row is not None:
+            self.queue.put(row)
+
+    def flush(self, timeout: float = 30.0):
+        """Block until everything queued so far is committed"""
+        if self.thread.is_alive():
+            done = threading.Event()
+            self.queue.put(("flush", done))
+            done.wait(timeout)
+
+    def close(self):
+        if self.thread.is_alive():
+            done = threading.Event()
+            self.queue.put(("stop", done))
+            done.wait(30.0)
+
+    def _writer(self):
+        conn = connect(self.path)
+        pending = []
+        while True:
+            try:
+                item = self.queue.get(timeout=self.flush_interval if pending else None)
+            except queue.Empty:
+                item = None
+            control = None
+            if item is not None and item[0] in ("flush", "stop"):
+                control = item
+            elif item is not None:
+                pending.append(item)
+                if len(pending) < self.batch_size:
+                    continue
+            if pending:
+                try:
+                    _write(conn, [(INSERT, pending), (ROLLUP, _rollup(pending))])
+                    self.written += len(pending)
+                except sqlite3.Error as e:
+                    self.failed += len(pending)
+                    print(f"Could not store {len(pending)} usage records: {e}")
+                pending = []
+            if control is not None:
+                control[1].set()
+                if control[0] == "stop":
+                    conn.close()
+                    return
+
+    # Queries
+
+    @staticmethod
+    def _where(start: float = None, end: float = None, model: str = None, session: str = None) -> Tuple[str, list]:
+        clauses, params = [], []
+        if start is not None:
+            clauses.append("ts >= ?")
+            params.append(start)
+        if end is not None:
+            clauses.append("ts < ?")
+            params.append(end)
+        if model is not None:
+            clauses.append("model = ?")
+            params.append(model)
+        if session is not None:
+            clauses.append("session = ?")
+            params.append(session)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    @staticmethod
+    def _daily_where(start: float = None, end: float = None, model: str = None, session: str = None):
+        """WHERE clause over the daily rollup, or None if the range doesn't fall on local day boundaries"""
+        if session is not None:
+            return None
+        clauses, params = [], []
+        for bound, op in ((start, ">="), (end, "<")):
+            if bound is None:
+                continue
+            moment = datetime.datetime.fromtimestamp(bound)
+            if moment.time() != datetime.time(0):
+                return None
+            clauses.append(f"day {op} ?")
+            params.append(moment.strftime("%Y-%m-%d"))
+        if model is not None:
+            clauses.append("model = ?")
+            params.append(model)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def _query(self, sql: str, params: list) -> list:
+        self.flush()  # Include this process's queued records
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def totals(self, start: float = None, end: float = None, model: str = None, session: str = None) -> dict:
+        """Cost, tokens and message count over [start, end) epoch seconds"""
+        daily = self._daily_where(start, end, model, session)
+        if daily is not None:
+            sql = ("SELECT COALESCE(SUM(messages), 0), COALESCE(SUM(cost_usd), 0), COALESCE(SUM(total_tokens), 0), "
+                   "COALESCE(SUM(prompt_tokens), 0), COALESCE(SUM(completion_tokens), 0), MIN(first), MAX(last) "
+                   "FROM daily")
+            where, params = daily
+        else:
+            sql = ("SELECT COUNT(*), COALESCE(SUM(cost_usd), 0), COALESCE(SUM(total_tokens), 0), "
+                   "COALESCE(SUM(prompt_tokens), 0), COALESCE(SUM(completion_tokens), 0), MIN(ts), MAX(ts) "
+                   "FROM usage")
+            where, params = self._where(start, end, model, session)
+        messages, cost, tokens, prompt, completion, first, last = self._query(sql + where, params)[0]
+        return {"messages": messages, "cost_usd": cost, "tokens": tokens, "prompt_tokens": prompt,
+                "completion_tokens": completion, "first": first, "last": last}
+
+    def breakdown(self, group: str, start: float = None, end: float = None, model: str = None,
+                  session: str = None) -> List[dict]:
+        """Totals per model, session, day or hour, most expensive first (days and hours in order)"""
+        order = "key" if group in ("day", "hour") else "cost DESC"
+        daily = self._daily_where(start, end, model, session) if group in ("day", "model") else None
+        if daily is not None:
+            where, params = daily
+            sql = (f"SELECT {group} AS key, SUM(cost_usd) AS cost, SUM(total_tokens), SUM(messages) "
+                   f"FROM daily{where} GROUP BY key ORDER BY {order}")
+        else:
+            where, params = self._where(start, end, model, session)
+            sql = (f"SELECT {GROUPS[group]} AS key, SUM(cost_usd) AS cost, SUM(total_tokens), COUNT(*) "
+                   f"FROM usage{where} GROUP BY key ORDER BY {order}")
+        rows = self._query(sql, params)
+        return [{"key": key, "cost_usd": cost, "tokens": tokens, "messages": messages}
+                for key, cost, tokens, messages in rows]
+
+    def models(self) -> List[str]:
+        return [row[0] for row in self._query("SELECT DISTINCT model FROM daily ORDER BY model", [])]
+
+    def import_log(self, log_path: str) -> int:
+        """Copy chat_costs.log records into the store, resuming after the last import of that file
+
+        Records already in the store with the same timestamp and content are
+        skipped, since CostTracker wrote those to both places. Records from the
+        last SETTLE seconds are left for the next import, as a process logging
+        them may not have committed its copy yet.
+        """
+        key = "import:" + os.path.abspath(log_path)
+        self.flush()  # Commit this process's queued records so they are recognised
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        offset = row[0] if row else 0
+        settled = time.time() - SETTLE
+        if offset > os.path.getsize(log_path):
+            offset = 0  # Rotated or truncated since the last import
+        imported = 0
+        with open(log_path, "rb") as f:
+            f.seek(offset)
+            while True:
+                rows = []
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break  # Partial last line - still being written
+                    try:
+                        row = _row(json.loads(line))
+                    except ValueError:
+                        row = None
+                    if row is not None and row[0] > settled:
+                        break  # Resume here next time
+                    offset += len(line)
+                    if row is not None:
+                        rows.append(row)
+                    if len(rows) >= IMPORT_BATCH:
+                        break
+                fresh = []
+
+                def statements(conn, rows=rows, end=offset):
+                    # Records, rollups and the resume offset commit together
+                    fresh[:] = _unseen(conn, rows)
+                    return [(INSERT, fresh), (ROLLUP, _rollup(fresh)),
+                            ("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", [(key, end)])]
+
+                with self.lock:
+                    _write(self.conn, statements)
+                imported += len(fresh)
+                if len(rows) < IMPORT_BATCH:
+                    return imported
+
+# Active store for this process, set by the --usage-db flag
+store: Optional[UsageStore] = None
+
+def open_store(path: str) -> UsageStore:
+    global store
+    store = UsageStore(path)
+    return store
+
+def record(entry: dict):
+    """Queue a usage record if a store is open (no-op otherwise)"""
+    if store is not None:
+        store.add(entry)
+
+def parse_period(text: str, now: datetime.datetime = None) -> Tuple[Optional[float], Optional[float], str]:
+    """(start, end) epoch seconds and a label for 'today', 'yesterday', '7d', '12h', 'tuesday',
+    'last tuesday', '2025-01-14' or '2025-01-01..2025-01-31'; empty means all time"""
+    now = now or datetime.datetime.now()
+    text = text.strip().lower()
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    day = datetime.timedelta(days=1)
+
+    def span(start: datetime.datetime, end: datetime.datetime, label: str):
+        return start.timestamp(), end.timestamp(), label
+
+    if not text or text == "all":
+        return None, None, "all time"
+    if text == "today":
+        return span(midnight, midnight + day, "today")
+    if text == "yesterday":
+        return span(midnight - day, midnight, "yesterday")
+    if text[:-1].isdigit() and text[-1] in "dh":
+        amount = int(text[:-1])
+        delta = datetime.timedelta(days=amount) if text[-1] == "d" else datetime.timedelta(hours=amount)
+        return span(now - delta, now, f"last {amount}{text[-1]}")
+    name = text[5:] if text.startswith("last ") else text
+    if name in WEEKDAYS:
+        # Most recent such day before today
+        back = (now.weekday() - WEEKDAYS.index(name) - 1) % 7 + 1
+        start = midnight - back * day
+        return span(start, start + day, start.strftime("%A %Y-%m-%d"))
+    first, _, last = text.partition("..")
+    start = datetime.datetime.fromisoformat(first)
+    end = datetime.datetime.fromisoformat(last) if last else start
+    return span(start, end + day, f"{first}..{last}" if last else first)
+
+def print_report(usage: UsageStore, start: float = None, end: float = None, model: str = None,
+                 session: str = None, label: str = "all time"):
+    from cost_tracking import MODEL_PRICING
+
+    query_start = time.perf_counter()
+    totals = usage.totals(start, end, model, session)
+    models = usage.breakdown("model", start, end, model, session)
+    days = usage.breakdown("day", start, end, model, session)
+    elapsed = time.perf_counter() - query_start
+
+    print("\nCOST ANALYSIS")
+    print("=" * 50)
+    scope = f"{label}" + (f" | model {MODEL_PRICING.get(model, {}).get('name', model)}" if model else "") + \
+        (f" | session {session}" if session else "")
+    print(f"Period: {scope}  ({usage.path}, queried in {elapsed * 1000:.1f}ms)")
+    if totals["messages"] == 0:
+        print("No usage recorded for this period.")
+        return
+    print(f"Total spent: ${totals['cost_usd']:.6f}")
+    print(f"Total tokens: {totals['tokens']:,} ({totals['prompt_tokens']:,} prompt, "
+          f"{totals['completion_tokens']:,} completion)")
+    print(f"Total messages: {totals['messages']}")
+    print(f"Average per message: ${totals['cost_usd'] / totals['messages']:.6f}")
+
+    print(f"\nCost by Model:")
+    for row in models:
+        print(f"- {MODEL_PRICING.get(row['key'], {}).get('name', row['key'])}")
+        print(f"  ${row['cost_usd']:.6f} | {row['tokens']:,} tokens | {row['messages']} messages")
+
+    print("\nCost by Day:")
+    for row in days[-14:]:
+        print(f"  {row['key']}  ${row['cost_usd']:.6f} | {row['messages']} messages")
+    if len(days) > 14:
+        print(f"  ... {len(days) - 14} earlier days omitted")
+
+    avg_daily = totals["cost_usd"] / len(days)
+    monthly_projection = avg_daily * 30
+    print(f"\nAverage daily spend: ${avg_daily:.6f} | Monthly projection: ${monthly_projection:.2f}")
+    if monthly_projection > 10:
+        print("WARNING: High projected monthly cost!")
+
+def main():
+    parser = argparse.ArgumentParser(description="Query (or fill) the SQLite usage store")
+    parser.add_argument("--db", default=os.environ.get("GOOP_USAGE_DB") or DEFAULT_DB, help="database file")
+    parser.add_argument("--import", dest="import_log", metavar="LOG",
+                        help="copy new records from a chat_costs.log first (resumes where the last import stopped)")
+    parser.add_argument("--period", default="",
+                        help="today, yesterday, 7d, 12h, tuesday, 'last tuesday', YYYY-MM-DD or FROM..TO")
+    parser.add_argument("--model", help="only this model")
+    parser.add_argument("--session", help="only this session")
+    parser.add_argument("--json", action="store_true", help="print totals and breakdowns as JSON")
+    args = parser.parse_args()
+
+    usage = UsageStore(args.db)
+    if args.import_log:
+        start_time = time.perf_counter()
+        count = usage.import_log(args.import_log)
+        print(f"Imported {count:,} records from {args.import_log} in {time.perf_counter() - start_time:.2f}s")
+    start, end, label = parse_period(args.period)
+    if args.json:
+        print(json.dumps({
+            "period": label,
+            "totals": usage.totals(start, end, args.model, args.session),
+            "by_model": usage.breakdown("model", start, end, args.model, args.session),
+            "by_day": usage.breakdown("day", start, end, args.model, args.session),
+        }, indent=2))
+    else:
+        print_report(usage, start, end, args.model, args.session, label)
+
+if __name__ == "__main__":
+    main()
@@ -6,11 +6,20 @@
 # Setup: Follow goop setup instructions, then run this script
 
 from openai import OpenAI
+import argparse
 import time
 
+from connection_warmer import ConnectionWarmer
+from concurrency_sweep import DEFAULT_LEVELS, HISTORY_FILE, load_history, previous_levels, save_run, sweep_model
+from model_cache import ModelCache, CACHE_FILE
+from profiler import profile_run
+
 # Configure for your goop proxy setup
 # Default goop proxy runs on localhost:8080
-client = OpenAI(base_url="http://localhost:8080/openai-proxy/v1", api_key="your-api-key")
+# Connections are opened before timing starts, so the first model doesn't pay for connection setup
+warmer = ConnectionWarmer()
+client = OpenAI(base_url="http://localhost:8080/openai-proxy/v1", api_key="your-api-key",
+                http_client=warmer.http_client())
 
 # Priority models - most likely to work and most useful
 # Update this list based on your Google Cloud project's model access
@@ -56,7 +65,9 @@ def test_model_detailed(model_name, description, use_case):
         duration = time.time() - start_time
         content = response.choices[0].message.content.strip()
         
-        print(f"SUCCESS ({duration:.2f}s)")
+        # Includes connection setup if the pooled connection had been dropped
+        cold = " incl. new connection" if warmer.last_request_cold() else ""
+        print(f"SUCCESS ({duration:.2f}s{cold})")
         print(f"   Response: {content}")
         
         # Try to get usage info if available
@@ -70,7 +81,27 @@ def test_model_detailed(model_name, description, use_case):
         print(f"   Error: {str(e)[:100]}")
         return False, str(e), 0
 
-def main():
+def parse_args():
+    parser = argparse.ArgumentParser(description="Verify Vertex AI model access through goop proxy")
+    parser.add_argument("--all", action="store_true",
+                        help="re-test every model, ignoring fresh cached results")
+    parser.add_argument("--ttl", type=float, default=None,
+                        help="override how long (seconds) new results stay fresh")
+    parser.add_argument("--sweep", action="store_true",
+                        help="measure throughput and latency at rising concurrency instead of checking access")
+    parser.add_argument("--levels", default=",".join(str(level) for level in DEFAULT_LEVELS),
+                        help="comma-separated concurrency levels for --sweep")
+    parser.add_argument("--sweep-requests", type=int, default=None,
+                        help="requests per level (default: 4 per worker, at least 20)")
+    parser.add_argument("--models", default=None,
+                        help="comma-separated models for --sweep (default: models verified as working)")
+    parser.add_argument("--profile", action="store_true",
+                        help="profile the run and write collapsed stacks plus a cProfile dump to profiles/")
+    return parser.parse_args()
+
+def verify(args):
+    cache = ModelCache()
+
     print("VERTEX AI MODEL VERIFICATION")
     print("Testing model access through goop proxy...")
     print("=" * 60)
@@ -86,6 +117,7 @@ def main():
             timeout=10
         )
         print("Connection successful!")
+        warmer.warm(client)
     except Exception as e:
         print(f"Connection failed: {e}")
         print("Make sure goop proxy is running on http://localhost:8080")
@@ -95,8 +127,18 @@ def main():
     working_models = []
     failed_models = []
     
+    cached_count = 0
+    
     for model, tag, description in priority_models:
+        # Incremental mode: only re-test stale or previously failing models
+        if not args.all and not cache.needs_check(model):
+            cached_count += 1
+            working_models.append((model, tag, description, cache.entries[model]["latency"]))
+            continue
+        
         success, result, duration = test_model_detailed(model, tag, description)
+        cache.record(model, success, duration, None if success else result, ttl=args.ttl)
+        cache.save()
         
         if success:
             working_models.append((model, tag, description, duration))
@@ -106,6 +148,9 @@ def main():
         # Brief pause between tests
         time.sleep(1)
     
+    if cached_count:
+        print(f"\nReused {cached_count} fresh result(s) from '{CACHE_FILE}' (use --all to re-test)")
+    
     # Results Summary
     print("\n" + "=" * 60)
     print("RESULTS SUMMARY")
@@ -168,6 +213,10 @@ def main():
             f.write("Update MODEL_PRICING dictionary with these working models\n")
         
         print(f"\nDetailed results saved to 'working_models.txt'")
+        print(f"Availability cache for other tools saved to '{CACHE_FILE}'")
+    
+    # The connection test is usually the only cold request; model timings above reuse warm connections
+    print(f"\n{warmer.describe()}")
     
     if not working_models:
         print("\nTROUBLESHOoting:")
@@ -182,5 +231,61 @@ def main():
         print(f"   3. Set up cost monitoring for your usage")
         print(f"   4. Test the models in chat_with_costs.py or web_chat.py")
 
+def sweep(args):
+    """Concurrency scaling sweep for working models, compared with the previous run"""
+    if args.models:
+        models = [m.strip() for m in args.models.split(",") if m.strip()]
+    else:
+        cache = ModelCache()
+        models = [model for model, _, _ in priority_models if cache.is_available(model)]
+        if not models:
+            print(f"No verified models in '{CACHE_FILE}' - run verify_models.py first or pass --models")
+            return
+    levels = [int(level) for level in args.levels.split(",")]
+    # Retries would hide throttling, so every request gets exactly one attempt
+    sweep_client = client.with_options(max_retries=0)
+    history = load_history()
+
+    print("CONCURRENCY SCALING SWEEP")
+    print(f"Levels: {', '.join(map(str, levels))} concurrent requests per model")
+    print("=" * 78)
+    results = []
+    for model in models:
+        previous = previous_levels(history, model)
+        print(f"\n{model}")
+        print(f"  {'conc':>5} {'req/s':>8} {'tok/s':>8} {'p50':>7} {'p95':>7} {'p99':>7} "
+              f"{'errors':>7} {'throttle':>8}  vs last run")
+
+        def show(level):
+            before = previous.get(level["concurrency"])
+            change = ""
+            if before and before["requests_per_sec"]:
+                change = f"{(level['requests_per_sec'] / before['requests_per_sec'] - 1) * 100:+.0f}% req/s"
+            print(f"  {level['concurrency']:>5} {level['requests_per_sec']:>8.2f} {level['tokens_per_sec']:>8.1f} "
+                  f"{level['latency_p50']:>6.2f}s {level['latency_p95']:>6.2f}s {level['latency_p99']:>6.2f}s "
+                  f"{level['error_rate']:>7.1%} {level['throttle_rate']:>8.1%}  {change}")
+
+        result = sweep_model(sweep_client, model, levels, args.sweep_requests, on_level=show)
+        saturation = result["saturation"]
+        if saturation["concurrency"] is None:
+            print(f"  Saturation: none found ({saturation['reason']})")
+        else:
+            print(f"  Saturation: ~{saturation['concurrency']} concurrent, "
+                  f"{saturation['requests_per_sec']:.2f} req/s ({saturation['reason']})")
+        results.append(result)
+
+    save_run(results)
+    print(f"\nResults appended to '{HISTORY_FILE}'")
+    # New connections opened while concurrency rose are reported apart from reused ones
+    print(warmer.describe())
+
+def main():
+    args = parse_args()
+    with profile_run("verify_models", enabled=args.profile):
+        if args.sweep:
+            sweep(args)
+        else:
+            verify(args)
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
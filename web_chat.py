@@ -5,61 +5,417 @@
 # Dependencies: pip install openai
 # Setup: Follow goop setup instructions, then run this script
 
-from http.server import HTTPServer, BaseHTTPRequestHandler
+import argparse
+from contextlib import contextmanager, nullcontext
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import gzip
 import json
+import os
+import socket
+import threading
+import time
 import urllib.parse
-from openai import OpenAI
+from typing import Optional
+from openai import APIConnectionError, APIStatusError, InternalServerError, OpenAI, RateLimitError
+
+from anomaly_detector import upstream_seconds
+from budget import BudgetExceeded, BudgetManager, Reservation, TokenEstimator, add_budget_args
+from connection_warmer import ConnectionWarmer, add_warm_args
+from conversation_store import ConversationStore
+from cost_tracking import MODEL_PRICING, CostTracker
+from cost_attribution import CostAttribution, load as load_attribution, prompt_fingerprint
+from health_monitor import HealthMonitor
+from max_tokens_tuner import MaxTokensTuner
+from model_cache import ModelCache
+from model_compare import compare_models
+from phase_timer import PhaseTimer, phase_stats
+from profiler import profile_run
+from traffic_capture import KEY_FILE, anonymize, capture, load_key, start_capture, stop_capture
+from request_scheduler import QueueFull, RequestCancelled, RequestScheduler
+from tracing import KIND_CLIENT, add_trace_args, current_span, tracer
+from transcript_store import TranscriptStore
+import usage_store
+from worker_pool import Drain, ReusePortHTTPServer, SharedCounters, WorkerPool, serve_worker, worker_path
+from ws_transport import WebSocketConnection, accept_key
 
 # Configure for your goop proxy setup
 # Default goop proxy runs on localhost:8080
-client = OpenAI(base_url="http://localhost:8080/openai-proxy/v1", api_key="your-api-key")
-
-# Vertex AI Pricing (as of January 2025) - verify current rates at cloud.google.com
-# Update these rates based on your region and current Google Cloud pricing
-MODEL_PRICING = {
-    "vertex/gemini-2.0-flash-lite-001": {
-        "input_per_1k": 0.000075,
-        "output_per_1k": 0.0003,
-        "name": "Gemini 2.0 Flash Lite",
-        "description": "Fastest (0.51s)",
-        "speed": "fastest"
-    },
-    "vertex/gemini-2.5-flash-preview-05-20": {
-        "input_per_1k": 0.00015,
-        "output_per_1k": 0.0006,
-        "name": "Gemini 2.5 Flash Preview",
-        "description": "Newest (0.68s)",
-        "speed": "fast"
-    },
-    "vertex/gemini-2.0-flash-001": {
-        "input_per_1k": 0.00015,
-        "output_per_1k": 0.0006,
-        "name": "Gemini 2.0 Flash",
-        "description": "Reliable (0.83s)",
-        "speed": "medium"
-    },
-    "vertex/gemini-2.5-pro-preview-05-06": {
-        "input_per_1k": 0.0003,
-        "output_per_1k": 0.0012,
-        "name": "Gemini 2.5 Pro Preview",
-        "description": "Most Capable (1.26s)",
-        "speed": "slower"
-    }
-}
-
-# Session tracking
-session_cost = 0.0
-message_count = 0
-
-def calculate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
-    """Calculate cost for a single request"""
-    if model not in MODEL_PRICING:
-        model = "vertex/gemini-2.0-flash-001"  # Fallback
+# The warmer keeps pooled connections open while idle (set with --warm-connections/--warm-interval)
+warmer = ConnectionWarmer()
+client = OpenAI(base_url="http://localhost:8080/openai-proxy/v1", api_key="your-api-key",
+                http_client=warmer.http_client())
+PORT = 8000
+
+# Spend by request tags (session, prompt, user-supplied tags) in fixed memory - served by /attribution
+attribution = CostAttribution()
+ATTRIBUTION_SAVE_INTERVAL = 60  # Seconds between --attribution snapshots
+MAX_REQUEST_TAGS = 8
+
+# Server totals; usage is logged to the same chat_costs.log as chat_with_costs.py, so reports cover both.
+# The log's history (anomaly baselines) is read in main(), not at import
+COST_LOG = "chat_costs.log"
+cost_tracker = CostTracker(pricing=MODEL_PRICING, log_file=COST_LOG, attribution=attribution, load_history=False)
+
+# Recent messages per page session, so the page can drop old ones and reload on scroll
+transcripts = TranscriptStore()
+
+# Upstream concurrency budget shared fairly between clients (by address)
+scheduler = RequestScheduler(max_concurrent=4, max_queue=32, max_per_session=4)
+SPEED_PRIORITY = {"fastest": 0, "fast": 0, "medium": 1, "slower": 2}
+
+# Background canary probes - lets requests skip models that are down
+health_monitor = HealthMonitor(client, list(MODEL_PRICING.keys()))
+MAX_FAILOVER_ATTEMPTS = 3
+
+# max_tokens caps learned from observed reply lengths (seeded from the cost log at startup)
+MAX_TOKENS = 500
+tuner = MaxTokensTuner(max_tokens=MAX_TOKENS, pricing=MODEL_PRICING)
+
+# Requests in progress, so a worker stopping for a restart can let them finish
+drain = Drain()
+
+# Pre-flight prompt estimates and spending limits (set with --session-budget/--daily-budget/--budget)
+estimator = TokenEstimator()
+budgets = BudgetManager(MODEL_PRICING)
+
+class AllModelsFailed(Exception):
+    """Raised when the requested model and every fallback failed"""
+
+def is_transient(error: Exception) -> bool:
+    """Outages, timeouts, rate limits and 5xx - worth failing over for and counting against the model's health"""
+    if isinstance(error, (APIConnectionError, RateLimitError, InternalServerError)):
+        return True
+    return isinstance(error, APIStatusError) and error.status_code >= 500
+
+def rejection_text(error: APIStatusError) -> str:
+    """Message for a request the upstream refused (too long, unauthorized, ...)"""
+    return f"Request rejected by the model ({error.status_code}): {str(error.message)[:200]}"
+
+def complete_with_failover(requested_model: str, messages: list, stream: bool = False,
+                           max_tokens: int = MAX_TOKENS, hold: Optional[Reservation] = None):
+    """Call the requested model, transparently falling over to the next-best healthy one
+
+    The budget hold was priced for the requested model; a pricier failover
+    target is only tried if the hold can grow to its worst case. Errors that
+    aren't transient (a 400 for an over-long prompt, a 401) are the request's
+    fault, not the model's: they are raised as-is without failing over.
+    """
+    last_error = None
+    # Streaming requests ask for a final usage chunk so costs stay exact
+    stream_args = {"stream": True, "stream_options": {"include_usage": True}} if stream else {}
+    for attempt, model in enumerate(health_monitor.candidates(requested_model)[:MAX_FAILOVER_ATTEMPTS], 1):
+        if hold is not None and model != requested_model:
+            try:
+                budgets.extend(hold, model)
+            except BudgetExceeded as e:
+                print(f"Not failing over to {model}: {e}")
+                last_error = e
+                continue
+        start_time = time.time()
+        try:
+            # One span per model tried; the SDK's own retries appear as HTTP spans inside it
+            with tracer.span(f"chat {model}", KIND_CLIENT, {"gen_ai.request.model": model,
+                                                            "gen_ai.request.max_tokens": max_tokens,
+                                                            "goop.failover_attempt": attempt}):
+                response = client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=0.7,
+                    **stream_args
+                )
+        except Exception as e:
+            if not is_transient(e):
+                raise
+            print(f"Model {model} failed: {e}")
+            health_monitor.report_failure(model, e)
+            last_error = e
+            continue
+        health_monitor.report_success(model, time.time() - start_time)
+        if model != requested_model:
+            health_monitor.record_failover(requested_model)
+        return response, model
+    raise AllModelsFailed(f"No model is currently available (last error: {str(last_error)[:120]})")
+
+def record_cost(model: str, prompt_tokens: int, completion_tokens: int, latency: float = None,
+                detect: bool = True) -> dict:
+    """Add a request to the session totals and return the cost_info sent to the page
+    
+    The caller writes the log record once its phase timings are complete. Anomalies
+    (latency, tokens or cost far above the model's usual) are printed and passed on.
+    """
+    totals = cost_tracker.track_usage(model, prompt_tokens, completion_tokens, log=False, latency=latency,
+                                      detect=detect)
+    cost_info = dict(server_totals(), last_cost=totals["request_cost"], tokens=prompt_tokens + completion_tokens)
+    if "anomalies" in totals:
+        cost_info["anomalies"] = totals["anomalies"]
+        for alert in totals["anomalies"]:
+            print(f"ANOMALY: {alert['message']}")
+    return cost_info
+
+def trace_usage(model: str, prompt_tokens: int, completion_tokens: int, cost: float, finish_reason=None, **more):
+    """Served model, tokens and cost on the current trace's root span"""
+    current_span().set({"gen_ai.response.model": model, "gen_ai.usage.input_tokens": prompt_tokens,
+                        "gen_ai.usage.output_tokens": completion_tokens, "goop.cost_usd": cost,
+                        "gen_ai.response.finish_reasons": [finish_reason] if finish_reason else None,
+                        **{"goop." + key: value for key, value in more.items()}})
+
+def server_totals() -> dict:
+    """Spend and message count for the whole server - summed over every worker with --workers"""
+    if cost_tracker.counters is not None:
+        shared = cost_tracker.counters.totals()
+        cost, count = shared["cost"], shared["messages"]
+    else:
+        with cost_tracker.lock:
+            cost, count = cost_tracker.session_costs.session_cost, cost_tracker.session_costs.message_count
+    return {"session_cost": cost, "message_count": count, "avg_cost": cost / count if count > 0 else 0}
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token) when the API gave no usage"""
+    return max(1, len(text) // 4)
+
+def session_id(data: dict):
+    """The page's session id, if it sent a usable one"""
+    session = data.get('session')
+    return session if isinstance(session, str) and 0 < len(session) <= 64 else None
+
+def request_tags(data: dict, queue_key: str, message: str) -> dict:
+    """Attribution tags for a request: the client's own "tags" plus session and prompt fingerprint
+    
+    Client tags must be short strings; anything else is ignored rather than rejected.
+    """
+    tags = {}
+    supplied = data.get('tags')
+    if isinstance(supplied, dict):
+        for name, value in list(supplied.items())[:MAX_REQUEST_TAGS]:
+            if isinstance(name, str) and isinstance(value, str) and 0 < len(name) <= 32 and value:
+                tags[name] = value[:128]
+    tags["session"] = anonymize(queue_key)
+    tags["prompt"] = prompt_fingerprint(message)
+    return tags
+
+def reserve_budget(model: str, client: str, prompt_estimate: int, plan: dict):
+    """Hold the request's worst-case cost against the budgets; may lower plan["max_tokens"] in place
+
+    The session budget is keyed on the client address rather than the page's
+    session id, which a client could change on every request to escape it.
+    """
+    hold = budgets.reserve(model, anonymize(client), prompt_estimate, plan["max_tokens"])
+    if hold.shrunk:
+        # The budget's cap, not the tuner's - truncation here must not widen the learned cap
+        plan.update(max_tokens=hold.max_tokens, tuned=False, budget_limited=True)
+    return hold
+
+def model_priority(model: str) -> int:
+    """Scheduler priority class from the model's speed tier (lower runs first)"""
+    return SPEED_PRIORITY.get(MODEL_PRICING.get(model, {}).get("speed"), 1)
+
+def stream_chat(ws: WebSocketConnection, request_id, message: str, requested_model: str,
+                cancel_event: threading.Event, session: str = None, queue_key: str = None, tags: dict = None):
+    """Stream one reply over a WebSocket, stopping upstream generation on cancel"""
+    def send(data: dict) -> bool:
+        data["id"] = request_id
+        return ws.send_text(json_encoder.encode(data))
+    
+    print(f"User: {message}")
+    print(f"Using model: {requested_model} (streaming)")
+    queue_key = queue_key or "anonymous"
+    started = time.time()
+    timer = PhaseTimer()
+    prompt_estimate = estimator.estimate(requested_model, [{"role": "user", "content": message}])
+    plan = tuner.plan(requested_model, prompt_estimate, session)
+    try:
+        hold = reserve_budget(requested_model, queue_key, prompt_estimate, plan)
+    except BudgetExceeded as e:
+        send({"type": "error", "error": str(e), "budget": e.scope})
+        return
+    try:
+        with timer.phase("queue"):
+            ticket = scheduler.acquire(queue_key, model_priority(requested_model),
+                                       plan["expected_completion_tokens"], cancel_event.is_set)
+    except (QueueFull, RequestCancelled) as e:
+        budgets.release(hold)
+        send({"type": "error", "error": str(e), "retry_after": getattr(e, "retry_after", 0)})
+        return
+    try:
+        stream_reply(send, message, requested_model, cancel_event, session, timer, started, queue_key, plan,
+                     tags or request_tags({}, queue_key, message), hold)
+    finally:
+        budgets.release(hold)  # No-op once settled; covers replies that died before being charged
+        scheduler.release(ticket)
+
+def stream_reply(send, message: str, requested_model: str, cancel_event: threading.Event,
+                 session: str, timer: PhaseTimer, started: float, queue_key: str, plan: dict,
+                 tags: dict, hold):
+    """Body of stream_chat, run while holding an upstream slot"""
+    try:
+        with timer.phase("connect"):
+            stream, model = complete_with_failover(requested_model, [{"role": "user", "content": message}],
+                                                   stream=True, max_tokens=plan["max_tokens"], hold=hold)
+    except AllModelsFailed as e:
+        send({"type": "error", "error": str(e)})
+        return
+    except APIStatusError as e:
+        send({"type": "error", "error": rejection_text(e), "status": e.status_code})
+        return
+    send({"type": "start", "model": model, "requested_model": requested_model, "estimate": plan})
+    
+    parts = []
+    usage = None
+    finish_reason = None
+    error_text = None
+    generate_start = time.perf_counter()
+    span = tracer.span("generate")
+    try:
+        for chunk in stream:
+            if cancel_event.is_set():
+                break
+            if chunk.usage:
+                usage = chunk.usage
+            if chunk.choices and chunk.choices[0].finish_reason:
+                finish_reason = chunk.choices[0].finish_reason
+            if chunk.choices and chunk.choices[0].delta.content:
+                text = chunk.choices[0].delta.content
+                parts.append(text)
+                if not send({"type": "delta", "text": text}):
+                    cancel_event.set()  # Tab went away - no one is reading
+                    break
+    except Exception as e:
+        print(f"Stream error: {e}")
+        error_text = "Generation interrupted by an upstream error"
+        span.fail(e)
+    finally:
+        # Closing the response drops the upstream connection so the proxy stops generating
+        stream.close()
+        timer.record("generate", time.perf_counter() - generate_start)
+        span.set({"goop.chunks": len(parts), "goop.cancelled": cancel_event.is_set()})
+        span.end()
+    
+    ai_message = "".join(parts)
+    with timer.phase("cost"):
+        if usage is not None:
+            prompt_tokens, completion_tokens = usage.prompt_tokens, usage.completion_tokens
+            estimated = False
+        else:
+            # Cancelled before the usage chunk arrived - charge an estimate for what was generated
+            prompt_tokens, completion_tokens = estimate_tokens(message), estimate_tokens(ai_message)
+            estimated = True
+        cost_info = record_cost(model, prompt_tokens, completion_tokens, latency=upstream_seconds(timer.as_dict()),
+                                detect=not (estimated or error_text or cancel_event.is_set()))
+        budgets.settle(hold, cost_info["last_cost"])
+        if not estimated:
+            estimator.observe(requested_model, hold.prompt_tokens, prompt_tokens)
     
-    pricing = MODEL_PRICING[model]
-    input_cost = (prompt_tokens / 1000) * pricing["input_per_1k"]
-    output_cost = (completion_tokens / 1000) * pricing["output_per_1k"]
-    return input_cost + output_cost
+    print(f"AI: {ai_message}")
+    print(f"Cost: ${cost_info['last_cost']:.6f} | Session: ${cost_info['session_cost']:.6f}"
+          f"{' (estimated)' if estimated else ''}")
+    user_seq = seq = None
+    if session and ai_message:
+        # Both turns are saved together, so a rejected or empty reply leaves no orphan prompt in /history
+        user_seq = transcripts.append(session, "user", message)
+        seq = transcripts.append(session, "assistant", ai_message, model)
+    with timer.phase("log"):
+        cost_tracker.log_usage(model, prompt_tokens, completion_tokens, cost_info["last_cost"], timer.as_dict(),
+                               max_tokens=plan["max_tokens"], finish_reason=finish_reason,
+                               max_tokens_tuned=plan["tuned"], session=anonymize(queue_key), tags=tags)
+    phase_stats.add(timer)
+    timings = timer.as_dict()
+    upstream_ms = round(timings.get("connect", 0) + timings.get("generate", 0), 3) if timings else None
+    status = "error" if error_text else "cancelled" if cancel_event.is_set() else "ok"
+    trace_usage(model, prompt_tokens, completion_tokens, cost_info["last_cost"], finish_reason,
+                session=anonymize(queue_key), status=status)
+    if status == "ok":
+        # Cancelled or failed replies say nothing about how long the model wanted to talk
+        tuner.observe(model, completion_tokens, finish_reason, plan["max_tokens"], plan["tuned"], session,
+                      latency=upstream_ms / 1000 if upstream_ms else None)
+    capture(started, src="web", status=status, stream=True, sess=anonymize(queue_key), model=model,
+            req_model=requested_model, prompt_chars=len(message), prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens, max_tokens=plan["max_tokens"],
+            latency_ms=round((time.time() - started) * 1000, 3), upstream_ms=upstream_ms,
+            cost=cost_info["last_cost"])
+    if error_text:
+        send({"type": "error", "error": error_text, "cost_info": cost_info, "user_seq": user_seq, "seq": seq})
+    else:
+        send({"type": "cancelled" if cancel_event.is_set() else "done",
+              "model": model, "cost_info": cost_info, "estimated": estimated, "user_seq": user_seq, "seq": seq,
+              "timings": timings, "truncated": finish_reason == "length"})
+
+MAX_COMPARE_MODELS = 4
+
+def stream_compare(ws: WebSocketConnection, request_id, message: str, models: list,
+                   cancel_event: threading.Event, queue_key: str, tags: dict = None):
+    """Stream one prompt to several models at once, tagging every event with its model"""
+    def send(data: dict) -> bool:
+        data["id"] = request_id
+        if not ws.send_text(json_encoder.encode(data)):
+            cancel_event.set()  # Tab went away - stop every model
+            return False
+        return True
+    
+    @contextmanager
+    def slot(model):
+        # Each model takes its own upstream slot, so a comparison is scheduled like N chats
+        ticket = scheduler.acquire(queue_key, model_priority(model),
+                                   tuner.plan(model, estimate_tokens(message))["expected_completion_tokens"],
+                                   cancel_event.is_set)
+        try:
+            yield
+        finally:
+            scheduler.release(ticket)
+    
+    def on_event(kind, model, payload):
+        if kind == "delta":
+            send({"type": "compare_delta", "model": model, "text": payload})
+        else:
+            send({"type": "compare_done", "model": model,
+                  "result": {k: v for k, v in payload.items() if k != "text"}})
+    
+    print(f"Compare: {message}")
+    print(f"Models: {', '.join(models)} (streaming)")
+    send({"type": "compare_start", "models": models})
+    summary = compare_models(client, models, [{"role": "user", "content": message}], cost_tracker,
+                             max_tokens=MAX_TOKENS, on_event=on_event, cancel_event=cancel_event, slot=slot,
+                             tags=dict(tags or request_tags({}, queue_key, message), mode="compare"),
+                             budgets=budgets, session=anonymize(queue_key), estimator=estimator)
+    cost_info = dict(server_totals(), last_cost=summary["cost"], tokens=summary["tokens"])
+    print(f"Compare done in {summary['wall_s']:.2f}s (sequential ~{summary['sum_latency_s']:.2f}s) | "
+          f"Cost: ${summary['cost']:.6f}")
+    send({"type": "compare_end", "wall_s": summary["wall_s"], "sum_latency_s": summary["sum_latency_s"],
+          "cost_info": cost_info, "cancelled": cancel_event.is_set()})
+
+def current_metrics() -> dict:
+    """Session totals and model health, served by /metrics and pushed over WebSockets"""
+    totals = server_totals()
+    if cost_tracker.counters is not None:
+        totals["workers"] = cost_tracker.counters.workers()
+    totals["health"] = health_monitor.snapshot()
+    totals["scheduler"] = scheduler.stats()
+    totals["phases"] = phase_stats.snapshot()
+    totals["anomalies"] = cost_tracker.anomalies.snapshot()
+    totals["upstream"] = warmer.snapshot()
+    if tracer.enabled:
+        totals["tracing"] = tracer.snapshot()
+    if budgets.enabled:
+        totals["budgets"] = budgets.snapshot()
+    return totals
+
+def build_model_options() -> str:
+    """Render the model dropdown, skipping models verify_models.py found unavailable"""
+    cache = ModelCache()
+    options = []
+    for model in cache.filter_available(list(MODEL_PRICING.keys())):
+        info = MODEL_PRICING[model]
+        latency = cache.latency(model)
+        if latency is not None:
+            response_time = f"{latency:.2f}s (VERIFIED)"
+        else:
+            response_time = info["description"].split("(")[-1].rstrip(")")
+        options.append(f'                <option value="{model}">{info["name"].upper()} :: RESPONSE TIME: {response_time}</option>')
+    return "\n".join(options)
+
+def render_page() -> bytes:
+    """Build the HTML page once at startup with the current model list"""
+    return HTML_PAGE.replace("<!--MODEL_OPTIONS-->", build_model_options()).encode()
 
 # AI Chat Web Interface with embedded CSS
 HTML_PAGE = '''<!DOCTYPE html>
@@ -222,6 +578,39 @@ HTML_PAGE = '''<!DOCTYPE html>
             padding: 10px;
         }
         
+        .compare-panel {
+            margin-top: 10px;
+            font-size: 16px;
+            color: #00ff41;
+            letter-spacing: 1px;
+        }
+        
+        .compare-panel label { cursor: pointer; margin-right: 15px; white-space: nowrap; }
+        .compare-models { display: none; margin-top: 8px; }
+        .compare-models.active { display: block; }
+        
+        .compare-grid {
+            display: grid;
+            grid-template-columns: repeat(auto-fit, minmax(220px, 1fr));
+            gap: 12px;
+            margin-left: 25px;
+        }
+        
+        .compare-pane {
+            border: 1px solid rgba(0, 255, 65, 0.5);
+            padding: 8px 10px;
+            min-width: 0;
+        }
+        
+        .compare-pane .msg-content { margin-left: 0; }
+        
+        .compare-meta {
+            font-size: 14px;
+            opacity: 0.7;
+            margin-top: 8px;
+            letter-spacing: 1px;
+        }
+        
         .terminal {
             flex: 1;
             overflow-y: auto;
@@ -241,40 +630,35 @@ HTML_PAGE = '''<!DOCTYPE html>
             background: rgba(0, 255, 65, 0.8);
         }
         
+        /* Messages are virtualized: padding instead of margins keeps measured heights exact,
+           and no per-message animations or glows so long transcripts stay cheap to paint */
         .msg {
-            margin: 20px 0;
+            padding: 10px 0;
             font-family: 'VT323', monospace;
             font-size: 18px;
             line-height: 1.6;
-            opacity: 0;
-            animation: typeIn 0.5s ease forwards;
-        }
-        
-        @keyframes typeIn {
-            from { opacity: 0; transform: translateY(10px); }
-            to { opacity: 1; transform: translateY(0); }
+            text-shadow: none;
+            contain: content;
         }
         
         .msg.user-msg {
             color: #ffff00;
-            text-shadow: 0 0 4px #ffff00;
             margin-left: 40px;
         }
         
         .msg.ai-msg {
             color: #00ff41;
-            text-shadow: 0 0 4px #00ff41;
         }
         
         .msg.error-msg {
             color: #ff0000;
-            text-shadow: 0 0 4px #ff0000;
-            animation: errorFlash 0.5s ease;
         }
         
-        @keyframes errorFlash {
-            0%, 100% { opacity: 1; }
-            50% { opacity: 0.5; }
+        .history-status {
+            font-size: 14px;
+            text-align: center;
+            opacity: 0.6;
+            letter-spacing: 1px;
         }
         
         .msg-header {
@@ -406,7 +790,7 @@ HTML_PAGE = '''<!DOCTYPE html>
                 padding: 10px; 
             }
             .terminal { padding: 15px; }
-            .msg { font-size: 14px; margin: 10px 0; }
+            .msg { font-size: 14px; padding: 5px 0; }
             .input-panel { 
                 padding: 15px; 
                 gap: 10px;
@@ -428,7 +812,7 @@ HTML_PAGE = '''<!DOCTYPE html>
         
         <div class="header">
             <h1>AI Neural Interface</h1>
-            <div class="status-line">ARTIFICIAL INTELLIGENCE SYSTEM :: ONLINE</div>
+            <div class="status-line" id="status-line">ARTIFICIAL INTELLIGENCE SYSTEM :: ONLINE</div>
             
             <div class="metrics">
                 <div class="metric">
@@ -453,21 +837,19 @@ HTML_PAGE = '''<!DOCTYPE html>
         <div class="model-panel">
             <div class="model-label">NEURAL MODEL SELECTION</div>
             <select class="model-select" id="model-select">
-                <option value="vertex/gemini-2.0-flash-lite-001">GEMINI 2.0 FLASH LITE :: RESPONSE TIME: 0.51s</option>
-                <option value="vertex/gemini-2.5-flash-preview-05-20">GEMINI 2.5 FLASH PREVIEW :: RESPONSE TIME: 0.68s</option>
-                <option value="vertex/gemini-2.0-flash-001">GEMINI 2.0 FLASH :: RESPONSE TIME: 0.83s</option>
-                <option value="vertex/gemini-2.5-pro-preview-05-06">GEMINI 2.5 PRO PREVIEW :: RESPONSE TIME: 1.26s</option>
+<!--MODEL_OPTIONS-->
             </select>
+            <div class="compare-panel">
+                <label><input type="checkbox" id="compare-mode" onchange="toggleCompare()"> COMPARE MODELS SIDE BY SIDE</label>
+                <div class="compare-models" id="compare-models"></div>
+            </div>
         </div>
         
         <div class="terminal" id="terminal">
-            <div class="msg ai-msg">
-                <div class="msg-header">SYSTEM :: INITIALIZATION</div>
-                <div class="msg-content">ARTIFICIAL INTELLIGENCE SYSTEM ONLINE
-VERTEX AI NEURAL NETWORKS ACTIVE
-AWAITING USER INPUT<span class="cursor"></span></div>
-                <div class="timestamp">READY</div>
-            </div>
+            <div class="history-status" id="history-status"></div>
+            <div id="spacer-top"></div>
+            <div id="viewport"></div>
+            <div id="spacer-bottom"></div>
         </div>
         
         <div class="input-panel">
@@ -482,8 +864,151 @@ AWAITING USER INPUT<span class="cursor"></span></div>
     <script>
         let queryCount = 0;
         let sessionCost = 0;
+        
+        // Session id survives reloads in this tab so /history can restore the transcript
+        const sessionId = sessionStorage.getItem('chat-session') || (() => {
+            const id = Date.now().toString(36) + Math.random().toString(36).slice(2, 10);
+            sessionStorage.setItem('chat-session', id);
+            return id;
+        })();
+        
+        // Cost attribution tags from the page URL, e.g. ?tag.user=alice&tag.team=search
+        const requestTags = {};
+        new URLSearchParams(location.search).forEach((value, key) => {
+            if (key.startsWith('tag.')) requestTags[key.slice(4)] = value;
+        });
+        
+        // Virtualized transcript: every message is a record in `transcript`, but only the
+        // records near the viewport have DOM nodes. Beyond MAX_RETAINED records the far end
+        // is dropped and lazily reloaded from /history when scrolled back into view.
+        const MAX_RETAINED = 300;
+        const HISTORY_PAGE = 50;
+        const OVERSCAN_PX = 800;
+        const DEFAULT_HEIGHT = 90;
+        let transcript = [];
+        const mounted = new Set();
+        let olderOnServer = false;
+        let newerOnServer = false;
+        let loadingHistory = false;
+        let renderPending = false;
+        let stickToBottom = true;
+        
+        // One WebSocket per tab carries requests, streamed deltas, costs and cancels.
+        // If it can't connect, queries fall back to POST /chat.
+        let socket = null;
+        let socketReady = false;
+        let nextRequestId = 1;
+        let activeRequest = null;
+        
+        function connectSocket() {
+            if (!('WebSocket' in window)) return;
+            const scheme = location.protocol === 'https:' ? 'wss://' : 'ws://';
+            socket = new WebSocket(scheme + location.host + '/ws');
+            socket.onopen = () => { socketReady = true; };
+            socket.onclose = () => {
+                socketReady = false;
+                if (activeRequest) {
+                    addMessage('System Error', 'Link dropped during generation', 'error-msg');
+                    finishRequest();
+                }
+                setTimeout(connectSocket, 5000);
+            };
+            socket.onmessage = (event) => handleSocketMessage(JSON.parse(event.data));
+        }
+        
+        function handleSocketMessage(data) {
+            if (data.type === 'metrics') {
+                applyHealth(data.health);
+                return;
+            }
+            if (!activeRequest || data.id !== activeRequest.id) return;
+            
+            if (data.type === 'compare_start') {
+                activeRequest.record = addCompare(data.models);
+            } else if (data.type === 'compare_delta') {
+                appendToPane(activeRequest.record, data.model, data.text);
+            } else if (data.type === 'compare_done') {
+                setPaneMeta(activeRequest.record, data.model, describeResult(data.result));
+            } else if (data.type === 'compare_end') {
+                const record = activeRequest.record;
+                record.time = 'WALL ' + data.wall_s.toFixed(2) + 'S :: SEQUENTIAL ~' + data.sum_latency_s.toFixed(2) +
+                    'S :: TOTAL $' + data.cost_info.last_cost.toFixed(6) + (data.cancelled ? ' :: CANCELLED' : '');
+                if (record.timeEl) record.timeEl.textContent = record.time;
+                updateMetrics(data.cost_info);
+                finishRequest();
+            } else if (data.type === 'start') {
+                if (data.model !== data.requested_model) {
+                    addMessage('System', 'MODEL ' + data.requested_model + ' UNAVAILABLE :: REROUTED TO ' + data.model, 'error-msg');
+                }
+                activeRequest.record = addMessage('Neural Network', '', 'ai-msg', data.model);
+            } else if (data.type === 'delta') {
+                appendToMessage(activeRequest.record, data.text);
+            } else if (data.type === 'done' || data.type === 'cancelled') {
+                activeRequest.userRecord.seq = data.user_seq;
+                activeRequest.record.seq = data.seq;
+                if (data.type === 'cancelled') {
+                    addMessage('System', 'GENERATION CANCELLED', 'error-msg');
+                }
+                updateMetrics(data.cost_info);
+                finishRequest();
+            } else if (data.type === 'error') {
+                if (data.user_seq) activeRequest.userRecord.seq = data.user_seq;
+                if (activeRequest.record) activeRequest.record.seq = data.seq;
+                addMessage('System Error', data.error, 'error-msg');
+                if (data.cost_info) updateMetrics(data.cost_info);
+                finishRequest();
+            }
+        }
+        
+        function cancelQuery() {
+            if (activeRequest && socketReady) {
+                socket.send(JSON.stringify({ type: 'cancel', id: activeRequest.id }));
+                document.getElementById('execute-btn').disabled = true;
+            }
+        }
+        
+        function finishRequest() {
+            const input = document.getElementById('neural-input');
+            const executeBtn = document.getElementById('execute-btn');
+            activeRequest = null;
+            input.disabled = false;
+            executeBtn.disabled = false;
+            executeBtn.textContent = 'Execute';
+            input.focus();
+            scrollToBottom();
+        }
 
+        function toggleCompare() {
+            const enabled = document.getElementById('compare-mode').checked;
+            const box = document.getElementById('compare-models');
+            if (enabled && !box.childElementCount) {
+                // One checkbox per dropdown entry; the first four start selected
+                let index = 0;
+                for (const option of document.getElementById('model-select').options) {
+                    const label = document.createElement('label');
+                    const checkbox = document.createElement('input');
+                    checkbox.type = 'checkbox';
+                    checkbox.value = option.value;
+                    checkbox.checked = index++ < 4;
+                    label.append(checkbox, ' ' + option.textContent.split(' :: ')[0]);
+                    box.appendChild(label);
+                }
+            }
+            box.classList.toggle('active', enabled);
+            document.getElementById('model-select').disabled = enabled;
+        }
+        
+        function compareModels() {
+            if (!document.getElementById('compare-mode').checked) return null;
+            return Array.from(document.querySelectorAll('#compare-models input:checked')).map(c => c.value).slice(0, 4);
+        }
+        
         async function executeQuery() {
+            if (activeRequest) {
+                cancelQuery();
+                return;
+            }
+            
             const input = document.getElementById('neural-input');
             const executeBtn = document.getElementById('execute-btn');
             const modelSelect = document.getElementById('model-select');
@@ -491,29 +1016,75 @@ AWAITING USER INPUT<span class="cursor"></span></div>
             const query = input.value.trim();
             if (!query) return;
             
+            const models = compareModels();
+            if (models && (!models.length || !socketReady)) {
+                addMessage('System Error', models.length ? 'COMPARE MODE NEEDS A LIVE LINK :: RETRY SHORTLY' : 'SELECT AT LEAST ONE MODEL TO COMPARE', 'error-msg');
+                scrollToBottom();
+                return;
+            }
+            
             input.disabled = true;
             executeBtn.disabled = true;
             executeBtn.textContent = 'Processing...';
             
-            addMessage('User', query, 'user-msg');
+            // New messages belong after the newest ones, not after an old page we scrolled to
+            if (newerOnServer) await reloadLatest();
+            
+            const userRecord = addMessage('User', query, 'user-msg');
             input.value = '';
             
             scrollToBottom();
             
+            if (models) {
+                activeRequest = { id: String(nextRequestId++), userRecord: userRecord, record: null };
+                executeBtn.disabled = false;
+                executeBtn.textContent = 'Cancel';
+                socket.send(JSON.stringify({
+                    type: 'compare',
+                    id: activeRequest.id,
+                    message: query,
+                    models: models,
+                    session: sessionId,
+                    tags: requestTags
+                }));
+                return;
+            }
+            
+            if (socketReady) {
+                activeRequest = { id: String(nextRequestId++), userRecord: userRecord, record: null };
+                executeBtn.disabled = false;
+                executeBtn.textContent = 'Cancel';
+                socket.send(JSON.stringify({
+                    type: 'chat',
+                    id: activeRequest.id,
+                    message: query,
+                    model: modelSelect.value,
+                    session: sessionId,
+                    tags: requestTags
+                }));
+                return;
+            }
+            
             try {
                 const response = await fetch('/chat', {
                     method: 'POST',
                     headers: { 'Content-Type': 'application/json' },
                     body: JSON.stringify({
                         message: query,
-                        model: modelSelect.value
+                        model: modelSelect.value,
+                        session: sessionId,
+                        tags: requestTags
                     })
                 });
                 
                 const data = await response.json();
                 
                 if (data.success) {
-                    addMessage('Neural Network', data.response, 'ai-msg', data.model);
+                    userRecord.seq = data.user_seq;
+                    if (data.failover) {
+                        addMessage('System', 'MODEL ' + data.requested_model + ' UNAVAILABLE :: REROUTED TO ' + data.model, 'error-msg');
+                    }
+                    addMessage('Neural Network', data.response, 'ai-msg', data.model).seq = data.seq;
                     updateMetrics(data.cost_info);
                 } else {
                     addMessage('System Error', data.error, 'error-msg');
@@ -530,21 +1101,324 @@ AWAITING USER INPUT<span class="cursor"></span></div>
             }
         }
         
+        function makeRecord(sender, text, className, model, time, seq) {
+            return {
+                sender: sender,
+                text: text,
+                className: className,
+                model: model || '',
+                time: time || new Date().toLocaleTimeString(),
+                seq: seq === undefined ? null : seq,
+                height: DEFAULT_HEIGHT,
+                node: null,
+                contentEl: null,
+                timeEl: null
+            };
+        }
+        
+        function shortModel(model) {
+            return model.replace('vertex/gemini-', '').toUpperCase();
+        }
+        
+        function describeResult(result) {
+            if (result.error) return 'ERROR :: ' + result.error;
+            const parts = [];
+            if (result.ttft_s !== null) parts.push('TTFT ' + result.ttft_s.toFixed(2) + 'S');
+            parts.push('LATENCY ' + result.latency_s.toFixed(2) + 'S');
+            parts.push(result.prompt_tokens + '+' + result.completion_tokens + (result.estimated ? ' EST' : '') + ' TOKENS');
+            parts.push('$' + result.cost.toFixed(6));
+            if (result.cancelled) parts.push('CANCELLED');
+            else if (result.finish_reason === 'length') parts.push('TRUNCATED');
+            for (const alert of result.anomalies || []) parts.push('ANOMALY ' + alert.metric.toUpperCase() + ' ' + alert.ratio.toFixed(1) + 'X');
+            return parts.join(' :: ');
+        }
+        
+        function addCompare(models) {
+            // One record holding a pane per model; panes fill in as their streams arrive
+            const record = makeRecord('Neural Network', '', 'ai-msg', 'COMPARE :: ' + models.length + ' MODELS');
+            record.panes = models.map(model => ({ model: model, text: '', meta: 'STREAMING...', contentEl: null, metaEl: null }));
+            record.time = 'STREAMING...';
+            transcript.push(record);
+            trimOldest();
+            scheduleRender();
+            return record;
+        }
+        
+        function findPane(record, model) {
+            return record && record.panes ? record.panes.find(p => p.model === model) : null;
+        }
+        
+        function appendToPane(record, model, text) {
+            const pane = findPane(record, model);
+            if (!pane) return;
+            pane.text += text;
+            if (pane.contentEl) pane.contentEl.appendChild(document.createTextNode(text));
+            scheduleRender();
+        }
+        
+        function setPaneMeta(record, model, meta) {
+            const pane = findPane(record, model);
+            if (!pane) return;
+            pane.meta = meta;
+            if (pane.metaEl) pane.metaEl.textContent = meta;
+            scheduleRender();
+        }
+        
+        function buildPanes(record) {
+            const grid = document.createElement('div');
+            grid.className = 'compare-grid';
+            for (const pane of record.panes) {
+                const box = document.createElement('div');
+                box.className = 'compare-pane';
+                const header = document.createElement('div');
+                header.className = 'msg-header';
+                header.textContent = shortModel(pane.model);
+                const content = document.createElement('div');
+                content.className = 'msg-content';
+                content.appendChild(document.createTextNode(pane.text));
+                const meta = document.createElement('div');
+                meta.className = 'compare-meta';
+                meta.textContent = pane.meta;
+                box.append(header, content, meta);
+                pane.contentEl = content;
+                pane.metaEl = meta;
+                grid.appendChild(box);
+            }
+            return grid;
+        }
+        
+        function recordFromServer(m) {
+            const user = m.role === 'user';
+            return makeRecord(user ? 'User' : 'Neural Network', m.text, user ? 'user-msg' : 'ai-msg',
+                              m.model, new Date(m.time * 1000).toLocaleTimeString(), m.seq);
+        }
+        
+        function buildNode(record) {
+            // DOM built with textContent only - message text is never parsed as HTML
+            const msgDiv = document.createElement('div');
+            msgDiv.className = 'msg ' + record.className;
+            
+            const header = document.createElement('div');
+            header.className = 'msg-header';
+            header.textContent = record.sender + (record.model ? ' :: ' + shortModel(record.model) : '');
+            
+            const content = record.panes ? buildPanes(record) : document.createElement('div');
+            if (!record.panes) {
+                content.className = 'msg-content';
+                content.appendChild(document.createTextNode(record.text));
+            }
+            if (record.cursor) {
+                const cursor = document.createElement('span');
+                cursor.className = 'cursor';
+                content.appendChild(cursor);
+            }
+            
+            const timestamp = document.createElement('div');
+            timestamp.className = 'timestamp';
+            timestamp.textContent = record.time;
+            
+            msgDiv.append(header, content, timestamp);
+            record.node = msgDiv;
+            record.contentEl = content;
+            record.timeEl = timestamp;
+            return msgDiv;
+        }
+        
+        function unmount(record) {
+            if (record.node) record.node.remove();
+            record.node = null;
+            record.contentEl = null;
+            record.timeEl = null;
+            if (record.panes) {
+                for (const pane of record.panes) { pane.contentEl = null; pane.metaEl = null; }
+            }
+            mounted.delete(record);
+        }
+        
         function addMessage(sender, message, className, model = '') {
+            const record = makeRecord(sender, message, className, model);
+            transcript.push(record);
+            trimOldest();
+            scheduleRender();
+            return record;
+        }
+        
+        function appendToMessage(record, text) {
+            record.text += text;
+            // Streaming appends a text node - no reparse of what is already on screen
+            if (record.contentEl) record.contentEl.appendChild(document.createTextNode(text));
+            scheduleRender();
+        }
+        
+        function isPinned(record) {
+            return activeRequest && (record === activeRequest.record || record === activeRequest.userRecord);
+        }
+        
+        function trimOldest() {
             const terminal = document.getElementById('terminal');
-            const msgDiv = document.createElement('div');
-            msgDiv.className = `msg ${className}`;
+            let removedHeight = 0;
+            while (transcript.length > MAX_RETAINED && !isPinned(transcript[0])) {
+                const record = transcript.shift();
+                removedHeight += record.height;
+                unmount(record);
+                olderOnServer = true;
+            }
+            if (removedHeight && !stickToBottom) terminal.scrollTop -= removedHeight;
+        }
+        
+        function trimNewest() {
+            while (transcript.length > MAX_RETAINED && !isPinned(transcript[transcript.length - 1])) {
+                unmount(transcript.pop());
+                newerOnServer = true;
+            }
+        }
+        
+        function scheduleRender() {
+            if (renderPending) return;
+            renderPending = true;
+            requestAnimationFrame(render);
+        }
+        
+        function render() {
+            renderPending = false;
+            const terminal = document.getElementById('terminal');
+            const viewport = document.getElementById('viewport');
+            let total = 0;
+            for (const record of transcript) total += record.height;
+            // While following the conversation the viewport is the bottom of the transcript
+            const scrollTop = stickToBottom ? Math.max(0, total - terminal.clientHeight) : terminal.scrollTop;
+            const viewTop = scrollTop - OVERSCAN_PX;
+            const viewBottom = scrollTop + terminal.clientHeight + OVERSCAN_PX;
+            
+            // Find the records overlapping the viewport (plus overscan)
+            let offset = 0, first = -1, last = -1, topPad = 0;
+            for (let i = 0; i < transcript.length; i++) {
+                const height = transcript[i].height;
+                if (offset + height >= viewTop && offset <= viewBottom) {
+                    if (first < 0) { first = i; topPad = offset; }
+                    last = i;
+                }
+                offset += height;
+            }
+            
+            const visible = new Set(first < 0 ? [] : transcript.slice(first, last + 1));
+            for (const record of Array.from(mounted)) {
+                if (!visible.has(record)) unmount(record);
+            }
+            let previous = null;
+            for (const record of visible) {
+                const node = record.node || buildNode(record);
+                const expected = previous ? previous.nextSibling : viewport.firstChild;
+                if (node !== expected) viewport.insertBefore(node, expected);
+                mounted.add(record);
+                previous = node;
+            }
             
-            const timestamp = new Date().toLocaleTimeString();
-            const modelInfo = model ? ` :: ${model.replace('vertex/gemini-', '').toUpperCase()}` : '';
+            // Measure what we mounted and size the spacers around it
+            let bottomPad = 0;
+            for (const record of visible) record.height = record.node.offsetHeight || DEFAULT_HEIGHT;
+            for (let i = last + 1; i < transcript.length; i++) bottomPad += transcript[i].height;
+            document.getElementById('spacer-top').style.height = topPad + 'px';
+            document.getElementById('spacer-bottom').style.height = bottomPad + 'px';
             
-            msgDiv.innerHTML = `
-                <div class="msg-header">${sender}${modelInfo}</div>
-                <div class="msg-content">${message.replace(/\\n/g, '<br>')}</div>
-                <div class="timestamp">${timestamp}</div>
-            `;
+            document.getElementById('history-status').textContent =
+                loadingHistory ? 'LOADING ARCHIVE...' : (olderOnServer ? 'SCROLL UP FOR ARCHIVED MESSAGES' : '');
             
-            terminal.appendChild(msgDiv);
+            if (stickToBottom) terminal.scrollTop = terminal.scrollHeight;
+        }
+        
+        async function fetchHistory(params) {
+            const response = await fetch('/history?session=' + encodeURIComponent(sessionId) + '&limit=' + HISTORY_PAGE + params);
+            return response.json();
+        }
+        
+        function firstSeq() {
+            const record = transcript.find(r => r.seq !== null);
+            return record ? record.seq : null;
+        }
+        
+        function lastSeq() {
+            for (let i = transcript.length - 1; i >= 0; i--) {
+                if (transcript[i].seq !== null) return transcript[i].seq;
+            }
+            return null;
+        }
+        
+        async function loadOlder() {
+            const before = firstSeq();
+            if (loadingHistory || before === null) return;
+            loadingHistory = true;
+            try {
+                const data = await fetchHistory('&before=' + before);
+                const records = data.messages.map(recordFromServer);
+                olderOnServer = data.has_more;
+                transcript = records.concat(transcript);
+                trimNewest();
+                // Keep the messages on screen where they were
+                document.getElementById('terminal').scrollTop += records.length * DEFAULT_HEIGHT;
+            } catch (error) {
+                olderOnServer = false;
+            } finally {
+                loadingHistory = false;
+                scheduleRender();
+            }
+        }
+        
+        async function loadNewer() {
+            const after = lastSeq();
+            if (loadingHistory || after === null) return;
+            loadingHistory = true;
+            try {
+                const data = await fetchHistory('&after=' + after);
+                newerOnServer = data.has_more;
+                transcript = transcript.concat(data.messages.map(recordFromServer));
+                trimOldest();
+            } catch (error) {
+                newerOnServer = false;
+            } finally {
+                loadingHistory = false;
+                scheduleRender();
+            }
+        }
+        
+        async function reloadLatest() {
+            for (const record of Array.from(mounted)) unmount(record);
+            try {
+                const data = await fetchHistory('');
+                transcript = data.messages.map(recordFromServer);
+                olderOnServer = data.has_more;
+            } catch (error) {
+                transcript = [];
+            }
+            newerOnServer = false;
+            stickToBottom = true;
+            scheduleRender();
+        }
+        
+        function onTerminalScroll() {
+            const terminal = document.getElementById('terminal');
+            const fromBottom = terminal.scrollHeight - terminal.scrollTop - terminal.clientHeight;
+            stickToBottom = fromBottom < 40 && !newerOnServer;
+            if (terminal.scrollTop < 300 && olderOnServer) loadOlder();
+            if (fromBottom < 300 && newerOnServer) loadNewer();
+            scheduleRender();
+        }
+        
+        async function initTranscript() {
+            const intro = makeRecord('SYSTEM :: INITIALIZATION',
+                ['ARTIFICIAL INTELLIGENCE SYSTEM ONLINE', 'VERTEX AI NEURAL NETWORKS ACTIVE', 'AWAITING USER INPUT'].join(String.fromCharCode(10)),
+                'ai-msg', '', 'READY');
+            intro.cursor = true;
+            transcript.push(intro);
+            document.getElementById('terminal').addEventListener('scroll', onTerminalScroll, { passive: true });
+            scheduleRender();
+            // Restore this tab's conversation after a reload
+            try {
+                const data = await fetchHistory('');
+                transcript = transcript.concat(data.messages.map(recordFromServer));
+                olderOnServer = data.has_more;
+                scheduleRender();
+            } catch (error) {}
         }
         
         function updateMetrics(costInfo) {
@@ -565,20 +1439,58 @@ AWAITING USER INPUT<span class="cursor"></span></div>
                 sessionEl.classList.add('warning');
             }
             
-            if (costInfo.last_cost > 0.002) {
-                lastEl.classList.add('danger');
-            } else if (costInfo.last_cost > 0.001) {
-                lastEl.classList.add('warning');
+            // Flagged when unusual for the model rather than above a fixed amount
+            if (costInfo.anomalies) {
+                for (const alert of costInfo.anomalies) {
+                    addMessage('System', 'ANOMALY :: ' + alert.message.toUpperCase(), 'error-msg');
+                }
+                lastEl.classList.add(costInfo.anomalies.some(alert => alert.metric === 'cost') ? 'danger' : 'warning');
+            }
+        }
+        
+        async function refreshHealth() {
+            try {
+                const response = await fetch('/health');
+                const data = await response.json();
+                applyHealth(data.models);
+            } catch (error) {
+                document.getElementById('status-line').textContent = 'ARTIFICIAL INTELLIGENCE SYSTEM :: LINK LOST';
             }
         }
         
+        function applyHealth(models) {
+            const down = [];
+            for (const option of document.getElementById('model-select').options) {
+                const health = models[option.value];
+                const label = option.textContent.replace(/ \\[(DOWN|DEGRADED)\\]$/, '');
+                const status = health ? health.status : 'unknown';
+                if (status === 'down' || status === 'degraded') {
+                    option.textContent = label + ' [' + status.toUpperCase() + ']';
+                    if (status === 'down') down.push(label.split(' :: ')[0]);
+                } else {
+                    option.textContent = label;
+                }
+            }
+            const statusLine = document.getElementById('status-line');
+            statusLine.textContent = down.length
+                ? 'ARTIFICIAL INTELLIGENCE SYSTEM :: DEGRADED :: OFFLINE: ' + down.join(', ')
+                : 'ARTIFICIAL INTELLIGENCE SYSTEM :: ONLINE';
+            statusLine.classList.toggle('warning', down.length > 0);
+        }
+        
         function scrollToBottom() {
-            const terminal = document.getElementById('terminal');
-            setTimeout(() => {
-                terminal.scrollTop = terminal.scrollHeight;
-            }, 100);
+            stickToBottom = true;
+            scheduleRender();
         }
         
+        initTranscript();
+        connectSocket();
+        refreshHealth();
+        // Health arrives over the WebSocket when connected; poll only as a fallback
+        setInterval(() => { if (!socketReady) refreshHealth(); }, 15000);
+        // Keep the WebSocket from hitting the server's idle timeout
+        setInterval(() => { if (socketReady) socket.send('{"type":"ping"}'); }, 30000);
+        
         if (window.innerWidth > 768) {
             document.getElementById('neural-input').focus();
         }
@@ -586,92 +1498,386 @@ AWAITING USER INPUT<span class="cursor"></span></div>
 </body>
 </html>'''
 
+PAGE_BYTES = render_page()
+PAGE_GZIP = gzip.compress(PAGE_BYTES, compresslevel=9)  # Compressed once, served many times
+
+# Response encoding - compact separators and no circular check keep the hot path lean
+json_encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), check_circular=False)
+GZIP_MIN_SIZE = 1024  # Smaller bodies aren't worth the CPU
+GZIP_LEVEL = 5
+
+# WebSocket transport
+WS_IDLE_TIMEOUT = 90       # Seconds without any client frame before the socket is dropped
+WS_METRICS_INTERVAL = 15   # Seconds between pushed metrics/health updates
+
 class ChatHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps the browser's connection open between /chat requests
+    protocol_version = "HTTP/1.1"
+    timeout = 60  # Close idle keep-alive connections
+    
+    def setup(self):
+        super().setup()
+        # Headers and body go out in separate writes - don't let Nagle hold the body back
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    
     def do_GET(self):
-        if self.path == '/' or self.path == '/chat.html':
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html')
-            self.send_header('Cache-Control', 'no-cache, no-store, must-revalidate')
-            self.send_header('Pragma', 'no-cache')
-            self.send_header('Expires', '0')
-            self.end_headers()
-            self.wfile.write(HTML_PAGE.encode())
+        url = urllib.parse.urlsplit(self.path)
+        if url.path == '/' or url.path == '/chat.html':
+            self.send_body(PAGE_BYTES, 'text/html; charset=utf-8', gzipped=PAGE_GZIP, headers={
+                'Cache-Control': 'no-cache, no-store, must-revalidate',
+                'Pragma': 'no-cache',
+                'Expires': '0'
+            })
+        elif url.path == '/ws':
+            self.handle_websocket()
+        elif url.path == '/history':
+            self.send_history(urllib.parse.parse_qs(url.query))
+        elif url.path == '/health':
+            self.send_json({"models": health_monitor.snapshot()})
+        elif url.path == '/metrics':
+            self.send_json(current_metrics())
+        elif url.path == '/attribution':
+            self.send_attribution(urllib.parse.parse_qs(url.query))
         else:
-            self.send_response(404)
-            self.end_headers()
+            self.send_body(b'', 'text/plain', status=404)
+    
+    def send_history(self, query: dict):
+        """Page of a session's transcript: ?session=ID[&before=SEQ|&after=SEQ][&limit=N]"""
+        def int_param(name, default=None):
+            try:
+                return int(query[name][0])
+            except (KeyError, ValueError):
+                return default
+        
+        session = session_id({"session": query.get('session', [None])[0]})
+        if not session:
+            self.send_json({"success": False, "error": "Missing session"}, status=400)
+            return
+        page = transcripts.page(session, before=int_param('before'), after=int_param('after'),
+                                limit=max(1, min(200, int_param('limit', 50))))
+        self.send_json(dict(page, success=True))
+    
+    def send_attribution(self, query: dict):
+        """Top spenders per tag: ?top=N, or ?snapshot=1 for a mergeable sketch snapshot"""
+        if query.get('snapshot', ['0'])[0] == '1':
+            self.send_json(attribution.to_dict())
+            return
+        try:
+            top = max(1, min(attribution.capacity, int(query.get('top', ['10'])[0])))
+        except ValueError:
+            top = 10
+        self.send_json({"dimensions": attribution.report(top), "dropped": attribution.dropped})
+    
+    def handle_websocket(self):
+        """Upgrade to a WebSocket and serve chat requests until the tab closes"""
+        key = self.headers.get('Sec-WebSocket-Key')
+        if 'websocket' not in self.headers.get('Upgrade', '').lower() or not key:
+            self.send_body(b'Expected a WebSocket upgrade', 'text/plain', status=400)
+            return
+        
+        self.send_response(101)
+        self.send_header('Upgrade', 'websocket')
+        self.send_header('Connection', 'Upgrade')
+        self.send_header('Sec-WebSocket-Accept', accept_key(key))
+        self.end_headers()
+        self.close_connection = True
+        self.connection.settimeout(WS_IDLE_TIMEOUT)  # The page pings every 30s
+        
+        ws = WebSocketConnection(self.rfile, self.wfile)
+        active = {}  # request id -> cancel event
+        
+        def push_metrics():
+            while not ws.closed:
+                if not ws.send_text(json_encoder.encode(dict(current_metrics(), type="metrics"))):
+                    break
+                time.sleep(WS_METRICS_INTERVAL)
+        
+        def run_stream(request_id, message, model, cancel_event, session, data):
+            queue_key = self.client_address[0]
+            try:
+                with drain.request(), tracer.trace("websocket chat", attributes={"gen_ai.request.model": model}):
+                    stream_chat(ws, request_id, message, model, cancel_event, session, queue_key=queue_key,
+                                tags=request_tags(data, queue_key, message))
+            except Exception as e:
+                print(f"Error: {e}")
+                ws.send_text(json_encoder.encode({"type": "error", "id": request_id,
+                                                  "error": "Internal error while processing the request"}))
+            finally:
+                active.pop(request_id, None)
+        
+        def run_compare(request_id, message, models, cancel_event, session, data):
+            queue_key = self.client_address[0]
+            try:
+                with drain.request(), tracer.trace("websocket compare", attributes={"goop.models": models}):
+                    stream_compare(ws, request_id, message, models, cancel_event, queue_key,
+                                   tags=request_tags(data, queue_key, message))
+            except Exception as e:
+                print(f"Error: {e}")
+                ws.send_text(json_encoder.encode({"type": "error", "id": request_id,
+                                                  "error": "Internal error while processing the request"}))
+            finally:
+                active.pop(request_id, None)
+        
+        threading.Thread(target=push_metrics, daemon=True).start()
+        while True:
+            text = ws.recv()
+            if text is None:
+                break
+            try:
+                data = json.loads(text)
+            except ValueError:
+                continue
+            kind = data.get('type')
+            if kind == 'chat' and isinstance(data.get('message'), str) and isinstance(data.get('model'), str):
+                cancel_event = threading.Event()
+                active[data.get('id')] = cancel_event
+                threading.Thread(target=run_stream, daemon=True,
+                                 args=(data.get('id'), data['message'], data['model'], cancel_event,
+                                       session_id(data), data)).start()
+            elif kind == 'compare' and isinstance(data.get('message'), str) and isinstance(data.get('models'), list):
+                models = [m for m in data['models'] if isinstance(m, str) and m in MODEL_PRICING]
+                models = list(dict.fromkeys(models))[:MAX_COMPARE_MODELS]
+                if not models:
+                    ws.send_text(json_encoder.encode({"type": "error", "id": data.get('id'),
+                                                      "error": "No known models selected"}))
+                    continue
+                cancel_event = threading.Event()
+                active[data.get('id')] = cancel_event
+                threading.Thread(target=run_compare, daemon=True,
+                                 args=(data.get('id'), data['message'], models, cancel_event,
+                                       session_id(data), data)).start()
+            elif kind == 'cancel' and data.get('id') in active:
+                active[data['id']].set()
+        
+        # Tab closed - stop anything still generating so it stops costing money
+        for cancel_event in list(active.values()):
+            cancel_event.set()
+        ws.close()
+    
+    def send_body(self, body: bytes, content_type: str, status: int = 200,
+                  headers: dict = None, gzipped: bytes = None, timer: PhaseTimer = None):
+        """Send a complete response with Content-Length, gzip-compressed when worthwhile"""
+        compressible = len(body) >= GZIP_MIN_SIZE
+        use_gzip = compressible and 'gzip' in self.headers.get('Accept-Encoding', '')
+        if use_gzip:
+            with timer.phase("encode") if timer else nullcontext():
+                body = gzipped if gzipped is not None else gzip.compress(body, compresslevel=GZIP_LEVEL)
+        
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if compressible:
+            self.send_header('Vary', 'Accept-Encoding')
+        if use_gzip:
+            self.send_header('Content-Encoding', 'gzip')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if timer is not None and timer.enabled:
+            self.send_header('Server-Timing', timer.server_timing())
+        span = current_span()
+        if span.trace_id:
+            span.set({"http.response.status_code": status})
+            self.send_header('X-Trace-Id', span.trace_id)
+        self.end_headers()
+        with timer.phase("write") if timer else nullcontext():
+            self.wfile.write(body)
+    
+    def send_json(self, data: dict, status: int = 200, headers: dict = None, timer: PhaseTimer = None):
+        with timer.phase("encode") if timer else nullcontext():
+            body = json_encoder.encode(data).encode('utf-8')
+        self.send_body(body, 'application/json', status=status, timer=timer,
+                       headers=dict(headers or {}, **{'Access-Control-Allow-Origin': '*'}))
+    
+    def read_body(self) -> bytes:
+        """Read the full request body (Content-Length or chunked) so keep-alive stays in sync"""
+        if 'chunked' in self.headers.get('Transfer-Encoding', '').lower():
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b';', 1)[0].strip(), 16)
+                if size == 0:
+                    # Skip optional trailers up to the terminating blank line
+                    while self.rfile.readline() not in (b'\r\n', b'\n', b''):
+                        pass
+                    return b''.join(chunks)
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
     
     def do_POST(self):
+        # A stopping worker finishes these before it exits; a caller's traceparent header joins its trace
+        with drain.request(), tracer.trace(f"POST {self.path}", self.headers.get('traceparent'),
+                                           attributes={"http.request.method": "POST", "url.path": self.path}):
+            self.handle_post()
+    
+    def handle_post(self):
         if self.path == '/chat':
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
+            started = time.time()
+            timer = PhaseTimer()
+            requested_model = None
+            try:
+                with timer.phase("parse"):
+                    post_data = self.read_body()
+            except ValueError:
+                self.close_connection = True
+                self.send_json({"success": False, "error": "Malformed request body"}, status=400)
+                return
             
             try:
-                data = json.loads(post_data.decode('utf-8'))
-                message = data['message']
-                model = data['model']
+                with timer.phase("parse"):
+                    data = json.loads(post_data.decode('utf-8'))
+                    message = data['message']
+                    model = data['model']
                 
                 print(f"User: {message}")
                 print(f"Using model: {model}")
                 
-                response = client.chat.completions.create(
-                    model=model,
-                    messages=[{"role": "user", "content": message}],
-                    max_tokens=500,
-                    temperature=0.7
-                )
+                session = session_id(data)
+                requested_model = model
+                # Fairness and budgets follow the client address - session ids are the client's choice
+                queue_key = self.client_address[0]
+                prompt_estimate = estimator.estimate(requested_model, [{"role": "user", "content": message}])
+                plan = tuner.plan(requested_model, prompt_estimate, session)
+                hold = reserve_budget(requested_model, queue_key, prompt_estimate, plan)
+                try:
+                    with timer.phase("queue"):
+                        ticket = scheduler.acquire(queue_key, model_priority(requested_model),
+                                                   plan["expected_completion_tokens"])
+                    try:
+                        with timer.phase("upstream"):
+                            response, model = complete_with_failover(requested_model,
+                                                                     [{"role": "user", "content": message}],
+                                                                     max_tokens=plan["max_tokens"], hold=hold)
+                    finally:
+                        scheduler.release(ticket)
+                except BaseException:
+                    budgets.release(hold)
+                    raise
+                if model != requested_model:
+                    print(f"Failed over: {requested_model} -> {model}")
                 
                 ai_message = response.choices[0].message.content
+                finish_reason = response.choices[0].finish_reason
                 usage = response.usage
-                
-                global session_cost, message_count
-                message_cost = calculate_cost(model, usage.prompt_tokens, usage.completion_tokens)
-                session_cost += message_cost
-                message_count += 1
-                avg_cost = session_cost / message_count if message_count > 0 else 0
+                with timer.phase("cost"):
+                    cost_info = record_cost(model, usage.prompt_tokens, usage.completion_tokens,
+                                            latency=upstream_seconds(timer.as_dict()))
+                    budgets.settle(hold, cost_info["last_cost"])
+                    estimator.observe(requested_model, prompt_estimate, usage.prompt_tokens)
                 
                 print(f"AI: {ai_message}")
-                print(f"Cost: ${message_cost:.6f} | Session: ${session_cost:.6f} | Tokens: {usage.total_tokens}")
-                
-                self.send_response(200)
-                self.send_header('Content-type', 'application/json')
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.end_headers()
+                print(f"Cost: ${cost_info['last_cost']:.6f} | Session: ${cost_info['session_cost']:.6f} | Tokens: {usage.total_tokens}")
+                user_seq = transcripts.append(session, "user", message) if session else None
+                seq = transcripts.append(session, "assistant", ai_message, model) if session else None
                 
                 response_data = {
                     "success": True,
                     "response": ai_message,
                     "model": model,
-                    "cost_info": {
-                        "last_cost": message_cost,
-                        "session_cost": session_cost,
-                        "message_count": message_count,
-                        "avg_cost": avg_cost,
-                        "tokens": usage.total_tokens
-                    }
+                    "requested_model": requested_model,
+                    "failover": model != requested_model,
+                    "cost_info": cost_info,
+                    "estimate": plan,
+                    "truncated": finish_reason == "length",
+                    "user_seq": user_seq,
+                    "seq": seq
                 }
-                self.wfile.write(json.dumps(response_data).encode())
+                trace_usage(model, usage.prompt_tokens, usage.completion_tokens, cost_info["last_cost"],
+                            finish_reason, session=anonymize(queue_key), requested_model=requested_model)
+                self.send_json(response_data, timer=timer)
+                
+                # Logged after the response is out so the record carries every phase
+                timings = timer.as_dict()
+                with tracer.span("log"):
+                    cost_tracker.log_usage(model, usage.prompt_tokens, usage.completion_tokens,
+                                           cost_info["last_cost"], timings, max_tokens=plan["max_tokens"],
+                                           finish_reason=finish_reason, max_tokens_tuned=plan["tuned"],
+                                           session=anonymize(queue_key), tags=request_tags(data, queue_key, message))
+                phase_stats.add(timer)
+                upstream_ms = timings.get("upstream")
+                tuner.observe(model, usage.completion_tokens, finish_reason, plan["max_tokens"], plan["tuned"],
+                              session, latency=upstream_ms / 1000 if upstream_ms else None)
+                capture(started, src="web", status="ok", sess=anonymize(queue_key), model=model,
+                        req_model=requested_model, prompt_chars=len(message), prompt_tokens=usage.prompt_tokens,
+                        completion_tokens=usage.completion_tokens, max_tokens=plan["max_tokens"],
+                        latency_ms=round((time.time() - started) * 1000, 3),
+                        upstream_ms=upstream_ms, cost=cost_info["last_cost"])
                 
+            except BudgetExceeded as e:
+                # Rejected before the upstream call - nothing was spent
+                self.send_json({"success": False, "error": str(e), "budget": e.scope}, status=402, timer=timer)
+                capture(started, src="web", status="rejected", req_model=requested_model,
+                        latency_ms=round((time.time() - started) * 1000, 3))
+            except QueueFull as e:
+                # Fast rejection - the client can retry instead of waiting behind a full queue
+                self.send_json({"success": False, "error": str(e)}, status=429,
+                               headers={'Retry-After': str(e.retry_after)}, timer=timer)
+                capture(started, src="web", status="rejected", req_model=requested_model,
+                        latency_ms=round((time.time() - started) * 1000, 3))
+            except APIStatusError as e:
+                # The upstream refused this request itself (not an outage) - pass its status on
+                print(f"Rejected upstream: {e}")
+                current_span().fail(e)
+                status = e.status_code if 400 <= e.status_code < 500 else 502
+                self.send_json({"success": False, "error": rejection_text(e)}, status=status, timer=timer)
+                capture(started, src="web", status="error", req_model=requested_model,
+                        latency_ms=round((time.time() - started) * 1000, 3))
             except Exception as e:
                 print(f"Error: {e}")
+                current_span().fail(e)  # Failed traces are always exported
                 
-                self.send_response(200)
-                self.send_header('Content-type', 'application/json')
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.end_headers()
-                
+                if isinstance(e, AllModelsFailed):
+                    error_text = str(e)
+                elif isinstance(e, (KeyError, ValueError)):
+                    error_text = "Malformed request: expected JSON with 'message' and 'model'"
+                else:
+                    error_text = "Internal error while processing the request"
                 error_data = {
                     "success": False,
-                    "error": str(e)
+                    "error": error_text
                 }
-                self.wfile.write(json.dumps(error_data).encode())
+                self.send_json(error_data, timer=timer)
+                capture(started, src="web", status="error", req_model=requested_model,
+                        latency_ms=round((time.time() - started) * 1000, 3))
         else:
-            self.send_response(404)
-            self.end_headers()
+            # The unread body would be parsed as the next request, so close rather than read an arbitrary upload
+            self.send_body(b'', 'text/plain', status=404, headers={'Connection': 'close'})
     
     def log_message(self, format, *args):
         pass
 
-def main():
+def parse_args():
+    parser = argparse.ArgumentParser(description="Web chat interface with cost tracking for goop proxy")
+    parser.add_argument("--profile", action="store_true",
+                        help="profile the server until Ctrl+C and write collapsed stacks plus a cProfile dump to profiles/")
+    parser.add_argument("--capture", metavar="FILE",
+                        help="record sanitized request traces for benchmarks/replay_traffic.py (.gz to compress)")
+    parser.add_argument("--usage-db", metavar="FILE", default=os.environ.get("GOOP_USAGE_DB"),
+                        help="also record usage in an indexed SQLite database (e.g. chat_costs.db; env GOOP_USAGE_DB)")
+    add_budget_args(parser)
+    add_warm_args(parser)
+    add_trace_args(parser)
+    parser.add_argument("--conversations", metavar="DIR",
+                        help="save every page session's conversation under DIR, so history survives restarts "
+                             "and is shared by all workers (browse with conversation_store.py)")
+    parser.add_argument("--attribution", metavar="FILE",
+                        help="save cost attribution sketches here every minute and on exit (merge with cost_attribution.py)")
+    parser.add_argument("--workers", type=int, default=1, metavar="N",
+                        help="serve from N processes sharing the port (SO_REUSEPORT); the global and daily budgets "
+                             "cover the whole pool, session budgets are enforced by each worker")
+    return parser.parse_args()
+
+def save_attribution_every(path: str, interval: float = ATTRIBUTION_SAVE_INTERVAL):
+    """Snapshot the attribution sketches periodically so a crash loses at most one interval"""
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                attribution.save(path)
+            except OSError as e:
+                print(f"Could not save attribution snapshot: {e}")
+    threading.Thread(target=loop, daemon=True, name="attribution-save").start()
+
+def check_connection() -> bool:
     try:
         print("Testing connection to goop proxy...")
         response = client.chat.completions.create(
@@ -680,15 +1886,26 @@ def main():
             max_tokens=5
         )
         print("Connection to goop proxy working!")
+        return True
     except Exception as e:
         print(f"Cannot connect to goop proxy: {e}")
         print("Make sure your goop proxy is running on port 8080")
-        return
-    
-    port = 8000
-    server = HTTPServer(('0.0.0.0', port), ChatHandler)
-    
-    import socket
+        return False
+
+def reset_client():
+    """Give a forked worker its own HTTP connection pool - sockets inherited from the master can't be shared"""
+    global client
+    client = OpenAI(base_url=str(client.base_url), api_key=client.api_key, http_client=warmer.http_client())
+    health_monitor.client = client
+
+def start_background():
+    warmer.start(client)
+    health_monitor.start()
+    learned = tuner.load_log(cost_tracker.log_file)
+    if learned:
+        print(f"Learned reply lengths from {learned} logged requests")
+
+def print_addresses(port: int):
     hostname = socket.gethostname()
     local_ip = socket.gethostbyname(hostname)
     
@@ -696,12 +1913,94 @@ def main():
     print(f"Local access: http://localhost:{port}")
     print(f"Network access: http://{local_ip}:{port}")
     print("Press Ctrl+C to disconnect")
+
+def serve():
+    if not check_connection():
+        return
+    
+    start_background()
+    server = ThreadingHTTPServer(('0.0.0.0', PORT), ChatHandler)
+    print_addresses(PORT)
     
     try:
         server.serve_forever()
     except KeyboardInterrupt:
         print("\nInterface disconnected")
         server.server_close()
+        print(phase_stats.report())
+        print(warmer.describe())
+
+def start_services(args, worker: Optional[int] = None, counters: Optional[SharedCounters] = None):
+    """Open this process's capture file, usage database, budgets and attribution snapshot"""
+    if args.capture:
+        start_capture(worker_path(args.capture, worker, unique=True) if worker is not None else args.capture)
+    if args.usage_db:
+        usage_store.open_store(args.usage_db)
+    # In a pool the master has already seeded the shared day spend from the log
+    budgets.configure(args, cost_tracker.log_file, counters=counters, seed=counters is None)
+    warmer.configure(args)
+    # Like capture files, each worker (and each restart of one) writes its own trace file
+    tracer.configure(args, "web_chat", worker_path(args.trace, worker, unique=True)
+                     if args.trace and worker is not None else None)
+    if args.conversations:
+        transcripts.store = ConversationStore(args.conversations)
+    if budgets.enabled and worker in (None, 0):
+        print(budgets.describe())
+    path = attribution_path(args, worker)
+    if path:
+        if os.path.exists(path):
+            attribution.merge(load_attribution(path))  # Carry totals across restarts
+        save_attribution_every(path)
+
+def stop_services(args, worker: Optional[int] = None):
+    stop_capture()
+    tracer.close()
+    if transcripts.store is not None:
+        transcripts.store.close()
+    path = attribution_path(args, worker)
+    if path:
+        attribution.save(path)
+
+def attribution_path(args, worker: Optional[int] = None) -> Optional[str]:
+    # Each worker keeps its own sketches; cost_attribution.py merges the files
+    if not args.attribution or worker is None:
+        return args.attribution
+    return worker_path(args.attribution, worker)
+
+def run_worker(args, worker: int, counters):
+    """One --workers process: its own connections and services, serving the shared port"""
+    reset_client()
+    cost_tracker.counters = counters
+    drain.counters = counters
+    start_services(args, worker, counters)
+    try:
+        with profile_run(f"web_chat-w{worker}", enabled=args.profile):
+            start_background()
+            server = ReusePortHTTPServer(('0.0.0.0', PORT), ChatHandler)
+            serve_worker(server, counters, drain)
+    finally:
+        stop_services(args, worker)
+
+def main():
+    args = parse_args()
+    print(f"Logging usage to {cost_tracker.log_file}")
+    cost_tracker.load_historical_costs()  # Before forking, so every worker starts with the baselines
+    load_key(os.path.join(os.path.dirname(cost_tracker.log_file), KEY_FILE))  # Hashes sessions the same in every worker
+    if args.workers > 1:
+        if not check_connection():
+            return
+        print_addresses(PORT)
+        print(f"Running {args.workers} worker processes (SIGHUP restarts them one at a time)")
+        counters = SharedCounters()
+        budgets.configure(args, cost_tracker.log_file, counters=counters)  # Seed today's spend once for the pool
+        WorkerPool(args.workers, lambda worker, counters: run_worker(args, worker, counters), counters).run()
+        return
+    start_services(args)
+    try:
+        with profile_run("web_chat", enabled=args.profile):
+            serve()
+    finally:
+        stop_services(args)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
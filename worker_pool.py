@@ -0,0 +1,452 @@
+# worker_pool.py - Pre-Fork Worker Processes with Shared-Memory Counters
+#
+# Runs N copies of a server in forked worker processes that each bind the
+# same port with SO_REUSEPORT, so the kernel spreads connections across
+# processes and the GIL stops capping a host at one core. Workers publish
+# their cost, token and message totals to a multiprocessing.shared_memory
+# segment - one slot per worker, written only by that worker under a
+# sequence lock - so any worker (or the master) can read correct global
+# totals without a lock shared between processes. The master restarts
+# crashed workers, folds a dead worker's totals into a retired slot so
+# nothing is lost, and on SIGHUP replaces workers one at a time: the new
+# worker starts accepting before the old one stops and drains. Slots also
+# carry each worker's budget spend and holds, so the global and day
+# budgets apply to the whole pool and survive worker restarts
+# Used by: web_chat.py --workers N
+# Dependencies: none (standard library only; Linux/BSD for SO_REUSEPORT and fork)
+
+import fcntl
+import os
+import signal
+import socket
+import struct
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer
+from multiprocessing import shared_memory
+from typing import Callable, Dict, List, Optional
+
+MAX_SLOTS = 64         # Live workers plus replacements starting during a restart
+RETIRED = 0            # Slot 0 holds the totals of workers that have exited; only the master writes it
+HEARTBEAT_INTERVAL = 1.0
+READY_TIMEOUT = 30.0   # A replacement that is not accepting by then is abandoned
+DRAIN_TIMEOUT = 30.0   # In-flight requests a stopping worker waits for
+READ_RETRIES = 1000    # A sequence number still odd after this many tries belongs to a writer that died mid-update
+
+# Slot states
+FREE, STARTING, READY, DRAINING = 0, 1, 2, 3
+STATE_NAMES = {FREE: "free", STARTING: "starting", READY: "ready", DRAINING: "draining"}
+
+HEADER = struct.Struct("<Q")                 # Generation - odd while the master folds a slot
+# seq, pid, worker, state, started, heartbeat, cost, messages, tokens, inflight,
+# budget_spent, budget_reserved, budget_day (date ordinal), budget_day_spent
+SLOT = struct.Struct("<QqqqdddQQqddqd")
+SLOT_FIELDS = ("pid", "worker", "state", "started", "heartbeat", "cost", "messages", "tokens", "inflight",
+               "budget_spent", "budget_reserved", "budget_day", "budget_day_spent")
+BUDGET_RESET = {"budget_spent": 0.0, "budget_reserved": 0.0, "budget_day": 0, "budget_day_spent": 0.0}
+
+class SharedCounters:
+    """Per-worker usage counters in one shared memory segment, summed on read
+
+    Each slot has a single writer, so updates need no cross-process lock; the
+    slot's sequence number is odd while it is being written and readers retry
+    torn reads (a seqlock). Threads within a worker share that worker's lock.
+    """
+
+    def __init__(self, slots: int = MAX_SLOTS):
+        self.slots = slots
+        self.shm = shared_memory.SharedMemory(create=True, size=HEADER.size + slots * SLOT.size)
+        self.shm.buf[:] = bytes(len(self.shm.buf))
+        self.owner = os.getpid()
+        self.slot: Optional[int] = None  # This process's slot, once it is a worker
+        self.lock = threading.Lock()
+        # Budget checks must be atomic across workers. lockf locks belong to the process, so the
+        # inherited descriptor works in every child, and a worker that dies holding it releases it
+        self.budget_file = tempfile.TemporaryFile()
+
+    def _offset(self, slot: int) -> int:
+        return HEADER.size + slot * SLOT.size
+
+    def _read_slot(self, slot: int) -> dict:
+        buf, offset = self.shm.buf, self._offset(slot)
+        for _ in range(READ_RETRIES):
+            values = SLOT.unpack_from(buf, offset)
+            if values[0] % 2 == 0 and struct.unpack_from("<Q", buf, offset)[0] == values[0]:
+                break
+            time.sleep(0)  # A writer is mid-update - let it finish
+        # Still odd: the writer was killed mid-update and never will finish, so take the fields as they are
+        return dict(zip(SLOT_FIELDS, values[1:]))
+
+    def _raw_slot(self, slot: int) -> dict:
+        """Read a slot without the sequence check - only once its writer is known to be dead"""
+        return dict(zip(SLOT_FIELDS, SLOT.unpack_from(self.shm.buf, self._offset(slot))[1:]))
+
+    def _write_slot(self, slot: int, **changes):
+        """Update fields of a slot; the caller must be its only writer"""
+        buf, offset = self.shm.buf, self._offset(slot)
+        values = list(SLOT.unpack_from(buf, offset))
+        odd = values[0] | 1  # Already odd if a killed writer left it so
+        struct.pack_into("<Q", buf, offset, odd)  # Readers will retry
+        for name, value in changes.items():
+            values[1 + SLOT_FIELDS.index(name)] = value
+        values[0] = odd
+        SLOT.pack_into(buf, offset, *values)
+        struct.pack_into("<Q", buf, offset, odd + 1)  # Even again, only after every field is in place
+
+    def claim(self, worker: int) -> int:
+        """Master: reserve a free slot for a worker about to be forked"""
+        for slot in range(1, self.slots):
+            if self._read_slot(slot)["state"] == FREE:
+                self._write_slot(slot, pid=0, worker=worker, state=STARTING, started=time.time(), heartbeat=0.0,
+                                 cost=0.0, messages=0, tokens=0, inflight=0, **BUDGET_RESET)
+                return slot
+        raise RuntimeError(f"All {self.slots - 1} worker slots are in use")
+
+    def retire(self, slot: int):
+        """Master: fold an exited worker's totals into the retired slot and free its slot"""
+        header = HEADER.unpack_from(self.shm.buf, 0)[0]
+        HEADER.pack_into(self.shm.buf, 0, header + 1)  # Readers summing now will start over
+        # The worker has been reaped, so nothing can be mid-write: a SIGKILL during an update leaves the
+        # sequence number odd for good, and waiting for it to turn even would hang the master
+        dead, retired = self._raw_slot(slot), self._raw_slot(RETIRED)
+        # Its budget spend is kept like its counts; its holds died with its requests
+        day, day_spent = retired["budget_day"], retired["budget_day_spent"]
+        if dead["budget_day"] > day:
+            day, day_spent = dead["budget_day"], dead["budget_day_spent"]
+        elif dead["budget_day"] == day:
+            day_spent += dead["budget_day_spent"]
+        self._write_slot(RETIRED, cost=retired["cost"] + dead["cost"], messages=retired["messages"] + dead["messages"],
+                         tokens=retired["tokens"] + dead["tokens"],
+                         budget_spent=retired["budget_spent"] + dead["budget_spent"],
+                         budget_day=day, budget_day_spent=day_spent)
+        self._write_slot(slot, pid=0, state=FREE, cost=0.0, messages=0, tokens=0, inflight=0, heartbeat=0.0,
+                         **BUDGET_RESET)
+        HEADER.pack_into(self.shm.buf, 0, header + 2)
+
+    def seed_day(self, day: int, spent: float):
+        """Master, before forking: count earlier spend (from the cost log) toward day `day`"""
+        self._write_slot(RETIRED, budget_day=day, budget_day_spent=spent)
+
+    # Worker side
+
+    def attach(self, slot: int):
+        """Called in the forked worker: from now on this process alone writes `slot`"""
+        self.slot = slot
+        self._write_slot(slot, pid=os.getpid())
+
+    def set_state(self, state: int):
+        with self.lock:
+            self._write_slot(self.slot, state=state, heartbeat=time.time())
+
+    def heartbeat(self):
+        with self.lock:
+            self._write_slot(self.slot, heartbeat=time.time())
+
+    def add(self, cost: float, tokens: int, messages: int = 1):
+        """Count a request's usage in this worker's slot (no-op outside a pool)"""
+        if self.slot is None:
+            return
+        with self.lock:
+            current = self._read_slot(self.slot)
+            self._write_slot(self.slot, cost=current["cost"] + cost, tokens=current["tokens"] + tokens,
+                             messages=current["messages"] + messages)
+
+    def add_budget(self, day: int, spent: float = 0.0, reserved: float = 0.0):
+        """Count settled budget spend for day `day` and change this worker's budget holds"""
+        if self.slot is None:
+            return
+        with self.lock:
+            current = self._read_slot(self.slot)
+            day_spent = current["budget_day_spent"]
+            if day > current["budget_day"]:
+                day_spent = spent  # A new day
+            elif day == current["budget_day"]:
+                day_spent += spent
+            else:
+                day = current["budget_day"]  # A request held before midnight only counts toward the total
+            self._write_slot(self.slot, budget_spent=current["budget_spent"] + spent,
+                             budget_reserved=max(0.0, current["budget_reserved"] + reserved),
+                             budget_day=day, budget_day_spent=day_spent)
+
+    @contextmanager
+    def budget_lock(self):
+        """Held across a budget check and its hold, so workers cannot jointly overshoot"""
+        fcntl.lockf(self.budget_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.lockf(self.budget_file, fcntl.LOCK_UN)
+
+    def add_inflight(self, delta: int):
+        if self.slot is None:
+            return
+        with self.lock:
+            self._write_slot(self.slot, inflight=self._read_slot(self.slot)["inflight"] + delta)
+
+    # Readers (any process)
+
+    def totals(self) -> dict:
+        """Cost, tokens and messages across every worker, past and present"""
+        return self._stable(self._sum)
+
+    def budget_totals(self, day: int) -> dict:
+        """Budget spend in total and on day `day`, and the holds of running requests, across workers"""
+        return self._stable(lambda: self._sum_budget(day))
+
+    def _stable(self, read: Callable[[], dict]) -> dict:
+        """Run a summing read that no concurrent fold by the master overlapped"""
+        for _ in range(READ_RETRIES):
+            header = HEADER.unpack_from(self.shm.buf, 0)[0]
+            if header % 2:
+                time.sleep(0)
+                continue
+            result = read()
+            if HEADER.unpack_from(self.shm.buf, 0)[0] == header:
+                return result
+        return read()  # The master died mid-fold; a retired worker may be counted twice
+
+    def _sum(self) -> dict:
+        result = {"cost": 0.0, "tokens": 0, "messages": 0}
+        for slot in range(self.slots):
+            values = self._read_slot(slot)
+            for name in result:
+                result[name] += values[name]
+        return result
+
+    def _sum_budget(self, day: int) -> dict:
+        result = {"spent": 0.0, "day_spent": 0.0, "reserved": 0.0}
+        for slot in range(self.slots):
+            values = self._read_slot(slot)
+            result["spent"] += values["budget_spent"]
+            result["reserved"] += values["budget_reserved"]
+            if values["budget_day"] == day:
+                result["day_spent"] += values["budget_day_spent"]
+        return result
+
+    def workers(self) -> List[dict]:
+        """Live workers with their own totals, in-flight requests and heartbeat age"""
+        now = time.time()
+        result = []
+        for slot in range(1, self.slots):
+            values = self._read_slot(slot)
+            if values["state"] == FREE:
+                continue
+            result.append({"worker": values["worker"], "pid": values["pid"], "state": STATE_NAMES[values["state"]],
+                           "uptime_s": round(now - values["started"], 1),
+                           "heartbeat_age_s": round(now - values["heartbeat"], 1) if values["heartbeat"] else None,
+                           "inflight": values["inflight"], "messages": values["messages"],
+                           "tokens": values["tokens"], "cost": round(values["cost"], 9)})
+        return result
+
+    def close(self):
+        self.budget_file.close()
+        self.shm.close()
+        if os.getpid() == self.owner:
+            self.shm.unlink()
+
+class Drain:
+    """Counts in-flight requests so a stopping worker can wait for them to finish"""
+
+    def __init__(self, counters: Optional[SharedCounters] = None):
+        self.counters = counters
+        self.active = 0
+        self.condition = threading.Condition()
+
+    @contextmanager
+    def request(self):
+        with self.condition:
+            self.active += 1
+        if self.counters is not None:
+            self.counters.add_inflight(1)
+        try:
+            yield
+        finally:
+            if self.counters is not None:
+                self.counters.add_inflight(-1)
+            with self.condition:
+                self.active -= 1
+                self.condition.notify_all()
+
+    def wait(self, timeout: float = DRAIN_TIMEOUT) -> bool:
+        """True if every request finished within the timeout"""
+        with self.condition:
+            return self.condition.wait_for(lambda: self.active == 0, timeout)
+
+class ReusePortHTTPServer(ThreadingHTTPServer):
+    """ThreadingHTTPServer whose listening socket can be shared by several processes"""
+
+    def server_bind(self):
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+def worker_path(path: str, worker: int, unique: bool = False) -> str:
+    """Per-worker variant of an output path: attribution.json -> attribution.w2.json
+
+    unique adds the pid, for files a restarted worker must not overwrite.
+    """
+    directory, name = os.path.split(path)
+    stem, dot, rest = name.partition(".")
+    tag = f"w{worker}-{os.getpid()}" if unique else f"w{worker}"
+    return os.path.join(directory, f"{stem}.{tag}{dot}{rest}")
+
+def serve_worker(server: ThreadingHTTPServer, counters: SharedCounters, drain: Drain,
+                 on_stop: Optional[Callable] = None):
+    """Run one worker's server until SIGTERM, then stop accepting and drain in-flight requests"""
+    stopping = threading.Event()
+
+    def stop(signum, frame):
+        if not stopping.is_set():
+            stopping.set()
+            # shutdown() blocks until serve_forever returns, so it can't run on the serving thread
+            threading.Thread(target=server.shutdown, daemon=True).start()
+
+    def beat():
+        while not stopping.wait(HEARTBEAT_INTERVAL):
+            counters.heartbeat()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl-C goes to the master, which stops workers in order
+    threading.Thread(target=beat, daemon=True, name="worker-heartbeat").start()
+    counters.set_state(READY)
+    try:
+        server.serve_forever()
+    finally:
+        counters.set_state(DRAINING)
+        server.server_close()  # New connections now go to the remaining workers
+        if not drain.wait():
+            print(f"Worker {os.getpid()}: {drain.active} requests still running after {DRAIN_TIMEOUT:.0f}s")
+        if on_stop:
+            on_stop()
+
+class WorkerPool:
+    """Master side: fork workers, restart them when they die, roll them on SIGHUP, stop on Ctrl-C
+
+    run_worker(worker_number, counters) is called in each forked child and
+    should serve until SIGTERM; the child exits when it returns.
+    """
+
+    def __init__(self, size: int, run_worker: Callable[[int, SharedCounters], None],
+                 counters: Optional[SharedCounters] = None):
+        self.size = size
+        self.run_worker = run_worker
+        self.counters = counters or SharedCounters()
+        self.pids: Dict[int, tuple] = {}  # pid -> (worker number, slot)
+        self.exited: List[tuple] = []     # (worker number, pid, status) not yet handled by run()
+        self.stopping = False
+        self.restart_requested = False
+        self.restarts = 0
+
+    def spawn(self, worker: int) -> int:
+        slot = self.counters.claim(worker)  # Before forking, so two quick spawns can't pick the same slot
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                self.counters.attach(slot)
+                self.run_worker(worker, self.counters)
+            except BaseException as e:
+                print(f"Worker {worker} failed: {e}")
+                code = 1
+            finally:
+                os._exit(code)  # Never return into the master's code
+        self.pids[pid] = (worker, slot)
+        return pid
+
+    def _reap(self, block: bool = False):
+        """Collect exited workers into self.exited, folding their totals into the retired slot"""
+        while self.pids:
+            try:
+                pid, status = os.waitpid(-1, 0 if block else os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            worker, slot = self.pids.pop(pid, (None, None))
+            if slot is not None:
+                self.counters.retire(slot)
+                self.exited.append((worker, pid, status))
+            if block:
+                break
+
+    def _wait_ready(self, pid: int) -> bool:
+        deadline = time.monotonic() + READY_TIMEOUT
+        slot = self.pids[pid][1]
+        while time.monotonic() < deadline:
+            if self.counters._read_slot(slot)["state"] == READY:
+                return True
+            self._reap()
+            if pid not in self.pids:
+                return False  # Died while starting
+            time.sleep(0.05)
+        return False
+
+    def rolling_restart(self):
+        """Replace every worker, one at a time, without a moment with fewer than `size` accepting"""
+        print(f"Restarting {self.size} workers...")
+        for old_pid, (worker, _) in list(self.pids.items()):
+            if self.stopping:
+                return
+            new_pid = self.spawn(worker)
+            if not self._wait_ready(new_pid):
+                print(f"Replacement for worker {worker} did not start - keeping pid {old_pid}")
+                if new_pid in self.pids:
+                    os.kill(new_pid, signal.SIGKILL)
+                continue
+            os.kill(old_pid, signal.SIGTERM)
+            self.restarts += 1
+        print("Restart complete")
+
+    def stop(self, timeout: float = DRAIN_TIMEOUT + 5):
+        self.stopping = True
+        for pid in list(self.pids):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + timeout
+        while self.pids and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.05)
+        for pid in list(self.pids):
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        while self.pids:
+            self._reap(block=True)
+
+    def run(self):
+        """Start the workers and supervise them until Ctrl-C or SIGTERM"""
+        def request_restart(signum, frame):
+            self.restart_requested = True
+
+        def request_stop(signum, frame):
+            raise KeyboardInterrupt
+
+        signal.signal(signal.SIGHUP, request_restart)
+        signal.signal(signal.SIGTERM, request_stop)
+        for worker in range(self.size):
+            self.spawn(worker)
+        try:
+            while True:
+                if self.restart_requested:
+                    self.restart_requested = False
+                    self.rolling_restart()
+                self._reap()
+                while self.exited:
+                    worker, pid, status = self.exited.pop(0)
+                    if not self.stopping and worker not in {w for w, _ in self.pids.values()}:
+                        print(f"Worker {worker} (pid {pid}) exited with status {status} - restarting it")
+                        self.spawn(worker)
+                        self.restarts += 1
+                time.sleep(0.2)
+        except KeyboardInterrupt:
+            print("\nStopping workers...")
+            self.stop()
+            totals = self.counters.totals()
+            print(f"All workers: {totals['messages']} messages | {totals['tokens']:,} tokens | "
+                  f"${totals['cost']:.6f} | {self.restarts} restarts")
+        finally:
+            self.counters.close()
@@ -0,0 +1,143 @@
+# ws_transport.py - Minimal WebSocket Transport (RFC 6455)
+#
+# Standard-library-only server side framing for web_chat.py: handshake,
+# masked frame decoding, fragmentation, ping/pong and close handling
+# Dependencies: none (standard library only)
+
+import base64
+import hashlib
+import struct
+import threading
+from typing import Optional
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+MAX_MESSAGE_SIZE = 1024 * 1024  # Chat messages are small; refuse anything larger
+
+class WebSocketClosed(Exception):
+    """Raised when the peer closed the connection or broke the protocol"""
+
+def accept_key(key: str) -> str:
+    """Compute Sec-WebSocket-Accept for a client's Sec-WebSocket-Key"""
+    digest = hashlib.sha1((key.strip() + WS_GUID).encode("ascii")).digest()
+    return base64.b64encode(digest).decode("ascii")
+
+def unmask(payload: bytes, mask: bytes) -> bytes:
+    """XOR the payload with the 4-byte mask using big-integer arithmetic (fast in CPython)"""
+    if not payload:
+        return payload
+    length = len(payload)
+    key = (mask * (length // 4 + 1))[:length]
+    return (int.from_bytes(payload, "big") ^ int.from_bytes(key, "big")).to_bytes(length, "big")
+
+def encode_frame(opcode: int, payload: bytes) -> bytes:
+    """Build a single unmasked, final frame (servers never mask)"""
+    length = len(payload)
+    if length < 126:
+        header = struct.pack("!BB", 0x80 | opcode, length)
+    elif length < 65536:
+        header = struct.pack("!BBH", 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+    return header + payload
+
+class WebSocketConnection:
+    """Server side of an upgraded connection, safe to send from several threads"""
+
+    def __init__(self, rfile, wfile):
+        self.rfile = rfile
+        self.wfile = wfile
+        self.send_lock = threading.Lock()
+        self.closed = False
+
+    def _read_exact(self, count: int) -> bytes:
+        data = self.rfile.read(count)
+        if len(data) < count:
+            raise WebSocketClosed("connection dropped")
+        return data
+
+    def _read_frame(self):
+        first, second = self._read_exact(2)
+        fin = bool(first & 0x80)
+        opcode = first & 0x0F
+        length = second & 0x7F
+        if not second & 0x80:
+            self.close(1002)
+            raise WebSocketClosed("client frames must be masked")
+        if length == 126:
+            length = struct.unpack("!H", self._read_exact(2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", self._read_exact(8))[0]
+        if length > MAX_MESSAGE_SIZE:
+            self.close(1009)
+            raise WebSocketClosed("message too large")
+        mask = self._read_exact(4)
+        return fin, opcode, unmask(self._read_exact(length), mask)
+
+    def recv(self) -> Optional[str]:
+        """Return the next text message, answering pings along the way; None on close"""
+        fragments = []
+        message_opcode = None
+        size = 0
+        while True:
+            try:
+                fin, opcode, payload = self._read_frame()
+            except (OSError, ValueError, WebSocketClosed):
+                self.closed = True
+                return None
+
+            if opcode == OP_PING:
+                self._send(OP_PONG, payload)
+                continue
+            if opcode == OP_PONG:
+                continue
+            if opcode == OP_CLOSE:
+                code = struct.unpack("!H", payload[:2])[0] if len(payload) >= 2 else 1000
+                self.close(code if code < 5000 else 1000)
+                return None
+
+            if opcode != OP_CONTINUATION:
+                message_opcode = opcode
+            size += len(payload)
+            if size > MAX_MESSAGE_SIZE:
+                self.close(1009)
+                return None
+            fragments.append(payload)
+            if fin:
+                if message_opcode != OP_TEXT:
+                    # Binary messages are not part of the chat protocol
+                    fragments, size, message_opcode = [], 0, None
+                    continue
+                try:
+                    return b"".join(fragments).decode("utf-8")
+                except UnicodeDecodeError:
+                    self.close(1007)
+                    return None
+
+    def _send(self, opcode: int, payload: bytes) -> bool:
+        with self.send_lock:
+            if self.closed and opcode != OP_CLOSE:
+                return False
+            try:
+                self.wfile.write(encode_frame(opcode, payload))
+                self.wfile.flush()
+                return True
+            except (OSError, ValueError):  # ValueError: handler already closed the file
+                self.closed = True
+                return False
+
+    def send_text(self, text: str) -> bool:
+        """Send a text message; returns False if the connection is gone"""
+        return self._send(OP_TEXT, text.encode("utf-8"))
+
+    def close(self, code: int = 1000):
+        if not self.closed:
+            self._send(OP_CLOSE, struct.pack("!H", code))
+            self.closed = True